@@ -3,18 +3,32 @@ from __future__ import unicode_literals
 
 import logging
 
+import six
+
+from pyforce.bulk import BulkApiError
+from pyforce.bulk import BulkClient
+from pyforce.pool import ConnectionPool
+from pyforce.pyclient import BatchError
 from pyforce.pyclient import Client as PythonClient
 from pyforce.xmlclient import Client as XMLClient
 from pyforce.xmlclient import SessionTimeoutError
 from pyforce.xmlclient import SoapFaultError
 
 __all__ = (
+    'BatchError',
+    'BulkApiError',
+    'BulkClient',
+    'ConnectionPool',
     'PythonClient',
     'SoapFaultError',
     'SessionTimeoutError',
     'XMLClient'
 )
 
+if six.PY3:
+    from pyforce.aioclient import AsyncClient  # NOQA
+    __all__ += ('AsyncClient', )
+
 
 class NullHandler(logging.Handler):
     def emit(self, record):
@@ -0,0 +1,586 @@
+"""
+An asyncio flavour of PythonClient.
+
+The request envelopes come from pyforce.xmlclient and the results are
+extracted exactly as PythonClient does, only the HTTP calls are non-blocking,
+so any number of calls can be in flight on a single event loop. Requires
+Python 3.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import asyncio
+import gzip
+import logging
+import ssl
+import time
+from urllib.parse import urlparse
+
+from pyforce import xmlclient
+from pyforce.compression import CompressionPolicy
+from pyforce.pyclient import _extractDeleted
+from pyforce.pyclient import _extractDescribeGlobal
+from pyforce.pyclient import _extractDescribeSObjects
+from pyforce.pyclient import _extractLoginResult
+from pyforce.pyclient import _extractSaveResults
+from pyforce.pyclient import _extractUpdated
+from pyforce.pyclient import _extractUpsertResults
+from pyforce.pyclient import _extractUserInfo
+from pyforce.pyclient import _prepareSObjects
+from pyforce.pyclient import _queryString
+from pyforce.records import RecordHandler
+from pyforce.xmlclient import _tPartnerNS
+from pyforce.xmlclient import AuthenticatedRequest
+from pyforce.xmlclient import CreateRequest
+from pyforce.xmlclient import DEFAULT_SERVER_URL
+from pyforce.xmlclient import DeleteRequest
+from pyforce.xmlclient import DescribeSObjectsRequest
+from pyforce.xmlclient import GetDeletedRequest
+from pyforce.xmlclient import GetUpdatedRequest
+from pyforce.xmlclient import LoginRequest
+from pyforce.xmlclient import LogoutRequest
+from pyforce.xmlclient import QueryMoreRequest
+from pyforce.xmlclient import QueryRequest
+from pyforce.xmlclient import READ_ONLY_OPERATIONS
+from pyforce.xmlclient import RetrieveRequest
+from pyforce.xmlclient import SearchRequest
+from pyforce.xmlclient import UpdateRequest
+from pyforce.xmlclient import UpsertRequest
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_PER_HOST = 20
+DEFAULT_IDLE_TIMEOUT = 300
+DEFAULT_CONNECT_TIMEOUT = 30
+DEFAULT_READ_TIMEOUT = 300
+
+# connection level failures worth retrying on a fresh connection, like the
+# requests ConnectionErrors retried by SoapEnvelope.post
+_connectionErrors = (OSError, asyncio.IncompleteReadError)
+
+
+class ResponseLostError(ConnectionError):
+    """
+    The connection failed after the whole request was sent, so the server may
+    have acted on it.
+    """
+
+
+class HttpStatusError(Exception):
+    """
+    A response which is neither a result nor a SOAP fault, like a 502 from a
+    proxy or a redirect.
+    """
+
+    def __init__(self, status, reason, url, content=b''):
+        Exception.__init__(
+            self, 'HTTP {0} {1} from {2}'.format(status, reason, url))
+        self.status = status
+        self.reason = reason
+        self.url = url
+        self.content = content
+
+
+class AsyncResponse(object):
+    def __init__(self, status, headers, content, reason=''):
+        self.status = status
+        self.headers = headers
+        self.content = content
+        self.reason = reason
+
+
+class _Connection(object):
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.lastUsed = time.time()
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncConnectionPool(object):
+    """
+    Keep-alive HTTP/1.1 connections for use on one event loop.
+
+    Parameters:
+        maxPerHost - the maximum number of concurrent connections to a host,
+                     further requests wait for a connection to be released.
+        idleTimeout - pooled connections idle for longer than this many
+                      seconds are closed rather than reused.
+        sslContext - the ssl.SSLContext used for https urls.
+        connectTimeout - seconds to wait for a new connection, or None to
+                         wait as long as it takes.
+        readTimeout - seconds to wait for sending a request and for its
+                      response, or None to wait as long as it takes.
+    """
+
+    def __init__(self, maxPerHost=DEFAULT_MAX_PER_HOST,
+                 idleTimeout=DEFAULT_IDLE_TIMEOUT, sslContext=None,
+                 connectTimeout=DEFAULT_CONNECT_TIMEOUT,
+                 readTimeout=DEFAULT_READ_TIMEOUT):
+        self.maxPerHost = maxPerHost
+        self.idleTimeout = idleTimeout
+        self.sslContext = sslContext
+        self.connectTimeout = connectTimeout
+        self.readTimeout = readTimeout
+        self._idle = {}
+        self._slots = {}
+        self._requests = 0
+        self._misses = 0
+
+    def _slot(self, key):
+        if key not in self._slots:
+            self._slots[key] = asyncio.Semaphore(self.maxPerHost)
+        return self._slots[key]
+
+    async def _connect(self, key):
+        scheme, host, port = key
+        idle = self._idle.get(key, [])
+        now = time.time()
+        while idle:
+            conn = idle.pop()
+            if (now - conn.lastUsed <= self.idleTimeout and
+                    not conn.reader.at_eof()):
+                return conn
+            conn.close()
+        if scheme == 'https':
+            context = self.sslContext or ssl.create_default_context()
+            connecting = asyncio.open_connection(
+                host, port, ssl=context, server_hostname=host)
+        else:
+            connecting = asyncio.open_connection(host, port)
+        try:
+            reader, writer = await asyncio.wait_for(connecting,
+                                                    self.connectTimeout)
+        except asyncio.TimeoutError:
+            raise ConnectionError(
+                'Timed out connecting to {0}:{1}'.format(host, port))
+        self._misses += 1
+        return _Connection(reader, writer)
+
+    def _release(self, key, conn):
+        conn.lastUsed = time.time()
+        self._idle.setdefault(key, []).append(conn)
+
+    async def request(self, method, url, body=b'', headers=None):
+        parts = urlparse(url)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        key = (parts.scheme, parts.hostname, port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        lines = ['{0} {1} HTTP/1.1'.format(method, path),
+                 'Host: {0}'.format(parts.netloc),
+                 'Content-Length: {0}'.format(len(body))]
+        for k, v in (headers or {}).items():
+            lines.append('{0}: {1}'.format(k, v))
+        head = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+        self._requests += 1
+        async with self._slot(key):
+            conn = await self._connect(key)
+            try:
+                conn.writer.write(head + body)
+                await asyncio.wait_for(conn.writer.drain(), self.readTimeout)
+            except asyncio.TimeoutError:
+                conn.close()
+                raise ConnectionError('Timed out sending to {0}'.format(url))
+            except BaseException:
+                conn.close()
+                raise
+            try:
+                response, keepAlive = await asyncio.wait_for(
+                    _readResponse(conn.reader), self.readTimeout)
+            except asyncio.TimeoutError:
+                conn.close()
+                raise ResponseLostError(
+                    'Timed out waiting for the response from {0}'.format(url))
+            except _connectionErrors as ex:
+                conn.close()
+                raise ResponseLostError(
+                    'Connection failed after the request was sent: '
+                    '{0!r}'.format(ex))
+            except BaseException:
+                conn.close()
+                raise
+            if keepAlive:
+                self._release(key, conn)
+            else:
+                conn.close()
+        return response
+
+    async def post(self, url, data=b'', headers=None):
+        return await self.request('POST', url, data, headers)
+
+    def stats(self):
+        return dict(
+            requests=self._requests,
+            misses=self._misses,
+            hits=max(self._requests - self._misses, 0),
+            hosts=len([k for k, v in self._idle.items() if v]),
+        )
+
+    async def close(self):
+        for idle in self._idle.values():
+            for conn in idle:
+                conn.close()
+        self._idle = {}
+
+
+async def _readResponse(reader):
+    statusLine = await reader.readline()
+    if not statusLine:
+        raise ConnectionResetError('Connection closed by server')
+    parts = statusLine.decode('latin-1').rstrip('\r\n').split(None, 2)
+    if (len(parts) < 2 or not parts[0].startswith('HTTP/') or
+            not parts[1].isdigit()):
+        raise ValueError('Malformed HTTP status line: {0!r}'.format(
+            statusLine))
+    version, status = parts[:2]
+    reason = parts[2] if len(parts) > 2 else ''
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        k, v = line.decode('latin-1').split(':', 1)
+        headers[k.strip().lower()] = v.strip()
+    keepAlive = (version == 'HTTP/1.1' and
+                 headers.get('connection', '').lower() != 'close')
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if not size:
+                # skip any trailers
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+        content = b''.join(chunks)
+    elif 'content-length' in headers:
+        content = await reader.readexactly(int(headers['content-length']))
+    else:
+        content = await reader.read()
+        keepAlive = False
+    if headers.get('content-encoding', '').lower() == 'gzip':
+        content = gzip.decompress(content)
+    return AsyncResponse(int(status), headers, content, reason), keepAlive
+
+
+async def makeBody(envelope, compression=None):
+    """
+    SoapEnvelope.makeBody, but bodies compression has compressed off the
+    calling thread are compressed in the default executor, rather than
+    holding up the event loop.
+    """
+    compression = compression or xmlclient.defaultCompression
+    data = envelope.makeEnvelope()
+    if not xmlclient.gzipRequest:
+        return data, False
+    if compression.offThread(len(data)):
+        return await asyncio.get_event_loop().run_in_executor(
+            None, compression.compress, data)
+    return compression.compress(data)
+
+
+async def post(envelope, pool, alwaysReturnList=False, compression=None,
+               handler=None):
+    """
+    The asyncio counterpart of SoapEnvelope.post, returns the same xmltramp
+    result for the envelope, or handler once the response is parsed with it.
+
+    Failed connections are retried, but once the request has been sent only
+    READ_ONLY_OPERATIONS are, as sending a create again could duplicate it.
+    Responses other than a result or a SOAP fault raise HttpStatusError.
+    """
+    data, compressed = await makeBody(envelope, compression)
+    headers = envelope.makeHeaders(compressed)
+    max_attempts = 3
+    response = None
+    attempt = 1
+    conn_error = None
+    while response is None and attempt <= max_attempts:
+        try:
+            response = await pool.post(
+                envelope.serverUrl,
+                data=data,
+                headers=headers,
+            )
+        except ResponseLostError as ex:
+            if envelope.operationName not in READ_ONLY_OPERATIONS:
+                raise
+            attempt += 1
+            conn_error = ex
+        except _connectionErrors as ex:
+            attempt += 1
+            conn_error = ex
+    if response is None:
+        raise conn_error
+    # Salesforce sends SOAP faults as 500s with an xml body
+    if (response.status != 200 and
+            'xml' not in response.headers.get('content-type', '')):
+        raise HttpStatusError(response.status, response.reason,
+                              envelope.serverUrl, response.content)
+    return envelope.parseResponse(response.content, alwaysReturnList,
+                                  handler)
+
+
+class AsyncClient(object):
+    """
+    Mirrors PythonClient, with every call a coroutine:
+
+        svc = AsyncClient()
+        await svc.login('username', 'passwordTOKEN')
+        res = await svc.query("SELECT Id FROM Contact")
+        async for page in svc.queryPages("SELECT Id FROM Contact"):
+            ...
+        await svc.close()
+    """
+
+    def __init__(self, serverUrl=None, cacheTypeDescriptions=False,
+                 pool=None, compression=None):
+        self.batchSize = 500
+        self.serverUrl = serverUrl or DEFAULT_SERVER_URL
+        self.pool = pool if pool is not None else AsyncConnectionPool()
+        self.compression = compression or CompressionPolicy()
+        self.sessionId = None
+        self.cacheTypeDescriptions = cacheTypeDescriptions
+        self.__serverUrl = None
+
+    @property
+    def cacheTypeDescriptions(self):
+        return self._typeDescs is not None
+
+    @cacheTypeDescriptions.setter
+    def cacheTypeDescriptions(self, value):
+        if value is True:
+            self._typeDescs = getattr(self, '_typeDescs', None) or {}
+        elif value is False:
+            self._typeDescs = None
+        else:
+            raise TypeError(
+                "cacheTypeDescriptions must be set to either True or False"
+            )
+
+    def flushTypeDescriptionsCache(self):
+        if self.cacheTypeDescriptions:
+            self._typeDescs = {}
+
+    @property
+    def typeDescs(self):
+        return self._typeDescs if self._typeDescs is not None else {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        await self.pool.close()
+
+    def isConnected(self):
+        return self.sessionId is not None
+
+    async def call(self, envelope, alwaysReturnList=False, handler=None):
+        """
+        Post any request envelope from pyforce.xmlclient, returning the
+        xmltramp result like XMLClient does, or handler, a SAX handler the
+        response was parsed with.
+        """
+        return await post(envelope, self.pool, alwaysReturnList,
+                          self.compression, handler)
+
+    async def login(self, username, password):
+        res = await self.call(LoginRequest(self.serverUrl, username, password))
+        self.useSession(str(res[_tPartnerNS.sessionId]),
+                        str(res[_tPartnerNS.serverUrl]))
+        return _extractLoginResult(res)
+
+    def useSession(self, sessionId, serverUrl):
+        self.sessionId = sessionId
+        self.__serverUrl = serverUrl
+
+    async def logout(self):
+        res = await self.call(LogoutRequest(self.__serverUrl, self.sessionId))
+        return res._name == _tPartnerNS.logoutResponse
+
+    async def queryTypesDescriptions(self, types):
+        types = list(types)
+        if types:
+            types_descs = await self.describeSObjects(types)
+        else:
+            types_descs = []
+        return dict(zip(types, types_descs))
+
+    async def _describeTypes(self, types):
+        typeDescs = self.typeDescs
+        new_types = set(types) - set(typeDescs.keys())
+        if new_types:
+            typeDescs.update(await self.queryTypesDescriptions(new_types))
+        return typeDescs
+
+    async def _parseRecords(self, envelope):
+        """
+        Posts envelope, and returns the RecordHandler its response was
+        parsed with, once the types of its records have been described.
+        """
+        handler = await self.call(envelope, handler=RecordHandler(None))
+        handler.finish(await self._describeTypes(handler.newTypes))
+        return handler
+
+    async def query(self, *args, **kw):
+        handler = await self._parseRecords(QueryRequest(
+            self.__serverUrl,
+            self.sessionId,
+            self.batchSize,
+            _queryString(args, kw)
+        ))
+        return handler.queryResult()
+
+    async def queryMore(self, queryLocator):
+        handler = await self._parseRecords(QueryMoreRequest(
+            self.__serverUrl,
+            self.sessionId,
+            self.batchSize,
+            queryLocator
+        ))
+        return handler.queryResult()
+
+    def queryPages(self, *args, **kw):
+        """
+        An async iterator over the QueryRecordSet pages of a query, calling
+        queryMore until the query is done.
+        """
+        return QueryPages(self, args, kw)
+
+    async def search(self, sosl):
+        handler = await self._parseRecords(SearchRequest(
+            self.__serverUrl,
+            self.sessionId,
+            self.batchSize,
+            sosl
+        ))
+        return handler.records
+
+    async def retrieve(self, fields, sObjectType, ids):
+        handler = await self._parseRecords(RetrieveRequest(
+            self.__serverUrl,
+            self.sessionId,
+            fields,
+            sObjectType,
+            ids
+        ))
+        fields = [f.strip() for f in fields.split(',')]
+        return [dict((f, r[f]) for f in fields) if r is not None else None
+                for r in handler.records]
+
+    async def create(self, sObjects):
+        res = await self.call(CreateRequest(
+            self.__serverUrl,
+            self.sessionId,
+            _prepareSObjects(sObjects)
+        ))
+        return _extractSaveResults(res)
+
+    async def update(self, sObjects):
+        res = await self.call(UpdateRequest(
+            self.__serverUrl,
+            self.sessionId,
+            _prepareSObjects(sObjects)
+        ))
+        return _extractSaveResults(res)
+
+    async def upsert(self, externalIdName, sObjects):
+        res = await self.call(UpsertRequest(
+            self.__serverUrl,
+            self.sessionId,
+            externalIdName,
+            _prepareSObjects(sObjects)
+        ))
+        return _extractUpsertResults(res)
+
+    async def delete(self, ids):
+        res = await self.call(DeleteRequest(
+            self.__serverUrl,
+            self.sessionId,
+            ids
+        ))
+        return _extractSaveResults(res)
+
+    async def describeSObjects(self, sObjectTypes):
+        res = await self.call(DescribeSObjectsRequest(
+            self.__serverUrl,
+            self.sessionId,
+            sObjectTypes
+        ))
+        return _extractDescribeSObjects(res)
+
+    async def describeGlobal(self):
+        res = await self.call(AuthenticatedRequest(
+            self.__serverUrl,
+            self.sessionId,
+            "describeGlobal"
+        ))
+        return _extractDescribeGlobal(res)
+
+    async def getServerTimestamp(self):
+        res = await self.call(AuthenticatedRequest(
+            self.__serverUrl,
+            self.sessionId,
+            "getServerTimestamp"
+        ))
+        return str(res[_tPartnerNS.timestamp])
+
+    async def getUserInfo(self):
+        res = await self.call(AuthenticatedRequest(
+            self.__serverUrl,
+            self.sessionId,
+            "getUserInfo"
+        ))
+        return _extractUserInfo(res)
+
+    async def getUpdated(self, sObjectType, start, end):
+        res = await self.call(GetUpdatedRequest(
+            self.__serverUrl,
+            self.sessionId,
+            sObjectType,
+            start,
+            end
+        ))
+        return _extractUpdated(res)
+
+    async def getDeleted(self, sObjectType, start, end):
+        res = await self.call(GetDeletedRequest(
+            self.__serverUrl,
+            self.sessionId,
+            sObjectType,
+            start,
+            end
+        ))
+        return _extractDeleted(res)
+
+
+class QueryPages(object):
+    """Async iterator returned by AsyncClient.queryPages"""
+
+    def __init__(self, client, args, kw):
+        self.client = client
+        self.args = args
+        self.kw = kw
+        self.page = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.page is None:
+            self.page = await self.client.query(*self.args, **self.kw)
+        elif self.page.done:
+            raise StopAsyncIteration
+        else:
+            self.page = await self.client.queryMore(self.page.queryLocator)
+        return self.page
@@ -0,0 +1,174 @@
+"""
+Exports of query results as Arrow record batches and Parquet files, with
+a schema from the describe of the sObject type. Pages of the query are
+converted as they arrive, and written a row group at a time, so an export
+holds about a row group in memory however many rows it has. Needs
+pyarrow, and numpy.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import logging
+
+from pyforce.columns import IntColumn
+from pyforce.soql import exportFields
+from pyforce.soql import selectQuery
+
+try:
+    import numpy
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+_logger = logging.getLogger(__name__)
+
+# rows written to each Parquet row group
+ROW_GROUP_SIZE = 64 * 1024
+
+# the parts of address fields, as Salesforce describes them
+ADDRESS_PARTS = ('street', 'city', 'state', 'stateCode', 'postalCode',
+                 'country', 'countryCode', 'latitude', 'longitude',
+                 'geocodeAccuracy')
+
+
+def _requirePyarrow():
+    if pyarrow is None:
+        raise ImportError('Arrow and Parquet exports need pyarrow')
+
+
+def arrowType(fieldType):
+    """
+    Returns the Arrow type of values of fieldType, a type as describe has
+    it. Types without one of their own are strings.
+    """
+    _requirePyarrow()
+    if fieldType in ('double', 'currency', 'percent'):
+        return pyarrow.float64()
+    if fieldType == 'int':
+        return pyarrow.int64()
+    if fieldType == 'boolean':
+        return pyarrow.bool_()
+    if fieldType == 'date':
+        return pyarrow.date32()
+    if fieldType == 'datetime':
+        # Salesforce times are UTC
+        return pyarrow.timestamp('ms', tz='UTC')
+    if fieldType in ('multipicklist', 'combobox'):
+        return pyarrow.list_(pyarrow.string())
+    if fieldType == 'address':
+        return pyarrow.struct([(p, pyarrow.string()) for p in ADDRESS_PARTS])
+    return pyarrow.string()
+
+
+def arrowSchema(sObject, fields=None):
+    """
+    Returns the Arrow schema of fields, a list of names, of sObject, a
+    description. By default the fields are those of soql.exportFields.
+    """
+    _requirePyarrow()
+    if fields is None:
+        fields = exportFields(sObject)
+    columns = []
+    for name in fields:
+        field = sObject.fields.get(name)
+        if field is None:
+            raise ValueError('{0} has no field {1!r}'.format(
+                sObject.name, name))
+        columns.append(pyarrow.field(name, arrowType(field.type)))
+    return pyarrow.schema(columns)
+
+
+def recordBatch(columns, schema):
+    """
+    Returns a RecordBatch of schema with the columns of columns, a
+    pyforce.columns.ColumnBuilder. Fields it hasn't got are null.
+    """
+    arrays = []
+    for field in schema:
+        column = columns.columns.get(field.name)
+        if column is None:
+            arrays.append(pyarrow.nulls(columns.rows, field.type))
+        elif column.__class__ is IntColumn and column.nulls:
+            # masked, rather than through the floats of toArray
+            mask = numpy.zeros(len(column), dtype=bool)
+            mask[column.nulls] = True
+            values = numpy.frombuffer(column.values, dtype=numpy.int64)
+            arrays.append(pyarrow.array(values, type=field.type, mask=mask))
+        else:
+            arrays.append(pyarrow.array(column.toArray(), type=field.type,
+                                        from_pandas=True))
+    return pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def _export(client, sObjectType, fields, where):
+    # the schema of an export, and the query for it
+    _requirePyarrow()
+    sObject = client.queryTypesDescriptions([sObjectType])[sObjectType]
+    schema = arrowSchema(sObject, fields)
+    return schema, selectQuery(sObjectType, schema.names, where)
+
+
+def _batches(client, schema, soql):
+    for page in client.iterColumnPages(soql):
+        _logger.debug("exporting a page of %d rows", page.rows)
+        yield recordBatch(page, schema)
+
+
+def recordBatches(client, sObjectType, fields=None, where=None):
+    """
+    Yields a RecordBatch of each page of the rows of sObjectType which
+    match where, a SOQL condition, fetching the next page once the caller
+    is done with one.
+
+    Parameters:
+        client - a logged in PythonClient
+        fields - the field names to export, soql.exportFields by default
+    """
+    schema, soql = _export(client, sObjectType, fields, where)
+    return _batches(client, schema, soql)
+
+
+def writeParquet(client, sObjectType, path, fields=None, where=None,
+                 rowGroupSize=ROW_GROUP_SIZE, **kw):
+    """
+    Writes the rows of sObjectType matching where, a SOQL condition, or
+    every row without one, as a Parquet file. Returns the number of rows
+    written.
+
+    Parameters:
+        client - a logged in PythonClient
+        path - a path or a writable binary file object
+        fields - the field names to export, soql.exportFields by default
+        rowGroupSize - the rows in each row group
+        kw - options of pyarrow.parquet.ParquetWriter, e.g. compression
+    """
+    schema, soql = _export(client, sObjectType, fields, where)
+    rows = pendingRows = 0
+    pending = []
+    writer = pyarrow.parquet.ParquetWriter(path, schema, **kw)
+    try:
+        for batch in _batches(client, schema, soql):
+            pending.append(batch)
+            rows += batch.num_rows
+            pendingRows += batch.num_rows
+            if pendingRows >= rowGroupSize:
+                pending = _writeRowGroups(writer, schema, pending,
+                                          rowGroupSize)
+                pendingRows = sum(b.num_rows for b in pending)
+        _writeRowGroups(writer, schema, pending, rowGroupSize, last=True)
+    finally:
+        writer.close()
+    _logger.debug("exported %d rows of %s", rows, sObjectType)
+    return rows
+
+
+def _writeRowGroups(writer, schema, batches, rowGroupSize, last=False):
+    # writes the full row groups of batches, or all of them if they're the
+    # last, and returns the batches of the rows left over
+    table = pyarrow.Table.from_batches(batches, schema)
+    while table.num_rows >= rowGroupSize or (last and table.num_rows):
+        size = min(rowGroupSize, table.num_rows)
+        writer.write_table(table.slice(0, size), row_group_size=size)
+        table = table.slice(size)
+    return table.to_batches()
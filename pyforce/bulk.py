@@ -0,0 +1,403 @@
+"""
+A client for the Bulk API 2.0, which loads and extracts large numbers of
+records as CSV, using the session of a logged in XMLClient or PythonClient.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import csv
+import datetime
+import itertools
+import json
+import logging
+import time
+
+import six
+from six import binary_type
+from six import BytesIO
+from six import StringIO
+from six import text_type
+
+from pyforce.xmlclient import SessionTimeoutError
+
+_logger = logging.getLogger(__name__)
+
+# query jobs need at least 47.0
+DEFAULT_API_VERSION = '47.0'
+DEFAULT_POLL_INTERVAL = 1.0
+DEFAULT_MAX_POLL_INTERVAL = 30.0
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# the cell Bulk API 2.0 takes to set a field to null, empty cells leave
+# fields unchanged
+NULL_VALUE = '#N/A'
+
+INGEST_OPERATIONS = ('insert', 'update', 'upsert', 'delete', 'hardDelete')
+FINISHED_STATES = ('JobComplete', 'Failed', 'Aborted')
+
+
+class BulkApiError(Exception):
+    def __init__(self, errorCode, message, status=None):
+        self.errorCode = errorCode
+        self.message = message
+        self.status = status
+
+    def __str__(self):
+        return repr(self.errorCode) + " " + repr(self.message)
+
+
+class BulkClient(object):
+    """
+    Runs Bulk API 2.0 jobs with the session of client, so it sees a new
+    session whenever the client logs in again. Requests go through the
+    client's connection pool.
+
+    Parameters:
+        client - a logged in XMLClient or PythonClient
+        apiVersion - the REST API version of the jobs endpoints
+        pollInterval - seconds to wait between the first checks on a job,
+                       doubling after each check up to maxPollInterval
+        maxPollInterval - the most seconds to wait between checks
+        timeout - seconds waitForJob waits before giving up, or None to
+                  wait as long as the job takes
+    """
+
+    def __init__(self, client, apiVersion=DEFAULT_API_VERSION,
+                 pollInterval=DEFAULT_POLL_INTERVAL,
+                 maxPollInterval=DEFAULT_MAX_POLL_INTERVAL, timeout=None):
+        self.client = client
+        self.apiVersion = apiVersion
+        self.pollInterval = pollInterval
+        self.maxPollInterval = maxPollInterval
+        self.timeout = timeout
+
+    def _url(self, path):
+        return '{0}/services/data/v{1}/jobs/{2}'.format(
+            self.client.instanceUrl, self.apiVersion, path)
+
+    def _request(self, method, path, data=None, contentType=None,
+                 accept='application/json', **kw):
+        headers = {
+            'Authorization': 'Bearer ' + self.client.sessionId,
+            'Accept': accept,
+        }
+        if contentType is not None:
+            headers['Content-Type'] = contentType
+        response = self.client._getPool().request(
+            method, self._url(path), data=data, headers=headers, **kw)
+        if response.status_code >= 400:
+            try:
+                _raiseError(response)
+            finally:
+                response.close()
+        return response
+
+    def _json(self, method, path, body=None):
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+        response = self._request(method, path, data,
+                                 contentType='application/json; charset=UTF-8')
+        return response.json() if response.content else None
+
+    def _download(self, path, params=None, chunkSize=DEFAULT_CHUNK_SIZE):
+        response = self._request('GET', path, params=params, stream=True,
+                                 accept='text/csv')
+        return response, _closing(response, response.iter_content(chunkSize))
+
+    def createIngestJob(self, sObjectType, operation,
+                        externalIdFieldName=None, lineEnding='LF',
+                        columnDelimiter='COMMA'):
+        """
+        Opens an ingest job and returns its info dict, whose 'id' the other
+        calls take.
+
+        Parameters:
+            sObjectType - the type of record to load, e.g. 'Contact'
+            operation - one of INGEST_OPERATIONS
+            externalIdFieldName - the field upsert matches records on
+        """
+        if operation not in INGEST_OPERATIONS:
+            raise ValueError('unknown operation {0!r}'.format(operation))
+        job = dict(
+            object=sObjectType,
+            operation=operation,
+            contentType='CSV',
+            lineEnding=lineEnding,
+            columnDelimiter=columnDelimiter,
+        )
+        if externalIdFieldName is not None:
+            job['externalIdFieldName'] = externalIdFieldName
+        return self._json('POST', 'ingest/', job)
+
+    def uploadJobData(self, jobId, data, fields=None):
+        """
+        Uploads the records of an open ingest job, streaming them rather
+        than building the whole body in memory. A job takes one upload of
+        up to 100MB.
+
+        Parameters:
+            data - CSV as bytes or text, a file opened for reading, an
+                   iterable of CSV byte strings, or an iterable of dicts.
+                   None values of dicts are written as NULL_VALUE, fields
+                   missing from them as empty cells.
+            fields - the columns to write for dicts, by default the keys of
+                     the first one.
+        """
+        self._request('PUT', 'ingest/{0}/batches'.format(jobId),
+                      _csvBody(data, fields), contentType='text/csv').close()
+
+    def closeJob(self, jobId):
+        """Marks an ingest job's upload as complete, queueing it to run"""
+        return self._json('PATCH', 'ingest/{0}/'.format(jobId),
+                          {'state': 'UploadComplete'})
+
+    def abortJob(self, jobId, query=False):
+        return self._json('PATCH', _jobPath(jobId, query),
+                          {'state': 'Aborted'})
+
+    def deleteJob(self, jobId, query=False):
+        self._request('DELETE', _jobPath(jobId, query)).close()
+
+    def getJob(self, jobId, query=False):
+        """Returns the info dict of an ingest job, or a query job"""
+        return self._json('GET', _jobPath(jobId, query))
+
+    def waitForJob(self, jobId, query=False):
+        """
+        Polls a job until it is complete, failed or aborted, and returns
+        its final info dict. Raises BulkApiError if timeout runs out first.
+        """
+        interval = self.pollInterval
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.time() + self.timeout
+        while True:
+            job = self.getJob(jobId, query)
+            if job['state'] in FINISHED_STATES:
+                return job
+            if deadline is not None and time.time() + interval > deadline:
+                raise BulkApiError('TIMEOUT', 'job {0} is still {1}'.format(
+                    jobId, job['state']))
+            _logger.debug("job %s is %s, checking again in %ss",
+                          jobId, job['state'], interval)
+            time.sleep(interval)
+            interval = min(interval * 2, self.maxPollInterval)
+
+    def ingest(self, sObjectType, operation, data, externalIdFieldName=None,
+               fields=None):
+        """
+        Runs a whole ingest job: opens it, uploads data (see uploadJobData),
+        and waits for it to finish. Returns the final job info dict, which
+        has numberRecordsProcessed and numberRecordsFailed counts; the
+        per-record outcomes are available from getSuccessfulResults,
+        getFailedResults and getUnprocessedRecords.
+        """
+        job = self.createIngestJob(sObjectType, operation,
+                                   externalIdFieldName=externalIdFieldName)
+        try:
+            self.uploadJobData(job['id'], data, fields)
+        except Exception:
+            self.abortJob(job['id'])
+            raise
+        self.closeJob(job['id'])
+        return self.waitForJob(job['id'])
+
+    def getSuccessfulResults(self, jobId, chunkSize=DEFAULT_CHUNK_SIZE):
+        """Returns an iterator over the CSV bytes of the successful records"""
+        return self._download('ingest/{0}/successfulResults/'.format(jobId),
+                              chunkSize=chunkSize)[1]
+
+    def getFailedResults(self, jobId, chunkSize=DEFAULT_CHUNK_SIZE):
+        """Returns an iterator over the CSV bytes of the failed records"""
+        return self._download('ingest/{0}/failedResults/'.format(jobId),
+                              chunkSize=chunkSize)[1]
+
+    def getUnprocessedRecords(self, jobId, chunkSize=DEFAULT_CHUNK_SIZE):
+        """Returns an iterator over the CSV bytes of records never run"""
+        return self._download('ingest/{0}/unprocessedrecords/'.format(jobId),
+                              chunkSize=chunkSize)[1]
+
+    def createQueryJob(self, soql, queryAll=False):
+        """
+        Starts a query job and returns its info dict. With queryAll, deleted
+        and archived records are included.
+        """
+        return self._json('POST', 'query', dict(
+            operation='queryAll' if queryAll else 'query',
+            query=soql,
+            contentType='CSV',
+        ))
+
+    def iterQueryResults(self, jobId, maxRecords=None,
+                         chunkSize=DEFAULT_CHUNK_SIZE):
+        """
+        Yields the results of a completed query job as CSV bytes, fetching
+        one page of up to maxRecords rows at a time. The pages read as a
+        single CSV document, with the header row once.
+        """
+        locator = None
+        while True:
+            params = {}
+            if locator is not None:
+                params['locator'] = locator
+            if maxRecords is not None:
+                params['maxRecords'] = maxRecords
+            response, chunks = self._download(
+                'query/{0}/results'.format(jobId), params, chunkSize)
+            if locator is not None:
+                chunks = _skipLine(chunks)
+            for chunk in chunks:
+                yield chunk
+            locator = response.headers.get('Sforce-Locator')
+            if not locator or locator == 'null':
+                return
+
+    def query(self, soql, queryAll=False, maxRecords=None):
+        """
+        Runs a query job and yields its rows as dicts of text, with empty
+        strings for empty values. Raises BulkApiError if the job fails.
+        """
+        job = self.createQueryJob(soql, queryAll)
+        job = self.waitForJob(job['id'], query=True)
+        if job['state'] != 'JobComplete':
+            raise BulkApiError(job['state'], job.get('errorMessage', ''))
+        chunks = self.iterQueryResults(job['id'], maxRecords)
+        for row in _csvRows(chunks):
+            yield row
+
+
+def _jobPath(jobId, query):
+    return '{0}/{1}'.format('query' if query else 'ingest', jobId)
+
+
+def _raiseError(response):
+    try:
+        errors = response.json()
+    except ValueError:
+        errors = []
+    if isinstance(errors, dict):
+        errors = [errors]
+    if errors:
+        errorCode = errors[0].get('errorCode')
+        message = errors[0].get('message')
+    else:
+        errorCode, message = text_type(response.status_code), response.reason
+    if errorCode == 'INVALID_SESSION_ID':
+        raise SessionTimeoutError(errorCode, message)
+    raise BulkApiError(errorCode, message, response.status_code)
+
+
+def _closing(response, chunks):
+    try:
+        for chunk in chunks:
+            yield chunk
+    finally:
+        response.close()
+
+
+def _splitLines(chunks):
+    # regroup byte chunks into lines, keeping the line endings, joining the
+    # pieces of a line only once its end arrives
+    pending = []
+    for chunk in chunks:
+        if b'\n' not in chunk:
+            pending.append(chunk)
+            continue
+        lines = chunk.split(b'\n')
+        pending.append(lines[0])
+        lines[0] = b''.join(pending)
+        pending = [lines.pop()]
+        for line in lines:
+            yield line + b'\n'
+    pending = b''.join(pending)
+    if pending:
+        yield pending
+
+
+def _skipLine(chunks):
+    # drop everything up to and including the first line ending
+    chunks = iter(chunks)
+    for chunk in chunks:
+        end = chunk.find(b'\n')
+        if end != -1:
+            if end + 1 < len(chunk):
+                yield chunk[end + 1:]
+            break
+    for chunk in chunks:
+        yield chunk
+
+
+def _csvRows(chunks):
+    lines = _splitLines(chunks)
+    if six.PY2:
+        for row in csv.DictReader(lines):
+            yield dict((k.decode('utf-8'), v.decode('utf-8'))
+                       for k, v in row.items())
+    else:
+        for row in csv.DictReader(line.decode('utf-8') for line in lines):
+            yield row
+
+
+def _csvValue(value):
+    if value is None:
+        return NULL_VALUE
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return text_type(value)
+
+
+def csvLine(values):
+    """
+    Returns a line of CSV, as the bulk API reads it, of values encoded in
+    UTF-8. None is written as NULL_VALUE, booleans as true or false and
+    dates and datetimes in ISO format.
+    """
+    values = [_csvValue(v) for v in values]
+    if six.PY2:
+        out = BytesIO()
+        csv.writer(out, lineterminator='\n').writerow(
+            [v.encode('utf-8') for v in values])
+        return out.getvalue()
+    out = StringIO()
+    csv.writer(out, lineterminator='\n').writerow(values)
+    return out.getvalue().encode('utf-8')
+
+
+def _csvBody(data, fields=None):
+    """
+    Turns any of the data uploadJobData accepts into bytes, or a generator
+    of bytes which requests sends chunked.
+    """
+    if isinstance(data, binary_type):
+        return data
+    if isinstance(data, text_type):
+        return data.encode('utf-8')
+    if hasattr(data, 'read'):
+        return _readChunks(data)
+    data = iter(data)
+    try:
+        first = next(data)
+    except StopIteration:
+        return b''
+    data = itertools.chain([first], data)
+    if isinstance(first, dict):
+        return _dictLines(data, fields or list(first.keys()))
+    return (c.encode('utf-8') if isinstance(c, text_type) else c
+            for c in data)
+
+
+def _readChunks(fileobj):
+    while True:
+        chunk = fileobj.read(DEFAULT_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk.encode('utf-8') if isinstance(chunk, text_type) else chunk
+
+
+def _dictLines(records, fields):
+    yield csvLine(fields)
+    for record in records:
+        yield csvLine(record[f] if f in record else '' for f in fields)
@@ -0,0 +1,302 @@
+"""
+Caches for sObject descriptions, which PythonClient needs to marshall
+records and fetches with describeSObjects otherwise.
+
+Entries are keyed by (orgId, apiVersion, sObjectType), with the type name
+in lower case.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from six import text_type
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_SIZE = 500
+
+_defaultCache = None
+_defaultCacheLock = threading.Lock()
+
+_replace = getattr(os, 'replace', os.rename)
+
+
+def describeKey(orgId, apiVersion, sObjectType):
+    return (orgId, apiVersion, sObjectType.lower())
+
+
+class DescribeCache(object):
+    """
+    The interface of describe caches, which PythonClient takes with its
+    describeCache parameter.
+    """
+
+    def get(self, key):
+        """Returns the cached SObject description for key, or None"""
+        raise NotImplementedError
+
+    def set(self, key, sObject):
+        raise NotImplementedError
+
+    def invalidate(self, orgId=None, apiVersion=None, sObjectType=None):
+        """
+        Drops every entry matching all of the given key parts, e.g. all of
+        an org's types after a deployment. With no arguments, drops
+        everything.
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        self.invalidate()
+
+    def getMany(self, keys, load):
+        """
+        Returns a dict of the descriptions for keys. The keys that aren't
+        cached are passed to load, which returns their descriptions in the
+        same order, and those are cached.
+        """
+        found = {}
+        for key in keys:
+            desc = self.get(key)
+            if desc is not None:
+                found[key] = desc
+        missing = [k for k in keys if k not in found]
+        if missing:
+            for key, desc in zip(missing, load(missing)):
+                self.set(key, desc)
+                found[key] = desc
+        return found
+
+
+class MemoryDescribeCache(DescribeCache):
+    """
+    A thread-safe, least recently used cache of descriptions, which any
+    number of clients in a process can share. While one thread describes a
+    type, others asking for it wait for that describe rather than making
+    their own.
+
+    Parameters:
+        maxSize - the number of descriptions kept, evicting the least
+                  recently used beyond that
+        backend - another DescribeCache, e.g. a DiskDescribeCache, tried
+                  before describing types which aren't in memory
+    """
+
+    def __init__(self, maxSize=DEFAULT_MAX_SIZE, backend=None):
+        self.maxSize = maxSize
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._inFlight = {}
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def _touch(self, key):
+        desc = self._entries.pop(key)
+        self._entries[key] = desc
+        return desc
+
+    def _store(self, key, desc):
+        self._entries.pop(key, None)
+        self._entries[key] = desc
+        while len(self._entries) > self.maxSize:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                self._misses += 1
+                return None
+            self._hits += 1
+            return self._touch(key)
+
+    def set(self, key, sObject):
+        with self._lock:
+            self._store(key, sObject)
+
+    def getMany(self, keys, load):
+        found = {}
+        keys = list(keys)
+        while len(found) < len(set(keys)):
+            mine, waits = [], []
+            with self._lock:
+                for key in keys:
+                    if key in found or key in mine:
+                        continue
+                    if key in self._entries:
+                        self._hits += 1
+                        found[key] = self._touch(key)
+                    elif key in self._inFlight:
+                        waits.append(self._inFlight[key])
+                    else:
+                        self._misses += 1
+                        self._inFlight[key] = threading.Event()
+                        mine.append(key)
+            if mine:
+                try:
+                    if self.backend is not None:
+                        loaded = self.backend.getMany(mine, load)
+                    else:
+                        loaded = dict(zip(mine, load(mine)))
+                    with self._lock:
+                        for key in mine:
+                            self._store(key, loaded[key])
+                    found.update(loaded)
+                finally:
+                    with self._lock:
+                        events = [self._inFlight.pop(k) for k in mine]
+                    for event in events:
+                        event.set()
+            # keys another thread was loading are picked up on the next
+            # pass, or loaded by us if that thread failed.
+            for event in waits:
+                event.wait()
+        return found
+
+    def invalidate(self, orgId=None, apiVersion=None, sObjectType=None):
+        if sObjectType is not None:
+            sObjectType = sObjectType.lower()
+        wanted = (orgId, apiVersion, sObjectType)
+        with self._lock:
+            for key in list(self._entries.keys()):
+                if all(w is None or w == k for w, k in zip(wanted, key)):
+                    del self._entries[key]
+        if self.backend is not None:
+            self.backend.invalidate(orgId, apiVersion, sObjectType)
+
+    def stats(self):
+        """
+        Returns a dict of counters for this cache:
+            hits - lookups answered from memory
+            misses - lookups which had to be loaded
+            evictions - descriptions dropped to stay within maxSize
+            size - the number of descriptions held
+        """
+        with self._lock:
+            return dict(
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+                size=len(self._entries),
+            )
+
+
+class DiskDescribeCache(DescribeCache):
+    """
+    Keeps descriptions as JSON files under directory, one per key, which
+    any number of processes can share. Files are replaced atomically, so
+    readers never see a partial write.
+
+    Parameters:
+        directory - where to keep the cache, created if needed
+        ttl - seconds an entry stays fresh, or None to keep entries until
+              they are invalidated
+    """
+
+    def __init__(self, directory, ttl=DEFAULT_TTL):
+        self.directory = directory
+        self.ttl = ttl
+
+    def _path(self, key):
+        names = [_safeName(k) for k in key]
+        return os.path.join(self.directory, *names) + '.json'
+
+    def get(self, key, now=None):
+        path = self._path(key)
+        try:
+            with io.open(path, encoding='utf-8') as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        now = now if now is not None else time.time()
+        if self.ttl is not None and now - entry['cachedAt'] > self.ttl:
+            _logger.debug("describe of %s has expired", key)
+            return None
+        return _sObjectFromDict(entry['describe'])
+
+    def set(self, key, sObject, now=None):
+        path = self._path(key)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # another process got there first
+                if not os.path.isdir(directory):
+                    raise
+        entry = dict(
+            cachedAt=now if now is not None else time.time(),
+            describe=_sObjectToDict(sObject),
+        )
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with io.open(fd, 'w', encoding='utf-8') as f:
+                f.write(text_type(json.dumps(entry, ensure_ascii=False)))
+            _replace(tmp, path)
+        except Exception:
+            os.remove(tmp)
+            raise
+
+    def invalidate(self, orgId=None, apiVersion=None, sObjectType=None):
+        if sObjectType is not None:
+            sObjectType = sObjectType.lower()
+        wanted = (orgId, apiVersion, sObjectType)
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(root, name)
+                parts = os.path.relpath(path, self.directory)[:-5].split(os.sep)
+                if len(parts) != 3:
+                    continue
+                if all(w is None or _safeName(w) == p
+                       for w, p in zip(wanted, parts)):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+
+def getDefaultDescribeCache():
+    """
+    Returns the process-wide MemoryDescribeCache, creating it on first use
+    """
+    global _defaultCache
+    if _defaultCache is None:
+        with _defaultCacheLock:
+            if _defaultCache is None:
+                _defaultCache = MemoryDescribeCache()
+    return _defaultCache
+
+
+def _safeName(part):
+    # the apiVersion is None for server urls it can't be read from
+    return re.sub(r'[^\w.]', '_', text_type(part))
+
+
+def _sObjectToDict(sObject):
+    # leaving out private state, like compiled decoders
+    d = dict((k, v) for k, v in vars(sObject).items() if not k.startswith('_'))
+    d['fields'] = dict((n, vars(f)) for n, f in sObject.fields.items())
+    return d
+
+
+def _sObjectFromDict(d):
+    # imported here, as pyclient uses this module
+    from pyforce.pyclient import Field
+    from pyforce.pyclient import SObject
+    d = dict(d)
+    d['fields'] = dict((n, Field(**f)) for n, f in d['fields'].items())
+    return SObject(**d)
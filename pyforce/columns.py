@@ -0,0 +1,264 @@
+"""
+Columnar query results. A ColumnBuilder takes the fields of each record
+straight from a RecordHandler into a column per field, typed from the
+describe, so no record is made for a row. The columns are handed over as
+NumPy arrays or a pandas DataFrame, which need numpy, or numpy and pandas.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import logging
+from array import array
+from collections import OrderedDict
+
+from pyforce.marshall import doubletypes
+from pyforce.records import _TEXT
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+_logger = logging.getLogger(__name__)
+
+_NAN = float('nan')
+
+
+class Column(object):
+    """
+    The values of a field, in row order, as Python objects. Rows without
+    the field hold None.
+    """
+
+    def __init__(self, name, nulls=0):
+        self.name = name
+        self.values = [None] * nulls
+        self.append = self.values.append
+
+    def __len__(self):
+        return len(self.values)
+
+    def appendNull(self):
+        self.values.append(None)
+
+    def toArray(self):
+        # item by item, as numpy would take lists of the same length, like
+        # multipicklist values, for a second dimension, and look records
+        # up for the array interface
+        values = self.values
+        result = numpy.empty(len(values), dtype=object)
+        for i, v in enumerate(values):
+            result[i] = v
+        return result
+
+
+class DoubleColumn(Column):
+    """
+    double, currency and percent fields, with NaN for nulls. As with the
+    marshallers, text which isn't a number is taken as null.
+    """
+
+    def __init__(self, name, nulls=0):
+        self.name = name
+        self.values = array(str('d'), [_NAN] * nulls)
+        add = self.values.append
+
+        def append(text):
+            try:
+                add(float(text))
+            except ValueError:
+                add(_NAN)
+        self.append = append
+
+    def appendNull(self):
+        self.values.append(_NAN)
+
+    def toArray(self):
+        return numpy.frombuffer(self.values, dtype=numpy.float64).copy()
+
+
+class IntColumn(Column):
+    """
+    int fields, as int64, or float64 with NaN for nulls if there are any,
+    as pandas has it.
+    """
+
+    def __init__(self, name, nulls=0):
+        self.name = name
+        self.values = array(str('q'), [0] * nulls)
+        self.nulls = list(range(nulls))
+        values = self.values
+        add = values.append
+        nulls = self.nulls
+
+        def append(text):
+            try:
+                add(int(text))
+            except ValueError:
+                nulls.append(len(values))
+                add(0)
+        self.append = append
+
+    def appendNull(self):
+        self.nulls.append(len(self.values))
+        self.values.append(0)
+
+    def toArray(self):
+        result = numpy.frombuffer(self.values, dtype=numpy.int64).copy()
+        if self.nulls:
+            result = result.astype(numpy.float64)
+            result[self.nulls] = _NAN
+        return result
+
+
+class BooleanColumn(IntColumn):
+    """boolean fields, as bools, or objects with None for nulls if any"""
+
+    def __init__(self, name, nulls=0):
+        IntColumn.__init__(self, name, nulls)
+        values = self.values
+        add = values.append
+        nulls = self.nulls
+
+        def append(text):
+            if text:
+                add(text == 'true')
+            else:
+                nulls.append(len(values))
+                add(0)
+        self.append = append
+
+    def toArray(self):
+        result = numpy.frombuffer(self.values, dtype=numpy.int64) != 0
+        if self.nulls:
+            result = result.astype(object)
+            result[self.nulls] = None
+        return result
+
+
+class DateColumn(Column):
+    """
+    date fields, as datetime64[D] with NaT for nulls. The text of each
+    value is kept, and parsed by numpy all at once.
+    """
+    unit = 'D'
+    width = len('2000-01-01')
+
+    def __init__(self, name, nulls=0):
+        self.name = name
+        self.values = ['NaT'] * nulls
+        add = self.values.append
+        width = self.width
+
+        def append(text):
+            # like the marshaller, any timezone is ignored, as it's UTC
+            add(text[:width] if text else 'NaT')
+        self.append = append
+
+    def appendNull(self):
+        self.values.append('NaT')
+
+    def toArray(self):
+        return numpy.array(self.values, dtype='datetime64[%s]' % self.unit)
+
+
+class DateTimeColumn(DateColumn):
+    """datetime fields, as UTC datetime64[ms] with NaT for nulls"""
+    unit = 'ms'
+    width = len('2000-01-01T00:00:00.000')
+
+
+# the columns of field types kept in typed buffers, rather than as objects
+COLUMN_TYPES = dict(
+    [(t, DoubleColumn) for t in doubletypes] + [
+        ('int', IntColumn),
+        ('boolean', BooleanColumn),
+        ('date', DateColumn),
+        ('datetime', DateTimeColumn),
+    ])
+
+
+class ColumnBuilder(object):
+    """
+    Collects the fields of the top level records a RecordHandler parses
+    into columns, as its columns parameter, across any number of responses,
+    e.g. every page of a query.
+
+    Fields whose type is in COLUMN_TYPES, and whose values are plain text,
+    go into typed buffers without being marshalled; any others, including
+    nested records and sub-query results, are kept as the values a
+    QueryRecord would have. Columns are in the order fields are first seen.
+    """
+
+    def __init__(self):
+        self.columns = OrderedDict()
+        self.rows = 0
+        # (column append, item index, decoding func or None) steps of
+        # each record decoder seen
+        self._plans = {}
+
+    def addRow(self, type_data, decoder, items):
+        """
+        Adds a record, the items a RecordHandler collected for it, which
+        decoder (see pyforce.records) decodes as a type_data record.
+        """
+        if decoder is None:
+            plan = ()
+        else:
+            plan = self._plans.get(decoder)
+            if plan is None:
+                plan = self._plans[decoder] = self._plan(
+                    type_data, decoder, items)
+        for append, i, func in plan:
+            payload = items[i][3]
+            append(payload if func is None else func(payload))
+        self.rows += 1
+        if len(plan) < len(self.columns):
+            for column in self.columns.values():
+                if len(column) < self.rows:
+                    column.appendNull()
+
+    def _plan(self, type_data, decoder, items):
+        plan = []
+        for i, fname, func in decoder.steps:
+            xsiType, kind = items[i][1], items[i][2]
+            column = self.columns.get(fname)
+            if column is None:
+                columnType = Column
+                if kind is _TEXT:
+                    columnType = COLUMN_TYPES.get(
+                        type_data.fieldType(fname, xsiType), Column)
+                _logger.debug("%s of %s", columnType.__name__, fname)
+                column = self.columns[fname] = columnType(fname, self.rows)
+            if column.__class__ is Column:
+                plan.append((column.append, i, func))
+            elif kind is _TEXT:
+                # typed columns parse the field's text themselves
+                plan.append((column.append, i, None))
+            else:
+                plan.append((_nullFor(column), i, None))
+        return plan
+
+    def toArrays(self):
+        """Returns an OrderedDict of the columns by name, as NumPy arrays"""
+        if numpy is None:
+            raise ImportError('columnar results need numpy')
+        return OrderedDict(
+            (name, column.toArray()) for name, column in self.columns.items())
+
+    def toDataFrame(self):
+        """Returns the columns as a pandas DataFrame"""
+        if pandas is None:
+            raise ImportError('columnar results as a DataFrame need pandas')
+        return pandas.DataFrame(self.toArrays(), columns=list(self.columns))
+
+
+def _nullFor(column):
+    # for a field whose value in some layout can't go in its typed column
+    appendNull = column.appendNull
+    return lambda payload: appendNull()
@@ -0,0 +1,134 @@
+"""
+When and how request bodies are gzipped. Compressing a request costs CPU
+on the client to save bytes on the link, which only pays for bodies of a
+certain size: the envelope of a retrieve or getServerTimestamp call fits
+in a packet either way. Each client has a CompressionPolicy, which keeps
+stats of the bytes it saved and the time it spent, to tune it by.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import gzip
+import threading
+import zlib
+from timeit import default_timer
+
+from six import BytesIO
+
+# bodies smaller than this many bytes are sent uncompressed, about what
+# fits in a single TCP segment
+COMPRESS_THRESHOLD = 1400
+
+# the zlib level, from 1 (fastest) to 9 (smallest). 6 is zlib's default,
+# and compresses SOAP envelopes nearly as well as 9 at a fraction of the CPU
+COMPRESS_LEVEL = 6
+
+
+def gzipBytes(data, level=COMPRESS_LEVEL):
+    buf = BytesIO()
+    with gzip.GzipFile(mode='wb', fileobj=buf, compresslevel=level) as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+class CompressionPolicy(object):
+    """
+    Decides which request bodies are gzipped, and at what level, and keeps
+    stats of what compressing them has cost and saved. Policies are thread
+    safe, and can be shared between clients to pool their stats.
+
+    Parameters:
+        threshold - bodies smaller than this many bytes are sent as they are
+        level - the zlib level, 1 to 9, or 0 not to compress at all
+        offThreadSize - bodies of at least this many bytes are compressed
+                        on another thread by clients which can use the
+                        time meanwhile, i.e. AsyncClient, which keeps its
+                        event loop running. None to always compress inline.
+    """
+
+    def __init__(self, threshold=COMPRESS_THRESHOLD, level=COMPRESS_LEVEL,
+                 offThreadSize=None):
+        if not 0 <= level <= 9:
+            raise ValueError("level must be from 0 to 9, not %r" % level)
+        self.threshold = threshold
+        self.level = level
+        self.offThreadSize = offThreadSize
+        self._lock = threading.Lock()
+        self.resetStats()
+
+    def shouldCompress(self, size):
+        """Whether a body of size bytes is to be gzipped"""
+        return self.level > 0 and size >= self.threshold
+
+    def offThread(self, size):
+        """Whether a body of size bytes is to be gzipped on another thread"""
+        return (self.offThreadSize is not None and
+                self.shouldCompress(size) and size >= self.offThreadSize)
+
+    def compress(self, data):
+        """
+        Returns data, a request body, gzipped or as it is, and whether it
+        was gzipped.
+        """
+        if not self.shouldCompress(len(data)):
+            self._record(len(data), len(data), 0.0, False)
+            return data, False
+        started = default_timer()
+        body = gzipBytes(data, self.level)
+        self._record(len(data), len(body), default_timer() - started, True)
+        return body, True
+
+    def compressStream(self, chunks):
+        """
+        Yields chunks, an iterable of a request body's bytes, gzipped as
+        they come, whatever their size. The request is counted in the stats
+        once the last chunk is compressed.
+        """
+        # wbits of 16 + MAX_WBITS for a gzip header and trailer
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED,
+                                      16 + zlib.MAX_WBITS)
+        size = sent = 0
+        seconds = 0.0
+        for chunk in chunks:
+            started = default_timer()
+            out = compressor.compress(chunk)
+            seconds += default_timer() - started
+            size += len(chunk)
+            sent += len(out)
+            yield out
+        started = default_timer()
+        out = compressor.flush()
+        seconds += default_timer() - started
+        sent += len(out)
+        yield out
+        self._record(size, sent, seconds, True)
+
+    def _record(self, size, sent, seconds, compressed):
+        with self._lock:
+            self._stats['requests'] += 1
+            self._stats['compressed'] += compressed
+            self._stats['bytesIn'] += size
+            self._stats['bytesOut'] += sent
+            self._stats['seconds'] += seconds
+
+    def stats(self):
+        """
+        Returns a dict of the number of requests and of those compressed,
+        their bytes before and after (bytesIn, bytesOut), the bytes saved,
+        the seconds spent compressing, and the bytes saved per second spent.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats['bytesSaved'] = stats['bytesIn'] - stats['bytesOut']
+        stats['bytesSavedPerSecond'] = (
+            stats['bytesSaved'] / stats['seconds'] if stats['seconds'] else 0)
+        return stats
+
+    def resetStats(self):
+        with self._lock:
+            self._stats = dict(requests=0, compressed=0, bytesIn=0,
+                               bytesOut=0, seconds=0.0)
+
+    def __repr__(self):
+        return 'CompressionPolicy(threshold=%r, level=%r, offThreadSize=%r)' % (
+            self.threshold, self.level, self.offThreadSize)
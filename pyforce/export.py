@@ -0,0 +1,479 @@
+"""
+pyforce-export: exports the rows of an sObject type, or of a SOQL query,
+as CSV or JSON lines, optionally gzipped.
+
+Queries can be split into ranges run on several threads at once, and the
+next pages of each are fetched while one is written. With a checkpoint
+file an export which fails can be run again to carry on where it stopped:
+the checkpoint records how far each range got, ordered by Id, and where
+the output file ends for those rows.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import argparse
+import datetime
+import gzip
+import io
+import itertools
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from six import text_type
+from six.moves import queue
+from six.moves.collections_abc import Mapping
+
+from pyforce.bulk import csvLine
+from pyforce.pyclient import Client as PythonClient
+from pyforce.soql import addCondition
+from pyforce.soql import clauses
+from pyforce.soql import exportFields
+from pyforce.soql import literal
+from pyforce.soql import selectFields
+from pyforce.soql import selectQuery
+
+_logger = logging.getLogger(__name__)
+
+# rows written at a time
+CHUNK_ROWS = 2000
+# rows between checkpoints
+CHECKPOINT_ROWS = 50000
+# bytes of output buffered before being compressed and written
+BUFFER_SIZE = 256 * 1024
+# seconds between progress reports
+PROGRESS_INTERVAL = 10.0
+
+FORMATS = ('csv', 'jsonl')
+
+_replace = getattr(os, 'replace', os.rename)
+
+
+def formatValue(value):
+    """
+    Formats value for CSV as Salesforce does, e.g. datetimes in UTC with
+    milliseconds and multi-select picklists joined with ';'.
+    """
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%dT%H:%M:%S') + '.%03dZ' % (
+            value.microsecond // 1000)
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, list):
+        return ';'.join(value)
+    return text_type(value)
+
+
+def _jsonValue(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return formatValue(value)
+    raise TypeError(repr(value))
+
+
+def fieldValue(record, column):
+    """
+    The value of column in record, following dotted names, like
+    Account.Name, through related records. None if there isn't one.
+    """
+    value = record
+    for name in column.split('.'):
+        if not isinstance(value, Mapping):
+            return None
+        value = value.get(name)
+    return value
+
+
+def rowFormatter(columns, format='csv'):
+    """Returns a function of a record giving its row, as bytes"""
+    if format == 'csv':
+        def formatRow(record):
+            return csvLine([formatValue(fieldValue(record, c))
+                            for c in columns])
+    elif format == 'jsonl':
+        def formatRow(record):
+            row = OrderedDict((c, fieldValue(record, c)) for c in columns)
+            line = json.dumps(row, default=_jsonValue, ensure_ascii=False)
+            return (line + '\n').encode('utf-8')
+    else:
+        raise ValueError('unknown format {0!r}'.format(format))
+    return formatRow
+
+
+class Output(object):
+    """
+    A buffered output file, optionally gzipped. Every checkpoint ends a
+    gzip member, so the file can be cut back to a checkpoint and written
+    on from there, and still be one gzip file.
+
+    Parameters:
+        path - the file, or '-' for stdout
+        compress - gzip the output
+        offset - the length to cut an existing file back to, and append
+                 to, or None to write a new file
+    """
+
+    def __init__(self, path, compress=False, offset=None):
+        self.compress = compress
+        if path == '-':
+            self.raw = getattr(sys.stdout, 'buffer', sys.stdout)
+        elif offset is None:
+            self.raw = io.open(path, 'wb')
+        else:
+            self.raw = io.open(path, 'r+b')
+            self.raw.truncate(offset)
+            self.raw.seek(offset)
+        self.path = path
+        self._member = None
+        self._buffer = []
+        self._buffered = 0
+
+    def write(self, data):
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= BUFFER_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        data = b''.join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        if not self.compress:
+            self.raw.write(data)
+            return
+        if self._member is None:
+            self._member = gzip.GzipFile(fileobj=self.raw, mode='wb', mtime=0)
+        self._member.write(data)
+
+    def checkpoint(self):
+        """Writes everything so far, and returns the file's length"""
+        self._flush()
+        if self._member is not None:
+            # closing a member leaves the file it's written to open
+            self._member.close()
+            self._member = None
+        self.raw.flush()
+        if self.path != '-':
+            os.fsync(self.raw.fileno())
+            return self.raw.tell()
+
+    def close(self):
+        self.checkpoint()
+        if self.path != '-':
+            self.raw.close()
+
+
+class Export(object):
+    """
+    Writes the rows of queries, a list of disjoint queries such as the
+    partitions of one, to an Output, on `workers` threads at once.
+
+    Parameters:
+        client - a logged in PythonClient
+        state - a dict of the export: soql, columns, format, compress and
+                partitions, a list of dicts of each query's soql, the Id
+                of its last row written and whether it's done. The dict
+                is saved as the checkpoint.
+        output - an Output
+        checkpoint - the path of a checkpoint file, or None. Its queries
+                     are ordered by Id, so they can carry on from the last
+                     Id written.
+        prefetch - the pages each query fetches ahead (see iterQuery)
+        chunkRows - rows written at a time
+        checkpointRows - rows between checkpoints
+    """
+
+    def __init__(self, client, state, output, checkpoint=None, workers=1,
+                 prefetch=1, chunkRows=CHUNK_ROWS,
+                 checkpointRows=CHECKPOINT_ROWS):
+        self.client = client
+        self.state = state
+        self.output = output
+        self.checkpointPath = checkpoint
+        self.workers = workers
+        self.prefetch = prefetch
+        self.chunkRows = chunkRows
+        self.checkpointRows = checkpointRows
+        self.formatRow = rowFormatter(state['columns'], state['format'])
+        self.rows = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._error = None
+        self._sinceCheckpoint = 0
+        self._started = self._reported = time.time()
+
+    def run(self):
+        """Exports every query not yet done, returning the rows written"""
+        tasks = queue.Queue()
+        for partition in self.state['partitions']:
+            if not partition['done']:
+                tasks.put(partition)
+        workers = [threading.Thread(target=self._work, args=(tasks,))
+                   for _ in range(max(1, min(self.workers, tasks.qsize())))]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        try:
+            try:
+                for worker in workers:
+                    while worker.is_alive():
+                        worker.join(0.5)
+            except BaseException:
+                # e.g. KeyboardInterrupt, leaving the last checkpoint to
+                # resume
+                self._stop.set()
+                raise
+            if self._error is not None:
+                raise self._error
+        finally:
+            # failed exports too, where rows after the checkpoint are cut
+            # off again by the resume
+            with self._lock:
+                self.output.close()
+        if self.checkpointPath is not None and \
+                os.path.exists(self.checkpointPath):
+            os.remove(self.checkpointPath)
+        elapsed = time.time() - self._started
+        _logger.info("exported %d rows in %.1f seconds", self.rows, elapsed)
+        return self.rows
+
+    def _work(self, tasks):
+        while not self._stop.is_set():
+            try:
+                partition = tasks.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                self._export(partition)
+            except Exception as ex:
+                if self._error is None:
+                    self._error = ex
+                self._stop.set()
+                return
+
+    def _export(self, partition):
+        soql = partition['soql']
+        if self.checkpointPath is not None:
+            if partition['lastId'] is not None:
+                soql = addCondition(soql, 'Id > {0}'.format(
+                    literal(partition['lastId'])))
+            soql += ' ORDER BY Id'
+        _logger.debug("exporting %s", soql)
+        records = self.client.iterQuery(soql, self.prefetch)
+        try:
+            while not self._stop.is_set():
+                chunk = list(itertools.islice(records, self.chunkRows))
+                if not chunk:
+                    with self._lock:
+                        partition['done'] = True
+                        self._written(0)
+                    return
+                data = b''.join([self.formatRow(r) for r in chunk])
+                with self._lock:
+                    if self._stop.is_set():
+                        # the output may be closed already
+                        return
+                    self.output.write(data)
+                    partition['lastId'] = chunk[-1].get('Id')
+                    self._written(len(chunk))
+        finally:
+            records.close()
+
+    def _written(self, rows):
+        # with the lock held, once rows are in the output
+        self.rows += rows
+        self._sinceCheckpoint += rows
+        if self.checkpointPath is not None and \
+                self._sinceCheckpoint >= self.checkpointRows:
+            self.saveCheckpoint()
+        now = time.time()
+        if now - self._reported >= PROGRESS_INTERVAL:
+            self._reported = now
+            _logger.info("exported %d rows, %d rows/sec", self.rows,
+                         self.rows / (now - self._started))
+
+    def saveCheckpoint(self):
+        self.state['offset'] = self.output.checkpoint()
+        self._sinceCheckpoint = 0
+        saveCheckpoint(self.checkpointPath, self.state)
+
+
+def saveCheckpoint(path, state):
+    """Replaces the checkpoint at path with state, atomically"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with io.open(fd, 'w', encoding='utf-8') as f:
+            f.write(text_type(json.dumps(state, ensure_ascii=False)))
+        _replace(tmp, path)
+    except Exception:
+        os.remove(tmp)
+        raise
+
+
+def loadCheckpoint(path):
+    with io.open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def exportQuery(client, sObjectOrSoql, fields=None, where=None):
+    """
+    Returns the query for sObjectOrSoql, an sObject type or a query, and
+    its columns. The query of a type selects fields, or its
+    soql.exportFields from describe.
+    """
+    if ' ' in sObjectOrSoql.strip():
+        if fields or where:
+            raise ValueError('fields and where are for sObject types, '
+                             'not queries')
+        return sObjectOrSoql, selectFields(sObjectOrSoql)
+    if fields is None:
+        sObject = client.queryTypesDescriptions(
+            [sObjectOrSoql])[sObjectOrSoql]
+        fields = exportFields(sObject)
+    return selectQuery(sObjectOrSoql, fields, where), list(fields)
+
+
+def export(client, sObjectOrSoql, path, format='csv', compress=False,
+           fields=None, where=None, partitions=1, partitionField='Id',
+           workers=1, prefetch=1, checkpoint=None,
+           checkpointRows=CHECKPOINT_ROWS, chunkRows=CHUNK_ROWS):
+    """
+    Exports sObjectOrSoql, an sObject type or a query, to path, returning
+    the number of rows written. If checkpoint names a file which exists,
+    the export it was saved by carries on. Otherwise the export starts
+    over, and is checkpointed to that file until it's done.
+    """
+    if checkpoint is not None and os.path.exists(checkpoint):
+        state = loadCheckpoint(checkpoint)
+        if state['path'] != path:
+            raise ValueError('{0} is the checkpoint of an export to {1}'
+                             .format(checkpoint, state['path']))
+        _logger.info("resuming the export to %s after %d bytes",
+                     path, state['offset'])
+        output = Output(path, state['compress'], state['offset'])
+    else:
+        if format not in FORMATS:
+            raise ValueError('unknown format {0!r}'.format(format))
+        soql, columns = exportQuery(client, sObjectOrSoql, fields, where)
+        if checkpoint is not None:
+            _checkResumable(soql, columns, path)
+        queries = [soql]
+        if partitions > 1:
+            queries = client.partitionQueries(soql, partitionField,
+                                              partitions)
+        state = dict(
+            path=path, soql=soql, columns=columns, format=format,
+            compress=compress, offset=0,
+            partitions=[dict(soql=q, lastId=None, done=False)
+                        for q in queries],
+        )
+        output = Output(path, compress)
+        if format == 'csv':
+            output.write(csvLine(columns))
+    job = Export(client, state, output, checkpoint=checkpoint,
+                 workers=workers, prefetch=prefetch, chunkRows=chunkRows,
+                 checkpointRows=checkpointRows)
+    if checkpoint is not None:
+        job.saveCheckpoint()
+    return job.run()
+
+
+def _checkResumable(soql, columns, path):
+    if path == '-':
+        raise ValueError("exports to stdout can't be checkpointed")
+    if 'Id' not in columns:
+        raise ValueError('checkpointed exports must select Id')
+    for keyword, text in clauses(soql):
+        if keyword in ('order by', 'group by', 'limit', 'offset'):
+            raise ValueError("can't checkpoint a query with {0}".format(
+                keyword.upper()))
+
+
+def _argumentParser():
+    parser = argparse.ArgumentParser(
+        prog='pyforce-export',
+        description='Exports the rows of an sObject type, or of a SOQL '
+                    'query, as CSV or JSON lines.')
+    parser.add_argument('query', help='an sObject type, or a SOQL query')
+    parser.add_argument('output', help="the file to write, or '-' for "
+                        "stdout. Names ending .jsonl, .gz or .jsonl.gz "
+                        "choose the format and compression.")
+    parser.add_argument('-u', '--username',
+                        default=os.environ.get('SF_USERNAME'),
+                        help='defaults to $SF_USERNAME')
+    parser.add_argument('-p', '--password',
+                        default=os.environ.get('SF_PASSWORD'),
+                        help='with any security token appended, defaults '
+                        'to $SF_PASSWORD')
+    parser.add_argument('--server-url', help='the partner API login URL')
+    parser.add_argument('--fields', help='comma separated fields of an '
+                        'sObject type to export, rather than all of them')
+    parser.add_argument('--where', help='a condition on the rows of an '
+                        'sObject type to export')
+    parser.add_argument('--format', choices=FORMATS)
+    parser.add_argument('--gzip', action='store_true', default=None)
+    parser.add_argument('--partitions', type=int, default=1,
+                        help='split the query into this many ranges')
+    parser.add_argument('--partition-field', default='Id',
+                        help='the indexed field to split ranges over')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='ranges exported at once')
+    parser.add_argument('--prefetch', type=int, default=1,
+                        help='pages of each range fetched ahead')
+    parser.add_argument('--checkpoint', help='a file to checkpoint to, '
+                        'and resume from if it exists')
+    parser.add_argument('--checkpoint-rows', type=int,
+                        default=CHECKPOINT_ROWS)
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help="don't report progress")
+    return parser
+
+
+def main(argv=None, client=None):
+    """
+    The pyforce-export command. Returns its exit status. client, a
+    PythonClient, is logged in rather than a new one.
+    """
+    args = _argumentParser().parse_args(argv)
+    logging.basicConfig(format='%(message)s', stream=sys.stderr,
+                        level=logging.WARNING if args.quiet else logging.INFO)
+    name = args.output[:-3] if args.output.endswith('.gz') else args.output
+    format = args.format or ('jsonl' if name.endswith('.jsonl') else 'csv')
+    compress = args.gzip if args.gzip is not None else \
+        args.output.endswith('.gz')
+    if client is None:
+        client = PythonClient(serverUrl=args.server_url)
+    try:
+        client.login(args.username, args.password)
+        export(client, args.query, args.output, format=format,
+               compress=compress,
+               fields=[f.strip() for f in args.fields.split(',')]
+               if args.fields else None,
+               where=args.where, partitions=args.partitions,
+               partitionField=args.partition_field, workers=args.workers,
+               prefetch=args.prefetch, checkpoint=args.checkpoint,
+               checkpointRows=args.checkpoint_rows)
+    except ValueError as ex:
+        _logger.error("pyforce-export: %s", ex)
+        return 2
+    except Exception as ex:
+        _logger.error("pyforce-export failed: %s", ex)
+        if args.checkpoint:
+            _logger.error("run it again to resume from %s", args.checkpoint)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
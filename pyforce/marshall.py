@@ -1,6 +1,8 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+import base64
+import binascii
 import datetime
 import logging
 import re
@@ -31,6 +33,9 @@ multitypes = ('combobox', 'multipicklist')
 dicttypes = ('address')
 
 _marshallers = dict()
+# text converters of the stock marshallers, used by decoders which already
+# have a field's element or text in hand
+_textConverters = dict()
 
 
 def marshall(fieldtype, fieldname, xml, ns=_tSObjectNS):
@@ -38,18 +43,36 @@ def marshall(fieldtype, fieldname, xml, ns=_tSObjectNS):
     return m(fieldname, xml, ns)
 
 
-def register(fieldtypes, func):
+def register(fieldtypes, func, fromText=None):
+    """
+    Register func(fieldname, xml, ns) as the marshaller of fieldtypes.
+    fromText(text) may be given when the value depends only on the field's
+    text, letting decoders skip looking the field up by name.
+    """
     if not isinstance(fieldtypes, (list, tuple, dict)):
         fieldtypes = [fieldtypes]
     for t in fieldtypes:
         _marshallers[t] = func
+        if fromText is not None:
+            _textConverters[t] = fromText
+        else:
+            _textConverters.pop(t, None)
+
+
+def textConverter(fieldtype):
+    """Returns the fromText function of fieldtype, or None"""
+    return _textConverters.get(fieldtype)
+
+
+def stringFromText(text):
+    return text
 
 
 def stringMarshaller(fieldname, xml, ns):
     return text_type(xml[getattr(ns, fieldname)])
 
 
-register(stringtypes, stringMarshaller)
+register(stringtypes, stringMarshaller, stringFromText)
 
 
 def textMarshaller(fieldname, xml, ns):
@@ -57,52 +80,62 @@ def textMarshaller(fieldname, xml, ns):
     return stringMarshaller(fieldname, xml, ns)
 
 
-register(texttypes, textMarshaller)
+register(texttypes, textMarshaller, stringFromText)
 
 
-def multiMarshaller(fieldname, xml, ns):
-    asString = text_type(xml[getattr(ns, fieldname), ][0])
-    if not asString:
+def multiFromText(text):
+    if not text:
         return []
-    return asString.split(';')
+    return text.split(';')
+
 
+def multiMarshaller(fieldname, xml, ns):
+    return multiFromText(text_type(xml[getattr(ns, fieldname), ][0]))
 
-register(multitypes, multiMarshaller)
+
+register(multitypes, multiMarshaller, multiFromText)
+
+
+def booleanFromText(text):
+    return text == 'true'
 
 
 def booleanMarshaller(fieldname, xml, ns):
     return bool_(xml[getattr(ns, fieldname)])
 
 
-register('boolean', booleanMarshaller)
+register('boolean', booleanMarshaller, booleanFromText)
 
 
-def integerMarshaller(fieldname, xml, ns):
-    strVal = text_type(xml[getattr(ns, fieldname)])
+def integerFromText(text):
     try:
-        i = int(strVal)
-        return i
-    except:
+        return int(text)
+    except ValueError:
         return None
 
 
-register('int', integerMarshaller)
+def integerMarshaller(fieldname, xml, ns):
+    return integerFromText(text_type(xml[getattr(ns, fieldname)]))
 
 
-def doubleMarshaller(fieldname, xml, ns):
-    strVal = text_type(xml[getattr(ns, fieldname)])
+register('int', integerMarshaller, integerFromText)
+
+
+def doubleFromText(text):
     try:
-        i = float(strVal)
-        return i
-    except:
+        return float(text)
+    except ValueError:
         return None
 
 
-register(doubletypes, doubleMarshaller)
+def doubleMarshaller(fieldname, xml, ns):
+    return doubleFromText(text_type(xml[getattr(ns, fieldname)]))
 
 
-def dateMarshaller(fieldname, xml, ns):
-    datestr = text_type(xml[getattr(ns, fieldname)])
+register(doubletypes, doubleMarshaller, doubleFromText)
+
+
+def dateFromText(datestr):
     match = dateregx.match(datestr)
     if match:
         grps = match.groups()
@@ -113,11 +146,14 @@ def dateMarshaller(fieldname, xml, ns):
     return None
 
 
-register('date', dateMarshaller)
+def dateMarshaller(fieldname, xml, ns):
+    return dateFromText(text_type(xml[getattr(ns, fieldname)]))
 
 
-def dateTimeMarshaller(fieldname, xml, ns):
-    datetimestr = text_type(xml[getattr(ns, fieldname)])
+register('date', dateMarshaller, dateFromText)
+
+
+def dateTimeFromText(datetimestr):
     match = datetimeregx.match(datetimestr)
     if match:
         grps = match.groups()
@@ -137,14 +173,52 @@ def dateTimeMarshaller(fieldname, xml, ns):
     return None
 
 
-register('datetime', dateTimeMarshaller)
+def dateTimeMarshaller(fieldname, xml, ns):
+    return dateTimeFromText(text_type(xml[getattr(ns, fieldname)]))
+
+
+register('datetime', dateTimeMarshaller, dateTimeFromText)
 
 
 def base64Marshaller(fieldname, xml, ns):
     return text_type(xml[getattr(ns, fieldname)])
 
 
-register('base64', base64Marshaller)
+register('base64', base64Marshaller, stringFromText)
+
+
+class Base64Writer(object):
+    """
+    Decodes base64 text, written to it in pieces of any size, such as the
+    text of a base64 field as the parser reports it, into a binary file
+    object as it comes, so only a piece of the text is held at a time.
+
+    Parameters:
+        fileobj - a binary file-like object the decoded bytes are written to
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        # how many decoded bytes were written
+        self.size = 0
+        # text left over from the last piece, short of a 4 character group
+        self._pending = ''
+
+    def write(self, text):
+        text = self._pending + ''.join(text.split())
+        end = len(text) - len(text) % 4
+        self._pending = text[end:]
+        if end:
+            data = base64.b64decode(text[:end].encode('ascii'))
+            self.fileobj.write(data)
+            self.size += len(data)
+
+    def close(self):
+        """Checks all the text was decoded. The file object is left open."""
+        if self._pending:
+            raise binascii.Error(
+                'base64 text ends with an incomplete group: %r' %
+                self._pending)
 
 
 def dictMarshaller(fieldname, xml, ns):
@@ -0,0 +1,191 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import logging
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from six.moves.http_cookiejar import DefaultCookiePolicy
+from six.moves.urllib.parse import urlparse
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_PER_HOST = 10
+DEFAULT_MAX_HOSTS = 10
+DEFAULT_IDLE_TIMEOUT = 300
+
+_defaultPool = None
+_defaultPoolLock = threading.Lock()
+
+
+class ConnectionPool(object):
+    """
+    A pool of keep-alive HTTP connections which can be shared by any number
+    of clients, and is used for login as well as authenticated calls.
+
+    Parameters:
+        maxPerHost - the maximum number of connections kept open to a single
+                     host.
+        maxHosts - the number of hosts for which connections are kept.
+        block - when True, callers wait for a free connection once
+                maxPerHost connections to a host are in use, rather than
+                opening a throwaway one.
+        idleTimeout - connections to a host that has not been used for this
+                      many seconds are closed. None disables pruning.
+
+    The pool notices when it is used from a forked child process, and starts
+    over with fresh connections rather than sharing sockets with the parent.
+    """
+
+    def __init__(self, maxPerHost=DEFAULT_MAX_PER_HOST,
+                 maxHosts=DEFAULT_MAX_HOSTS, block=False,
+                 idleTimeout=DEFAULT_IDLE_TIMEOUT):
+        self.maxPerHost = maxPerHost
+        self.maxHosts = maxHosts
+        self.block = block
+        self.idleTimeout = idleTimeout
+        self._lock = threading.RLock()
+        self._session = None
+        self.reset()
+
+    def reset(self):
+        """
+        Drop every pooled connection and start over, without closing sockets
+        which may still be in use by a parent process.
+        """
+        with self._lock:
+            self._pid = os.getpid()
+            self._lastUsed = {}
+            self._requests = 0
+            self._retired = 0
+            self._pruned = 0
+            self._session = self._makeSession()
+
+    def _makeSession(self):
+        session = requests.Session()
+        # clients from different orgs may share the pool, never let them
+        # share cookies.
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(
+            pool_connections=self.maxHosts,
+            pool_maxsize=self.maxPerHost,
+            pool_block=self.block,
+        )
+        adapter.poolmanager.pools.dispose_func = self._retire
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def _retire(self, hostPool):
+        # keep the connection count of pools which are evicted or pruned, so
+        # the miss counter doesn't go backwards.
+        with self._lock:
+            self._retired += hostPool.num_connections
+        hostPool.close()
+
+    def _hostPools(self):
+        adapter = self._session.get_adapter('https://')
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            try:
+                yield key, pools[key]
+            except KeyError:
+                pass
+
+    @property
+    def session(self):
+        """The requests.Session backing this pool, for this process"""
+        if self._pid != os.getpid():
+            _logger.debug("pool used after fork, resetting connections")
+            self.reset()
+        return self._session
+
+    def request(self, method, url, **kw):
+        session = self.session
+        (scheme, host, path, params, query, frag) = urlparse(url)
+        now = time.time()
+        with self._lock:
+            self._requests += 1
+            self._lastUsed[(scheme, host.lower())] = now
+        self.prune(now)
+        return session.request(method, url, **kw)
+
+    def post(self, url, data=None, **kw):
+        return self.request('POST', url, data=data, **kw)
+
+    def get(self, url, **kw):
+        return self.request('GET', url, **kw)
+
+    def prune(self, now=None):
+        """
+        Close the connections of every host which has been idle for longer
+        than idleTimeout. Called automatically on each request.
+        """
+        if self.idleTimeout is None:
+            return
+        now = now if now is not None else time.time()
+        with self._lock:
+            idle = set(
+                k for k, t in self._lastUsed.items()
+                if now - t > self.idleTimeout
+            )
+            if not idle:
+                return
+            pools = self._session.get_adapter('https://').poolmanager.pools
+            for key, hostPool in self._hostPools():
+                port = '' if key.key_port is None else ':%d' % key.key_port
+                for host in (key.key_host, key.key_host + port):
+                    if (key.key_scheme, host) in idle:
+                        del pools[key]
+                        self._pruned += 1
+                        break
+            for k in idle:
+                del self._lastUsed[k]
+
+    def stats(self):
+        """
+        Returns a dict of counters for this pool:
+            requests - the number of requests sent through the pool
+            misses - the number of new connections opened (handshakes)
+            hits - the number of requests which reused a pooled connection
+            pruned - the number of idle hosts whose connections were closed
+            hosts - the number of hosts with pooled connections
+        """
+        with self._lock:
+            misses = self._retired
+            hosts = 0
+            for key, hostPool in self._hostPools():
+                misses += hostPool.num_connections
+                hosts += 1
+            return dict(
+                requests=self._requests,
+                misses=misses,
+                hits=max(self._requests - misses, 0),
+                pruned=self._pruned,
+                hosts=hosts,
+            )
+
+    def close(self):
+        with self._lock:
+            self._session.close()
+            self._lastUsed = {}
+
+
+def getDefaultPool():
+    """Returns the process-wide ConnectionPool, creating it on first use"""
+    global _defaultPool
+    if _defaultPool is None:
+        with _defaultPoolLock:
+            if _defaultPool is None:
+                _defaultPool = ConnectionPool()
+    return _defaultPool
+
+
+def setDefaultPool(pool):
+    """Replace the process-wide ConnectionPool used by new clients"""
+    global _defaultPool
+    with _defaultPoolLock:
+        _defaultPool = pool
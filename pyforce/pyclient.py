@@ -1,15 +1,32 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
-import copy
+import itertools
 import logging
+import threading
+from collections import deque
 from functools import reduce
+from multiprocessing.pool import ThreadPool
 
 from six import string_types
 from six import text_type
+from six.moves import queue
+from six.moves.collections_abc import Mapping
 
+from pyforce.cache import describeKey
+from pyforce.columns import ColumnBuilder
 from pyforce.common import bool_
 from pyforce.marshall import marshall
+# the record classes were defined here, and can still be imported from here
+from pyforce.records import QueryRecord  # NOQA
+from pyforce.records import QueryRecordSet  # NOQA
+from pyforce.records import recordClass
+from pyforce.records import RecordHandler
+from pyforce.soql import addCondition
+from pyforce.soql import boundsQuery
+from pyforce.soql import clauses
+from pyforce.soql import partitionConditions
+from pyforce.soql import splitRange
 from pyforce.xmlclient import _tPartnerNS
 from pyforce.xmlclient import _tSchemaInstanceNS
 from pyforce.xmlclient import _tSObjectNS
@@ -18,40 +35,45 @@ from pyforce.xmltramp import Namespace
 
 
 DEFAULT_FIELD_TYPE = "string"
+# most records create, update, upsert and delete accept in one call
+DML_BATCH_SIZE = 200
+# field types for the xsi:type of values in responses
+XSD_FIELD_TYPES = {
+    'string': 'string',
+    'int': 'int',
+    'long': 'int',
+    'double': 'double',
+    'boolean': 'boolean',
+    'date': 'date',
+    'dateTime': 'datetime',
+    'base64Binary': 'base64',
+    'address': 'address',
+}
 
 _tSchemaNS = Namespace('http://www.w3.org/2001/XMLSchema')
+_xsiType = _tSchemaInstanceNS.type
 _logger = logging.getLogger("pyforce.{0}".format(__name__))
 
 
-class QueryRecord(dict):
-    def __getattr__(self, n):
-        return self[n]
-
-    def __setattr__(self, n, v):
-        self[n] = v
-
-
-class QueryRecordSet(list):
-    def __init__(self, records, done, size, **kw):
-        super(QueryRecordSet, self).__init__(records)
-        self.done = done
-        self.size = size
-        for k, v in kw.items():
-            setattr(self, k, v)
-
-    @property
-    def records(self):
-        return self
+class BatchError(Exception):
+    """
+    Raised by create, update, upsert and delete when some of the batches
+    they sent failed. The other batches were saved, and their results are
+    kept, so that only the failed records need to be sent again.
+
+    Attributes:
+        results - the result of every record, in input order, with None for
+                  each record of a failed batch
+        errors - a (batch, exception) pair for each failed batch, batch
+                 being the list of records it held
+    """
 
-    def __getitem__(self, n):
-        # If string, we can try to return a result attribute
-        if isinstance(n, string_types):
-            try:
-                return getattr(self, n)
-            except AttributeError:
-                raise KeyError("Unknown key/attribute: {}".format(n))
-        # Otherwise, return a list item
-        return super(QueryRecordSet, self).__getitem__(n)
+    def __init__(self, results, errors):
+        Exception.__init__(
+            self, '{0} of the batches failed, the first with: {1!r}'.format(
+                len(errors), errors[0][1]))
+        self.results = results
+        self.errors = errors
 
 
 class SObject(object):
@@ -68,13 +90,78 @@ class SObject(object):
             return marshall(DEFAULT_FIELD_TYPE, fieldname, xml)
         return field.marshall(xml)
 
+    def fieldType(self, fieldname, xsiType=None):
+        field = self.fields.get(fieldname)
+        return field.type if field is not None else DEFAULT_FIELD_TYPE
+
+
+class InferredSObject(object):
+    """
+    Marshalls the fields of an sObject type without describing it, using
+    the xsi:type of each value when the response has one, then the
+    fieldTypes map, and treating anything else as a string.
+
+    fieldTypes maps 'Type.Field' or plain 'Field' names to field types as
+    describe returns them, e.g. {'Contact.Birthdate': 'date'}.
+    """
+
+    def __init__(self, name, fieldTypes=None):
+        self.name = name
+        self.fieldTypes = fieldTypes or {}
+
+    def fieldType(self, fieldname, xsiType=None):
+        if xsiType is not None:
+            fieldType = XSD_FIELD_TYPES.get(xsiType.split(':')[-1])
+            if fieldType is not None:
+                return fieldType
+        fieldType = self.fieldTypes.get(self.name + '.' + fieldname)
+        if fieldType is None:
+            fieldType = self.fieldTypes.get(fieldname, DEFAULT_FIELD_TYPE)
+        return fieldType
+
+    def marshall(self, fieldname, xml):
+        try:
+            xsiType = xml[getattr(_tSObjectNS, fieldname)](
+                _tSchemaInstanceNS.type)
+        except KeyError:
+            xsiType = None
+        return marshall(self.fieldType(fieldname, xsiType), fieldname, xml)
+
 
 class Client(BaseClient):
 
-    def __init__(self, serverUrl=None, cacheTypeDescriptions=False):
-        BaseClient.__init__(self, serverUrl=serverUrl)
+    # describeCache is a pyforce.cache.DescribeCache consulted before any
+    # describeSObjects call made to marshall records, and filled from them,
+    # such as the process-wide getDefaultDescribeCache(). While one is used
+    # cacheTypeDescriptions keeps no copies of its own.
+    # With describeTypes=False records are marshalled without describing
+    # their types at all, see InferredSObject for how fieldTypes is used.
+    # With lazyRecords=True query results hold LazyRecords, which only
+    # marshall the fields that are read. With slottedRecords=True query and
+    # retrieve return records of compact classes generated per type and
+    # field list, see pyforce.records.recordClass. compression is the
+    # pyforce.compression.CompressionPolicy of requests, and with
+    # streamRequests=True DML requests are streamed as they serialize.
+    def __init__(self, serverUrl=None, cacheTypeDescriptions=False,
+                 pool=None, describeCache=None, describeTypes=True,
+                 fieldTypes=None, lazyRecords=False, slottedRecords=False,
+                 compression=None, streamRequests=False):
+        if lazyRecords and slottedRecords:
+            raise ValueError(
+                "lazyRecords and slottedRecords can't be used together")
+        BaseClient.__init__(self, serverUrl=serverUrl, pool=pool,
+                            compression=compression,
+                            streamRequests=streamRequests)
         self._typeDescs = None
         self.cacheTypeDescriptions = cacheTypeDescriptions
+        self.describeCache = describeCache
+        self.describeTypes = describeTypes
+        self.fieldTypes = fieldTypes
+        # the InferredSObject of each type, with the fieldTypes it was made
+        # for, so the decoders compiled for it are reused
+        self._inferredTypes = {}
+        self.lazyRecords = lazyRecords
+        self.slottedRecords = slottedRecords
 
     @property
     def cacheTypeDescriptions(self):
@@ -103,9 +190,14 @@ class Client(BaseClient):
             )
 
     def flushTypeDescriptionsCache(self):
-        """Clears the type descriptions cache, if it's enabled"""
+        """
+        Clears the type descriptions cache, if it's enabled, and the
+        describeCache entries of this session's org
+        """
         if self.cacheTypeDescriptions:
             self._typeDescs = {}
+        if self.describeCache is not None and self.isConnected():
+            self.describeCache.invalidate(self.orgId, self.apiVersion)
 
     @property
     def typeDescs(self):
@@ -119,13 +211,7 @@ class Client(BaseClient):
 
     def login(self, username, passwd):
         res = BaseClient.login(self, username, passwd)
-        data = dict()
-        data['passwordExpired'] = bool_(res[_tPartnerNS.passwordExpired])
-        data['serverUrl'] = text_type(res[_tPartnerNS.serverUrl])
-        data['sessionId'] = text_type(res[_tPartnerNS.sessionId])
-        data['userId'] = text_type(res[_tPartnerNS.userId])
-        data['userInfo'] = _extractUserInfo(res[_tPartnerNS.userInfo])
-        return data
+        return _extractLoginResult(res)
 
     def logout(self):
         res = BaseClient.logout(self)
@@ -137,126 +223,75 @@ class Client(BaseClient):
 
     def describeGlobal(self):
         res = BaseClient.describeGlobal(self)
-        data = dict()
-        data['encoding'] = text_type(res[_tPartnerNS.encoding])
-        data['maxBatchSize'] = int(text_type(res[_tPartnerNS.maxBatchSize]))
-        sobjects = list()
-        for r in res[_tPartnerNS.sobjects, ]:
-            d = dict()
-            d['activateable'] = bool_(r[_tPartnerNS.activateable])
-            d['createable'] = bool_(r[_tPartnerNS.createable])
-            d['custom'] = bool_(r[_tPartnerNS.custom])
-            try:
-                d['customSetting'] = bool_(r[_tPartnerNS.customSetting])
-            except KeyError:
-                pass
-            d['deletable'] = bool_(r[_tPartnerNS.deletable])
-            d['deprecatedAndHidden'] = bool_(
-                r[_tPartnerNS.deprecatedAndHidden]
-            )
-            try:
-                d['feedEnabled'] = bool_(r[_tPartnerNS.feedEnabled])
-            except KeyError:
-                pass
-            d['keyPrefix'] = text_type(r[_tPartnerNS.keyPrefix])
-            d['label'] = text_type(r[_tPartnerNS.label])
-            d['labelPlural'] = text_type(r[_tPartnerNS.labelPlural])
-            d['layoutable'] = bool_(r[_tPartnerNS.layoutable])
-            d['mergeable'] = bool_(r[_tPartnerNS.mergeable])
-            d['name'] = text_type(r[_tPartnerNS.name])
-            d['queryable'] = bool_(r[_tPartnerNS.queryable])
-            d['replicateable'] = bool_(r[_tPartnerNS.replicateable])
-            d['retrieveable'] = bool_(r[_tPartnerNS.retrieveable])
-            d['searchable'] = bool_(r[_tPartnerNS.searchable])
-            d['triggerable'] = bool_(r[_tPartnerNS.triggerable])
-            d['undeletable'] = bool_(r[_tPartnerNS.undeletable])
-            d['updateable'] = bool_(r[_tPartnerNS.updateable])
-            sobjects.append(SObject(**d))
-        data['sobjects'] = sobjects
-        data['types'] = [text_type(t) for t in res[_tPartnerNS.types, ]]
-        if not data['types']:
-            # BBB for code written against API < 17.0
-            data['types'] = [s.name for s in data['sobjects']]
-        return data
+        return _extractDescribeGlobal(res)
 
     def describeSObjects(self, sObjectTypes):
         res = BaseClient.describeSObjects(self, sObjectTypes)
-        if not isinstance(res, (tuple, list)):
-            res = [res]
-        data = list()
-        for r in res:
-            d = dict()
-            d['activateable'] = bool_(r[_tPartnerNS.activateable])
-            rawreldata = r[_tPartnerNS.ChildRelationships, ]
-            relinfo = [_extractChildRelInfo(cr) for cr in rawreldata]
-            d['ChildRelationships'] = relinfo
-            d['createable'] = bool_(r[_tPartnerNS.createable])
-            d['custom'] = bool_(r[_tPartnerNS.custom])
-            try:
-                d['customSetting'] = bool_(r[_tPartnerNS.customSetting])
-            except KeyError:
-                pass
-            d['deletable'] = bool_(r[_tPartnerNS.deletable])
-            d['deprecatedAndHidden'] = bool_(
-                r[_tPartnerNS.deprecatedAndHidden]
-            )
-            try:
-                d['feedEnabled'] = bool_(r[_tPartnerNS.feedEnabled])
-            except KeyError:
-                pass
-            fields = r[_tPartnerNS.fields, ]
-            fields = [_extractFieldInfo(f) for f in fields]
-            field_map = dict()
-            for f in fields:
-                field_map[f.name] = f
-            d['fields'] = field_map
-            d['keyPrefix'] = text_type(r[_tPartnerNS.keyPrefix])
-            d['label'] = text_type(r[_tPartnerNS.label])
-            d['labelPlural'] = text_type(r[_tPartnerNS.labelPlural])
-            d['layoutable'] = bool_(r[_tPartnerNS.layoutable])
-            d['mergeable'] = bool_(r[_tPartnerNS.mergeable])
-            d['name'] = text_type(r[_tPartnerNS.name])
-            d['queryable'] = bool_(r[_tPartnerNS.queryable])
-            d['recordTypeInfos'] = ([_extractRecordTypeInfo(rti) for rti in
-                                     r[_tPartnerNS.recordTypeInfos, ]])
-            d['replicateable'] = bool_(r[_tPartnerNS.replicateable])
-            d['retrieveable'] = bool_(r[_tPartnerNS.retrieveable])
-            d['searchable'] = bool_(r[_tPartnerNS.searchable])
-            try:
-                d['triggerable'] = bool_(r[_tPartnerNS.triggerable])
-            except KeyError:
-                pass
-            d['undeletable'] = bool_(r[_tPartnerNS.undeletable])
-            d['updateable'] = bool_(r[_tPartnerNS.updateable])
-            d['urlDetail'] = text_type(r[_tPartnerNS.urlDetail])
-            d['urlEdit'] = text_type(r[_tPartnerNS.urlEdit])
-            d['urlNew'] = text_type(r[_tPartnerNS.urlNew])
-            data.append(SObject(**d))
-        return data
+        return _extractDescribeSObjects(res)
+
+    def create(self, sObjects, workers=1):
+        """
+        Create one or more records, returning a list of save results.
+
+        Parameters:
+            sObjects - a dict, or any iterable of dicts, each with a 'type'.
+                       Records are sent DML_BATCH_SIZE at a time.
+            workers - how many of those batches to send at once
+        """
+        return self._dispatchBatches(self._create, sObjects, workers)
 
-    def create(self, sObjects):
+    def _create(self, sObjects):
         preparedObjects = _prepareSObjects(sObjects)
         res = BaseClient.create(self, preparedObjects)
-        if not isinstance(res, (tuple, list)):
-            res = [res]
-        data = list()
-        for r in res:
-            d = dict()
-            data.append(d)
-            d['id'] = text_type(r[_tPartnerNS.id])
-            d['success'] = success = bool_(r[_tPartnerNS.success])
-            if not success:
-                d['errors'] = [
-                    _extractError(e)
-                    for e in r[_tPartnerNS.errors, ]
-                ]
-            else:
-                d['errors'] = list()
-        return data
+        return _extractSaveResults(res)
+
+    def _dispatchBatches(self, call, items, workers):
+        """
+        Calls call with DML_BATCH_SIZE items at a time, up to workers calls
+        at once, and returns all their results in input order. If some of
+        the batches fail, the rest are still sent, and a BatchError with
+        the results of all of them is raised.
+        """
+        if isinstance(items, (dict, string_types)):
+            return call(items)
+        batches = _batches(items, DML_BATCH_SIZE)
+        first = next(batches, [])
+        second = next(batches, None)
+        if second is None:
+            return call(first)
+        batches = itertools.chain((first, second), batches)
+
+        def attempt(batch):
+            try:
+                return batch, call(batch), None
+            except Exception as e:
+                return batch, None, e
+
+        pool = None
+        if workers <= 1:
+            outcomes = (attempt(batch) for batch in batches)
+        else:
+            pool = ThreadPool(workers)
+            outcomes = _imapBounded(pool, attempt, batches, workers)
+        results = []
+        errors = []
+        try:
+            for batch, result, error in outcomes:
+                if error is not None:
+                    errors.append((batch, error))
+                    result = [None] * len(batch)
+                results.append(result)
+        finally:
+            if pool is not None:
+                pool.close()
+        results = list(itertools.chain.from_iterable(results))
+        if errors:
+            raise BatchError(results, errors)
+        return results
 
     def convert_leads(self, lead_converts):
-        preparedLeadConverts = _prepareSObjects(lead_converts)
-        del preparedLeadConverts['fieldsToNull']
+        preparedLeadConverts = _prepareSObjects(lead_converts,
+                                                fieldsToNull=False)
         res = BaseClient.convertLeads(self, preparedLeadConverts)
         if not isinstance(res, (tuple, list)):
             res = [res]
@@ -296,15 +331,7 @@ class Client(BaseClient):
             In this situation, sendEmail() will fail with
             NO_MASS_MAIL_PERMISSION.
         """
-        preparedEmails = _prepareSObjects(emails)
-        if isinstance(preparedEmails, dict):
-            # If root element is a dict, then this is a single object not an
-            # array
-            del preparedEmails['fieldsToNull']
-        else:
-            # else this is an array, and each elelment should be prepped.
-            for listitems in preparedEmails:
-                del listitems['fieldsToNull']
+        preparedEmails = _prepareSObjects(emails, fieldsToNull=False)
         res = BaseClient.sendEmail(self, preparedEmails, mass_type)
         if not isinstance(res, (tuple, list)):
             res = [res]
@@ -322,231 +349,332 @@ class Client(BaseClient):
                 d['errors'] = list()
         return data
 
-    def retrieve(self, fields, sObjectType, ids):
-        resultSet = BaseClient.retrieve(self, fields, sObjectType, ids)
-        type_data = self.describeSObjects(sObjectType)[0]
+    def retrieve(self, fields, sObjectType, ids, base64Files=None):
+        """
+        Retrieve records of sObjectType by id, with fields, a comma
+        separated string of field names. The records are in the order of
+        ids, with None for an id that's not found.
 
-        if not isinstance(resultSet, (tuple, list)):
-            if isnil(resultSet):
-                resultSet = list()
-            else:
-                resultSet = [resultSet]
+        Parameters:
+            base64Files - a function of (fieldname, fields) returning a
+                          binary file object each base64 field, such as an
+                          Attachment Body, is decoded into as the response
+                          is parsed, instead of keeping its text in memory.
+                          fields holds the record's fields before it, such
+                          as its type and Id. See RecordHandler.
+        """
+        handler = self._recordHandler(base64Files=base64Files)
+        if base64Files is not None:
+            # the fields to decode are known before the response is parsed
+            handler.typeDescs.update(self._describeTypes([sObjectType]))
+        BaseClient.retrieve(self, fields, sObjectType, ids, handler=handler)
         fields = [f.strip() for f in fields.split(',')]
-        data = list()
-        for result in resultSet:
-            d = dict()
-            data.append(d)
-            for fname in fields:
-                d[fname] = type_data.marshall(fname, result)
-        return data
+        if self.slottedRecords:
+            return [_projectRecord(r, fields) if r is not None else None
+                    for r in handler.records]
+        return [dict((f, r[f]) for f in fields) if r is not None else None
+                for r in handler.records]
+
+    def update(self, sObjects, workers=1):
+        """
+        Update one or more records, returning a list of save results.
+
+        Parameters:
+            sObjects - a dict, or any iterable of dicts, each with a 'type'
+                       and 'Id'. Records are sent DML_BATCH_SIZE at a time.
+            workers - how many of those batches to send at once
+        """
+        return self._dispatchBatches(self._update, sObjects, workers)
 
-    def update(self, sObjects):
+    def _update(self, sObjects):
         preparedObjects = _prepareSObjects(sObjects)
         res = BaseClient.update(self, preparedObjects)
-        if not isinstance(res, (tuple, list)):
-            res = [res]
-        data = list()
-        for r in res:
-            d = dict()
-            data.append(d)
-            d['id'] = text_type(r[_tPartnerNS.id])
-            d['success'] = success = bool_(r[_tPartnerNS.success])
-            if not success:
-                d['errors'] = [
-                    _extractError(e)
-                    for e in r[_tPartnerNS.errors, ]
-                ]
-            else:
-                d['errors'] = list()
-        return data
+        return _extractSaveResults(res)
 
     def queryTypesDescriptions(self, types):
         """
         Given a list of types, construct a dictionary such that
         each key is a type, and each value is the corresponding sObject
-        for that type.
+        for that type. Descriptions in the describeCache are used rather
+        than describing those types again.
         """
         types = list(types)
-        if types:
-            types_descs = self.describeSObjects(types)
-        else:
-            types_descs = []
-        return dict(map(lambda t, d: (t, d), types, types_descs))
-
-    def _extractRecord(self, r, typeDescs):
-        record = QueryRecord()
-        if r:
-            row_type = text_type(r[_tSObjectNS.type])
-            _logger.debug("row type: {0}".format(row_type))
-            type_data = typeDescs[row_type]
-            _logger.debug("type data: {0}".format(type_data))
-            for field in r:
-                fname = text_type(field._name[1])
-                if isObject(field):
-                    record[fname] = self._extractRecord(
-                        r[field._name, ][0], typeDescs
-                    )
-                elif isQueryResult(field):
-                    record[fname] = QueryRecordSet(
-                        records=[self._extractRecord(rec, typeDescs) for rec
-                                 in field[_tPartnerNS.records, ]],
-                        done=field[_tPartnerNS.done],
-                        size=int(text_type(field[_tPartnerNS.size]))
-                    )
-                else:
-                    record[fname] = type_data.marshall(fname, r)
-        return record
-
-    def query(self, *args, **kw):
-        typeDescs = self.typeDescs
-
-        if len(args) == 1:  # full query string
-            queryString = args[0]
-        elif len(args) == 2:  # BBB: fields, sObjectType
-            queryString = 'select %s from %s' % (args[0], args[1])
-            if 'conditionalExpression' in kw:  # BBB: fields, sObjectType,
-                # conditionExpression as kwarg
-                queryString += ' where %s' % (kw['conditionalExpression'])
-        elif len(args) == 3:  # BBB: fields, sObjectType, conditionExpression
-            # as positional arg
-            whereClause = args[2] and (' where %s' % args[2]) or ''
-            queryString = 'select %s from %s%s' % (
-                args[0],
-                args[1],
-                whereClause,
-            )
-        else:
-            raise RuntimeError("Wrong number of arguments to query method.")
-
-        res = BaseClient.query(self, queryString)
-        # calculate the union of the sets of record types from each record
-        types = reduce(
-            lambda a, b: a | b,
-            [
-                getRecordTypes(r)
-                for r in res[_tPartnerNS.records, ]
-            ],
-            set(),
+        if self.describeCache is None:
+            types_descs = self.describeSObjects(types) if types else []
+            return dict(zip(types, types_descs))
+        keys = dict(
+            (t, describeKey(self.orgId, self.apiVersion, t)) for t in types)
+        names = dict((k, t) for t, k in keys.items())
+        found = self.describeCache.getMany(
+            list(names.keys()),
+            lambda missing: self.describeSObjects([names[k] for k in missing]),
         )
-        new_types = types - set(typeDescs.keys())
+        return dict((t, found[k]) for t, k in keys.items())
+
+    def _describeTypes(self, types):
+        if not self.describeTypes:
+            return dict((t, self._inferredType(t)) for t in types)
+        if self.describeCache is not None:
+            # which is bounded, unlike _typeDescs
+            return self.queryTypesDescriptions(set(types))
+        typeDescs = self.typeDescs
+        new_types = set(types) - set(typeDescs.keys())
         if new_types:
             typeDescs.update(self.queryTypesDescriptions(new_types))
-        data = QueryRecordSet(
-            records=[
-                self._extractRecord(r, typeDescs)
-                for r in res[_tPartnerNS.records, ]
-            ],
-            done=bool_(res[_tPartnerNS.done]),
-            size=int(text_type(res[_tPartnerNS.size])),
-            queryLocator=text_type(res[_tPartnerNS.queryLocator]),
-        )
-        return data
+        return typeDescs
+
+    def _inferredType(self, sObjectType):
+        fieldTypes = tuple(sorted((self.fieldTypes or {}).items()))
+        cached = self._inferredTypes.get(sObjectType)
+        if cached is None or cached[0] != fieldTypes:
+            cached = (fieldTypes,
+                      InferredSObject(sObjectType, dict(fieldTypes)))
+            self._inferredTypes[sObjectType] = cached
+        return cached[1]
+
+    def _recordHandler(self, **kw):
+        """
+        A RecordHandler parsing records straight from a response, which
+        describes their types as it comes across them.
+        """
+        kw.setdefault('lazy', self.lazyRecords)
+        kw.setdefault('slotted', self.slottedRecords)
+        return RecordHandler(self._describeTypes, **kw)
+
+    def query(self, *args, **kw):
+        queryString = _queryString(args, kw)
+        handler = self._recordHandler()
+        BaseClient.query(self, queryString, handler=handler)
+        return handler.queryResult()
 
     def queryMore(self, queryLocator):
-        typeDescs = self.typeDescs
+        handler = self._recordHandler()
+        BaseClient.queryMore(self, queryLocator, handler=handler)
+        return handler.queryResult()
 
-        locator = queryLocator
-        res = BaseClient.queryMore(self, locator)
-        # calculate the union of the sets of record types from each record
-        types = reduce(lambda a, b: a | b, [getRecordTypes(r) for r in
-                                            res[_tPartnerNS.records, ]], set())
-        new_types = types - set(typeDescs.keys())
-        if new_types:
-            typeDescs.update(self.queryTypesDescriptions(new_types))
-        data = QueryRecordSet(
-            records=[self._extractRecord(r, typeDescs) for r in
-                     res[_tPartnerNS.records, ]],
-            done=bool_(res[_tPartnerNS.done]),
-            size=int(text_type(res[_tPartnerNS.size])),
-            queryLocator=text_type(res[_tPartnerNS.queryLocator])
+    def queryArrays(self, soql):
+        """
+        Returns the records of a query, across all of its pages, as an
+        OrderedDict of NumPy arrays by field name (see pyforce.columns).
+        Needs numpy.
+        """
+        return self._queryColumns(soql).toArrays()
+
+    def queryDataFrame(self, soql):
+        """
+        Returns the records of a query, across all of its pages, as a
+        pandas DataFrame with a column per field (see pyforce.columns).
+        Needs numpy and pandas.
+        """
+        return self._queryColumns(soql).toDataFrame()
+
+    def _queryColumns(self, soql):
+        columns = ColumnBuilder()
+        for page in self.iterColumnPages(soql, columns):
+            pass
+        return columns
+
+    def iterColumnPages(self, soql, columns=None):
+        """
+        Yields a ColumnBuilder of each page of a query in turn, fetching
+        the next page once the caller is done with one. Given columns, a
+        ColumnBuilder, every page is added to it instead.
+        """
+        handler = None
+        while handler is None or not handler.done:
+            page = columns if columns is not None else ColumnBuilder()
+            nextHandler = self._recordHandler(columns=page)
+            if handler is None:
+                BaseClient.query(self, soql, handler=nextHandler)
+            else:
+                # the types are described once for all of the pages
+                nextHandler.typeDescs = handler.typeDescs
+                BaseClient.queryMore(self, handler.queryLocator,
+                                     handler=nextHandler)
+            handler = nextHandler
+            yield page
+
+    def iterQuery(self, soql, prefetch=1):
+        """
+        Yields the records of a query one at a time, across all of its pages.
+
+        While the caller works through a page, the next `prefetch` pages are
+        fetched with queryMore on a background thread, so about prefetch + 1
+        pages are held in memory at once. With prefetch=0 every queryMore
+        happens in the calling thread, as the previous page runs out.
+        """
+        page = self.query(soql)
+        if prefetch < 1 or page.done:
+            while True:
+                for record in page:
+                    yield record
+                if page.done:
+                    return
+                page = self.queryMore(page.queryLocator)
+
+        pages = queue.Queue(maxsize=prefetch)
+        stop = threading.Event()
+        fetcher = threading.Thread(
+            target=self._prefetchPages,
+            args=(page.queryLocator, pages, stop),
         )
-        return data
+        fetcher.daemon = True
+        fetcher.start()
+        try:
+            while True:
+                for record in page:
+                    yield record
+                if page.done:
+                    return
+                page, error = pages.get()
+                if error is not None:
+                    raise error
+        finally:
+            stop.set()
+
+    def _prefetchPages(self, queryLocator, pages, stop):
+        # runs on the iterQuery background thread, queueing (page, error)
+        # pairs until the query is done or the consumer goes away.
+        while not stop.is_set():
+            try:
+                page, error = self.queryMore(queryLocator), None
+            except Exception as ex:
+                page, error = None, ex
+            if not _putPage(pages, (page, error), stop):
+                return
+            if error is not None or page.done:
+                return
+            queryLocator = page.queryLocator
+
+    def queryPartitioned(self, soql, field='Id', partitions=8, workers=4):
+        """
+        Yields the records of a query, running it as `partitions` disjoint
+        range queries over `field` on `workers` threads at once.
+
+        field should be indexed and sortable, e.g. Id, CreatedDate or
+        SystemModstamp. Its lowest and highest values are looked up first,
+        and the range between them split evenly. Records come back in no
+        particular order, so the query can't have ORDER BY, GROUP BY, LIMIT
+        or OFFSET clauses.
+        """
+        queries = self.partitionQueries(soql, field, partitions)
+        if len(queries) == 1:
+            for record in self.iterQuery(soql):
+                yield record
+            return
+
+        tasks = queue.Queue()
+        for query in queries:
+            tasks.put(query)
+        workers = max(1, min(workers, len(queries)))
+        pages = queue.Queue(maxsize=workers)
+        stop = threading.Event()
+        for _ in range(workers):
+            worker = threading.Thread(
+                target=self._queryPartitions,
+                args=(tasks, pages, stop),
+            )
+            worker.daemon = True
+            worker.start()
+        try:
+            running = workers
+            while running:
+                page, error = pages.get()
+                if error is not None:
+                    raise error
+                if page is None:
+                    running -= 1
+                    continue
+                for record in page:
+                    yield record
+        finally:
+            stop.set()
+
+    def partitionQueries(self, soql, field='Id', partitions=8):
+        """
+        Returns up to `partitions` disjoint range queries over `field`,
+        which together match the rows of soql, or just soql if there's no
+        range to split. See queryPartitioned.
+        """
+        for keyword, text in clauses(soql):
+            if keyword in ('order by', 'group by', 'limit', 'offset'):
+                raise ValueError(
+                    "can't partition a query with {0}".format(keyword.upper()))
+        low = self.query(boundsQuery(soql, field))
+        high = self.query(boundsQuery(soql, field, descending=True))
+        conditions = []
+        if len(low) and len(high):
+            boundaries = splitRange(low[0][field], high[0][field], partitions)
+            conditions = partitionConditions(field, boundaries)
+        if not conditions:
+            return [soql]
+        return [addCondition(soql, c) for c in conditions]
+
+    def _queryPartitions(self, tasks, pages, stop):
+        # runs on a queryPartitioned worker thread, running whole
+        # query/queryMore chains until there are no partitions left, then
+        # queueing (None, None) to say it's finished.
+        while not stop.is_set():
+            try:
+                soql = tasks.get_nowait()
+            except queue.Empty:
+                _putPage(pages, (None, None), stop)
+                return
+            try:
+                page = self.query(soql)
+                while _putPage(pages, (page, None), stop) and not page.done:
+                    page = self.queryMore(page.queryLocator)
+            except Exception as ex:
+                _putPage(pages, (None, ex), stop)
+                return
 
     def search(self, sosl):
-        typeDescs = self.typeDescs
-        res = BaseClient.search(self, sosl)
-
-        # calculate the union of the sets of record types from each record
-        if len(res):
-            types = reduce(
-                lambda a, b: a | b,
-                [
-                    getRecordTypes(r)
-                    for r in res[_tPartnerNS.searchRecords]
-                ],
-                set(),
-            )
-            new_types = types - set(typeDescs.keys())
-            if new_types:
-                typeDescs.update(self.queryTypesDescriptions(new_types))
-            return [
-                self._extractRecord(r, typeDescs)
-                for r in res[_tPartnerNS.searchRecords]
-            ]
-        else:
-            return []
+        handler = self._recordHandler()
+        BaseClient.search(self, sosl, handler=handler)
+        return handler.records
+
+    def delete(self, ids, workers=1):
+        """
+        Delete one or more records, returning a list of save results.
+
+        Parameters:
+            ids - a record Id, or any iterable of them. Ids are sent
+                  DML_BATCH_SIZE at a time.
+            workers - how many of those batches to send at once
+        """
+        return self._dispatchBatches(self._delete, ids, workers)
 
-    def delete(self, ids):
+    def _delete(self, ids):
         res = BaseClient.delete(self, ids)
-        if not isinstance(res, (tuple, list)):
-            res = [res]
-        data = list()
-        for r in res:
-            d = dict()
-            data.append(d)
-            d['id'] = text_type(r[_tPartnerNS.id])
-            d['success'] = success = bool_(r[_tPartnerNS.success])
-            if not success:
-                d['errors'] = [
-                    _extractError(e)
-                    for e in r[_tPartnerNS.errors, ]
-                ]
-            else:
-                d['errors'] = list()
-        return data
+        return _extractSaveResults(res)
+
+    def upsert(self, externalIdName, sObjects, workers=1):
+        """
+        Create or update records, matching them on the externalIdName
+        field, and return a list of upsert results.
+
+        Parameters:
+            externalIdName - the external id field name
+            sObjects - a dict, or any iterable of dicts, each with a 'type'.
+                       Records are sent DML_BATCH_SIZE at a time.
+            workers - how many of those batches to send at once
+        """
+        return self._dispatchBatches(
+            lambda batch: self._upsert(externalIdName, batch),
+            sObjects, workers)
 
-    def upsert(self, externalIdName, sObjects):
+    def _upsert(self, externalIdName, sObjects):
         preparedObjects = _prepareSObjects(sObjects)
         res = BaseClient.upsert(self, externalIdName, preparedObjects)
-        if not isinstance(res, (tuple, list)):
-            res = [res]
-        data = list()
-        for r in res:
-            d = dict()
-            data.append(d)
-            d['id'] = text_type(r[_tPartnerNS.id])
-            d['success'] = success = bool_(r[_tPartnerNS.success])
-            if not success:
-                d['errors'] = [_extractError(e)
-                               for e in r[_tPartnerNS.errors, ]]
-            else:
-                d['errors'] = list()
-            d['isCreated'] = d['created'] = bool_(r[_tPartnerNS.created])
-        return data
+        return _extractUpsertResults(res)
 
     def getDeleted(self, sObjectType, start, end):
         res = BaseClient.getDeleted(self, sObjectType, start, end)
-        res = res[_tPartnerNS.deletedRecords, ]
-        if not isinstance(res, (tuple, list)):
-            res = [res]
-        data = list()
-        for r in res:
-            d = dict(
-                id=text_type(r[_tPartnerNS.id]),
-                deletedDate=marshall(
-                    'datetime', 'deletedDate', r,
-                    ns=_tPartnerNS,
-                )
-            )
-            data.append(d)
-        return data
+        return _extractDeleted(res)
 
     def getUpdated(self, sObjectType, start, end):
         res = BaseClient.getUpdated(self, sObjectType, start, end)
-        res = res[_tPartnerNS.ids, ]
-        if not isinstance(res, (tuple, list)):
-            res = [res]
-        return [text_type(r) for r in res]
+        return _extractUpdated(res)
 
     def getUserInfo(self):
         res = BaseClient.getUserInfo(self)
@@ -584,54 +712,328 @@ class Field(object):
         return marshall(self.type, self.name, xml)
 
 
-def _doPrep(field_dict):
+def _isNull(value):
+    # None and empty lists are sent as fieldsToNull
+    return value is None or (not isinstance(value, string_types) and
+                             hasattr(value, '__iter__') and len(value) == 0)
+
+
+def _prepValue(value):
+    """
+    Converts a python value into a format Salesforce will accept: lists of
+    strings become "apple;orange;pear" and dicts are embedded objects.
+    """
+    if value is None:
+        return []
+    if isinstance(value, string_types) or not hasattr(value, '__iter__'):
+        return value
+    if len(value) == 0:
+        return value
+    if isinstance(value, dict):
+        return PreparedSObject(value)
+    try:
+        return ";".join(value)
+    except TypeError:
+        return value
+
+
+class PreparedSObject(Mapping):
     """
-    _doPrep is makes changes in-place.
-    Do some prep work converting python types into formats that
-    Salesforce will accept.
-    This includes converting lists of strings to "apple;orange;pear".
-    Dicts will be converted to embedded objects
-    None or empty list values will be Null-ed
+    A read-only view of an sObject dict as Salesforce accepts it, which
+    neither copies nor changes the dict. Values are converted with
+    _prepValue as they are read, and None or empty values are listed in a
+    last fieldsToNull field, unless fieldsToNull is False.
     """
-    fieldsToNull = []
-    for key, value in field_dict.items():
-        if value is None:
-            fieldsToNull.append(key)
-            field_dict[key] = []
-        elif not isinstance(value, string_types) and hasattr(value, '__iter__'):
-            if len(value) == 0:
+    __slots__ = ('_fields', '_fieldsToNull')
+
+    def __init__(self, fields, fieldsToNull=True):
+        if 'fieldsToNull' in fields:
+            raise ValueError(
+                "fieldsToNull should be populated by the client, not the "
+                "caller."
+            )
+        self._fields = fields
+        self._fieldsToNull = fieldsToNull
+
+    def __getitem__(self, key):
+        if key == 'fieldsToNull' and self._fieldsToNull:
+            return [k for k, v in self._fields.items() if _isNull(v)]
+        return _prepValue(self._fields[key])
+
+    def __iter__(self):
+        for key in self._fields:
+            yield key
+        if self._fieldsToNull:
+            yield 'fieldsToNull'
+
+    def __len__(self):
+        return len(self._fields) + bool(self._fieldsToNull)
+
+    def __contains__(self, key):
+        if key == 'fieldsToNull':
+            return self._fieldsToNull
+        return key in self._fields
+
+    def items(self):
+        # in one pass over the fields, which serializing an sObject makes
+        fieldsToNull = []
+        for key, value in self._fields.items():
+            if _isNull(value):
                 fieldsToNull.append(key)
-            elif isinstance(value, dict):
-                innerCopy = copy.deepcopy(value)
-                _doPrep(innerCopy)
-                field_dict[key] = innerCopy
-            else:
-                try:
-                    field_dict[key] = ";".join(value)
-                except TypeError:
-                    pass
-    if 'fieldsToNull' in field_dict:
-        raise ValueError(
-            "fieldsToNull should be populated by the client, not the caller."
-        )
-    field_dict['fieldsToNull'] = fieldsToNull
+            yield key, _prepValue(value)
+        if self._fieldsToNull:
+            yield 'fieldsToNull', fieldsToNull
+
+    def __repr__(self):
+        return 'PreparedSObject(%r)' % dict(self.items())
+
 
 # sObjects can be 1 or a list. If values are python lists or tuples, we
 # convert these to strings:
 # ['one','two','three'] becomes 'one;two;three'
 
 
-def _prepareSObjects(sObjects):
-    '''Prepare a SObject'''
-    sObjectsCopy = copy.deepcopy(sObjects)
-    if isinstance(sObjectsCopy, dict):
+def _prepareSObjects(sObjects, fieldsToNull=True):
+    """
+    Prepares an sObject dict, or a list of them, for a call, as
+    PreparedSObjects. The caller's dicts are left as they are.
+    """
+    if isinstance(sObjects, dict):
         # If root element is a dict, then this is a single object not an array
-        _doPrep(sObjectsCopy)
+        return PreparedSObject(sObjects, fieldsToNull)
+    # else this is an array, and each elelment should be prepped.
+    return [PreparedSObject(o, fieldsToNull) for o in sObjects]
+
+
+def _queryString(args, kw):
+    if len(args) == 1:  # full query string
+        queryString = args[0]
+    elif len(args) == 2:  # BBB: fields, sObjectType
+        queryString = 'select %s from %s' % (args[0], args[1])
+        if 'conditionalExpression' in kw:  # BBB: fields, sObjectType,
+            # conditionExpression as kwarg
+            queryString += ' where %s' % (kw['conditionalExpression'])
+    elif len(args) == 3:  # BBB: fields, sObjectType, conditionExpression
+        # as positional arg
+        whereClause = args[2] and (' where %s' % args[2]) or ''
+        queryString = 'select %s from %s%s' % (
+            args[0],
+            args[1],
+            whereClause,
+        )
     else:
-        # else this is an array, and each elelment should be prepped.
-        for listitems in sObjectsCopy:
-            _doPrep(listitems)
-    return sObjectsCopy
+        raise RuntimeError("Wrong number of arguments to query method.")
+    return queryString
+
+
+def _putPage(pages, item, stop):
+    # Queue item for a consumer, giving up if it goes away.
+    while not stop.is_set():
+        try:
+            pages.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _projectRecord(record, fields):
+    # a SlottedRecord of just the retrieved fields, if they can be slots
+    cls = recordClass(record['type'], fields)
+    if cls is None:
+        return dict((f, record[f]) for f in fields)
+    return cls([record[f] for f in fields])
+
+
+def _imapBounded(pool, func, items, limit):
+    # pool.imap, but only reading items as results are taken, so at most
+    # limit of them are in flight rather than all of them queued up front
+    pending = deque()
+    for item in items:
+        if len(pending) >= limit:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(func, (item,)))
+    while pending:
+        yield pending.popleft().get()
+
+
+def _batches(items, size):
+    # split any iterable into lists of at most size items, as it's read
+    items = iter(items)
+    batch = list(itertools.islice(items, size))
+    while batch:
+        yield batch
+        batch = list(itertools.islice(items, size))
+
+
+def _extractLoginResult(res):
+    data = dict()
+    data['passwordExpired'] = bool_(res[_tPartnerNS.passwordExpired])
+    data['serverUrl'] = text_type(res[_tPartnerNS.serverUrl])
+    data['sessionId'] = text_type(res[_tPartnerNS.sessionId])
+    data['userId'] = text_type(res[_tPartnerNS.userId])
+    data['userInfo'] = _extractUserInfo(res[_tPartnerNS.userInfo])
+    return data
+
+
+def _extractDescribeGlobal(res):
+    data = dict()
+    data['encoding'] = text_type(res[_tPartnerNS.encoding])
+    data['maxBatchSize'] = int(text_type(res[_tPartnerNS.maxBatchSize]))
+    sobjects = list()
+    for r in res[_tPartnerNS.sobjects, ]:
+        d = dict()
+        d['activateable'] = bool_(r[_tPartnerNS.activateable])
+        d['createable'] = bool_(r[_tPartnerNS.createable])
+        d['custom'] = bool_(r[_tPartnerNS.custom])
+        try:
+            d['customSetting'] = bool_(r[_tPartnerNS.customSetting])
+        except KeyError:
+            pass
+        d['deletable'] = bool_(r[_tPartnerNS.deletable])
+        d['deprecatedAndHidden'] = bool_(
+            r[_tPartnerNS.deprecatedAndHidden]
+        )
+        try:
+            d['feedEnabled'] = bool_(r[_tPartnerNS.feedEnabled])
+        except KeyError:
+            pass
+        d['keyPrefix'] = text_type(r[_tPartnerNS.keyPrefix])
+        d['label'] = text_type(r[_tPartnerNS.label])
+        d['labelPlural'] = text_type(r[_tPartnerNS.labelPlural])
+        d['layoutable'] = bool_(r[_tPartnerNS.layoutable])
+        d['mergeable'] = bool_(r[_tPartnerNS.mergeable])
+        d['name'] = text_type(r[_tPartnerNS.name])
+        d['queryable'] = bool_(r[_tPartnerNS.queryable])
+        d['replicateable'] = bool_(r[_tPartnerNS.replicateable])
+        d['retrieveable'] = bool_(r[_tPartnerNS.retrieveable])
+        d['searchable'] = bool_(r[_tPartnerNS.searchable])
+        d['triggerable'] = bool_(r[_tPartnerNS.triggerable])
+        d['undeletable'] = bool_(r[_tPartnerNS.undeletable])
+        d['updateable'] = bool_(r[_tPartnerNS.updateable])
+        sobjects.append(SObject(**d))
+    data['sobjects'] = sobjects
+    data['types'] = [text_type(t) for t in res[_tPartnerNS.types, ]]
+    if not data['types']:
+        # BBB for code written against API < 17.0
+        data['types'] = [s.name for s in data['sobjects']]
+    return data
+
+
+def _extractDescribeSObjects(res):
+    if not isinstance(res, (tuple, list)):
+        res = [res]
+    data = list()
+    for r in res:
+        d = dict()
+        d['activateable'] = bool_(r[_tPartnerNS.activateable])
+        rawreldata = r[_tPartnerNS.ChildRelationships, ]
+        relinfo = [_extractChildRelInfo(cr) for cr in rawreldata]
+        d['ChildRelationships'] = relinfo
+        d['createable'] = bool_(r[_tPartnerNS.createable])
+        d['custom'] = bool_(r[_tPartnerNS.custom])
+        try:
+            d['customSetting'] = bool_(r[_tPartnerNS.customSetting])
+        except KeyError:
+            pass
+        d['deletable'] = bool_(r[_tPartnerNS.deletable])
+        d['deprecatedAndHidden'] = bool_(
+            r[_tPartnerNS.deprecatedAndHidden]
+        )
+        try:
+            d['feedEnabled'] = bool_(r[_tPartnerNS.feedEnabled])
+        except KeyError:
+            pass
+        fields = r[_tPartnerNS.fields, ]
+        fields = [_extractFieldInfo(f) for f in fields]
+        field_map = dict()
+        for f in fields:
+            field_map[f.name] = f
+        d['fields'] = field_map
+        d['keyPrefix'] = text_type(r[_tPartnerNS.keyPrefix])
+        d['label'] = text_type(r[_tPartnerNS.label])
+        d['labelPlural'] = text_type(r[_tPartnerNS.labelPlural])
+        d['layoutable'] = bool_(r[_tPartnerNS.layoutable])
+        d['mergeable'] = bool_(r[_tPartnerNS.mergeable])
+        d['name'] = text_type(r[_tPartnerNS.name])
+        d['queryable'] = bool_(r[_tPartnerNS.queryable])
+        d['recordTypeInfos'] = ([_extractRecordTypeInfo(rti) for rti in
+                                 r[_tPartnerNS.recordTypeInfos, ]])
+        d['replicateable'] = bool_(r[_tPartnerNS.replicateable])
+        d['retrieveable'] = bool_(r[_tPartnerNS.retrieveable])
+        d['searchable'] = bool_(r[_tPartnerNS.searchable])
+        try:
+            d['triggerable'] = bool_(r[_tPartnerNS.triggerable])
+        except KeyError:
+            pass
+        d['undeletable'] = bool_(r[_tPartnerNS.undeletable])
+        d['updateable'] = bool_(r[_tPartnerNS.updateable])
+        d['urlDetail'] = text_type(r[_tPartnerNS.urlDetail])
+        d['urlEdit'] = text_type(r[_tPartnerNS.urlEdit])
+        d['urlNew'] = text_type(r[_tPartnerNS.urlNew])
+        data.append(SObject(**d))
+    return data
+
+
+def _extractSaveResults(res):
+    if not isinstance(res, (tuple, list)):
+        res = [res]
+    data = list()
+    for r in res:
+        d = dict()
+        data.append(d)
+        d['id'] = text_type(r[_tPartnerNS.id])
+        d['success'] = success = bool_(r[_tPartnerNS.success])
+        if not success:
+            d['errors'] = [
+                _extractError(e)
+                for e in r[_tPartnerNS.errors, ]
+            ]
+        else:
+            d['errors'] = list()
+    return data
+
+
+def _extractUpsertResults(res):
+    if not isinstance(res, (tuple, list)):
+        res = [res]
+    data = list()
+    for r in res:
+        d = dict()
+        data.append(d)
+        d['id'] = text_type(r[_tPartnerNS.id])
+        d['success'] = success = bool_(r[_tPartnerNS.success])
+        if not success:
+            d['errors'] = [_extractError(e)
+                           for e in r[_tPartnerNS.errors, ]]
+        else:
+            d['errors'] = list()
+        d['isCreated'] = d['created'] = bool_(r[_tPartnerNS.created])
+    return data
+
+
+def _extractDeleted(res):
+    res = res[_tPartnerNS.deletedRecords, ]
+    if not isinstance(res, (tuple, list)):
+        res = [res]
+    data = list()
+    for r in res:
+        d = dict(
+            id=text_type(r[_tPartnerNS.id]),
+            deletedDate=marshall(
+                'datetime', 'deletedDate', r,
+                ns=_tPartnerNS,
+            )
+        )
+        data.append(d)
+    return data
+
+
+def _extractUpdated(res):
+    res = res[_tPartnerNS.ids, ]
+    if not isinstance(res, (tuple, list)):
+        res = [res]
+    return [text_type(r) for r in res]
 
 
 def _extractFieldInfo(fdata):
@@ -656,7 +1058,8 @@ def _extractFieldInfo(fdata):
     plValues = fdata[_tPartnerNS.picklistValues, ]
     data['picklistValues'] = [_extractPicklistEntry(p) for p in plValues]
     data['precision'] = int(text_type(fdata[_tPartnerNS.precision]))
-    data['referenceTo'] = [text_type(r) for r in fdata[_tPartnerNS.referenceTo, ]]
+    data['referenceTo'] = [
+        text_type(r) for r in fdata[_tPartnerNS.referenceTo, ]]
     data['restrictedPicklist'] = bool_(fdata[_tPartnerNS.restrictedPicklist])
     data['scale'] = int(text_type(fdata[_tPartnerNS.scale]))
     data['soapType'] = text_type(fdata[_tPartnerNS.soapType])
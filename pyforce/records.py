@@ -0,0 +1,760 @@
+"""
+Query records, and a SAX handler which builds them straight from query,
+queryMore, search and retrieve responses as the parser reads them, without
+building an xmltramp tree of the response first.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import keyword
+import logging
+import re
+import threading
+from xml.sax.handler import ContentHandler
+
+from six import string_types
+from six.moves.collections_abc import Mapping
+
+from pyforce.marshall import Base64Writer
+from pyforce.marshall import marshall
+from pyforce.marshall import textConverter
+from pyforce.xmlclient import _envNs
+from pyforce.xmlclient import _raiseFault
+from pyforce.xmlclient import _schemaInstanceNs
+from pyforce.xmlclient import _sobjectNs
+from pyforce.xmltramp import Element
+
+# record layouts a type keeps compiled decoders for
+MAX_DECODERS = 256
+# generated record classes kept for reuse
+MAX_RECORD_CLASSES = 1024
+
+_logger = logging.getLogger(__name__)
+
+_xsiType = (_schemaInstanceNs, 'type')
+_xsiNil = (_schemaInstanceNs, 'nil')
+_faultName = (_envNs, 'Fault')
+_recordName = (_sobjectNs, 'record')
+
+_identifier = re.compile(r'^[A-Za-z][A-Za-z0-9_]*$')
+_recordClasses = {}
+_recordClassesLock = threading.Lock()
+
+# kinds of record fields, for compiled decoders
+_TEXT = 'text'
+_ELEMENT = 'element'
+_VALUE = 'value'
+# kinds of the records and record sets nested in a record, which are made
+# along with it
+_RECORD = 'record'
+_RESULT = 'result'
+
+
+class QueryRecord(dict):
+    def __getattr__(self, n):
+        if n[:2] == '__':
+            # protocols looked up by numpy, pandas and the like
+            raise AttributeError(n)
+        return self[n]
+
+    def __setattr__(self, n, v):
+        self[n] = v
+
+
+class LazyRecord(QueryRecord):
+    """
+    A QueryRecord which keeps the text of its fields as parsed, and decodes
+    each field the first time it's read, keeping the value. Anything that
+    needs the whole record, like iterating it, comparing it or its len,
+    decodes every field at once. Copies and pickles are QueryRecords.
+    """
+    __slots__ = ('_payloads', '_decoder')
+
+    def __init__(self, payloads, decoder):
+        QueryRecord.__init__(self)
+        object.__setattr__(self, '_payloads', payloads)
+        object.__setattr__(self, '_decoder', decoder)
+
+    def __missing__(self, n):
+        payloads = self._payloads
+        if payloads is None or n not in self._decoder.fields:
+            raise KeyError(n)
+        i, func = self._decoder.fields[n]
+        value = payloads[i] if func is None else func(payloads[i])
+        dict.__setitem__(self, n, value)
+        return value
+
+    def _decodeAll(self):
+        payloads = self._payloads
+        if payloads is None:
+            return
+        # keep the fields in response order, and any values already read
+        # or set rather than decoding them again
+        known = dict(dict.items(self))
+        values = []
+        for i, fname, func in self._decoder.steps:
+            if fname in known:
+                values.append((fname, known.pop(fname)))
+            else:
+                values.append(
+                    (fname, payloads[i] if func is None else func(payloads[i])))
+        dict.clear(self)
+        dict.update(self, values)
+        dict.update(self, known)
+        object.__setattr__(self, '_payloads', None)
+
+    @property
+    def decoded(self):
+        """Whether every field has been decoded"""
+        return self._payloads is None
+
+    def __contains__(self, n):
+        return dict.__contains__(self, n) or (
+            self._payloads is not None and n in self._decoder.fields)
+
+    def get(self, n, default=None):
+        try:
+            return self[n]
+        except KeyError:
+            return default
+
+    def __iter__(self):
+        self._decodeAll()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        self._decodeAll()
+        return dict.__len__(self)
+
+    def __eq__(self, other):
+        self._decodeAll()
+        if isinstance(other, LazyRecord):
+            other._decodeAll()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        self._decodeAll()
+        return dict.__repr__(self)
+
+    def __reduce__(self):
+        return (QueryRecord, (list(self.items()),))
+
+    def copy(self):
+        return QueryRecord(self.items())
+
+
+def _decodingFirst(name):
+    method = getattr(dict, name)
+
+    def decodingFirst(self, *args, **kw):
+        self._decodeAll()
+        return method(self, *args, **kw)
+    decodingFirst.__name__ = str(name)
+    return decodingFirst
+
+
+for _name in ('keys', 'values', 'items', 'pop', 'popitem', 'setdefault',
+              '__delitem__', 'iterkeys', 'itervalues', 'iteritems',
+              'viewkeys', 'viewvalues', 'viewitems'):
+    if hasattr(dict, _name):
+        setattr(LazyRecord, _name, _decodingFirst(_name))
+
+
+class SlottedRecord(Mapping):
+    """
+    The base of the record classes made by recordClass, which keep their
+    fields in slots rather than a dict of their own. Fields can be read as
+    attributes or as items, and records compare equal to dicts with the
+    same items. Copies and pickles keep the class.
+    """
+    __slots__ = ()
+    # the name of the sObject type, and the fields, in order
+    sObjectType = None
+    _fields = ()
+    _fieldSet = frozenset()
+
+    def __getitem__(self, n):
+        if n in self._fieldSet:
+            try:
+                return getattr(self, n)
+            except AttributeError:
+                pass
+        raise KeyError(n)
+
+    def __setitem__(self, n, v):
+        if n not in self._fieldSet:
+            raise KeyError('{0} has no field {1!r}'.format(
+                type(self).__name__, n))
+        setattr(self, n, v)
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __contains__(self, n):
+        return n in self._fieldSet
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(type(self).__name__, dict(self.items()))
+
+    def __reduce__(self):
+        return (_makeSlottedRecord, (self.sObjectType, self._fields,
+                                     tuple(self[f] for f in self._fields)))
+
+    def copy(self):
+        return type(self)(tuple(self[f] for f in self._fields))
+
+
+def recordClass(sObjectType, fields):
+    """
+    Returns a SlottedRecord class for records of sObjectType with exactly
+    fields, a sequence of field names, creating it on first use. Its
+    constructor takes the values of the fields, in the same order. Returns
+    None if a field name can't be a slot.
+    """
+    fields = tuple(fields)
+    key = (sObjectType, fields)
+    cls = _recordClasses.get(key)
+    if cls is not None or key in _recordClasses:
+        return cls
+    if all(_identifier.match(f) and not keyword.iskeyword(f) and
+           not hasattr(SlottedRecord, f) for f in fields) and \
+            len(set(fields)) == len(fields):
+        cls = _defineRecordClass(sObjectType, fields)
+    with _recordClassesLock:
+        if len(_recordClasses) >= MAX_RECORD_CLASSES:
+            _recordClasses.clear()
+        _recordClasses[key] = cls
+    return cls
+
+
+def _defineRecordClass(sObjectType, fields):
+    _logger.debug("defining record class of %s for %r", sObjectType, fields)
+    # a generated __init__ assigns every slot at once, as namedtuple does
+    if fields:
+        source = 'def __init__(self, values):\n    {0}, = values\n'.format(
+            ', '.join('self.' + f for f in fields))
+    else:
+        source = 'def __init__(self, values=()):\n    pass\n'
+    namespace = {}
+    exec(source, namespace)
+    name = sObjectType if _identifier.match(sObjectType) else 'SObject'
+    return type(str(name + 'Record'), (SlottedRecord,), dict(
+        __slots__=tuple(str(f) for f in fields),
+        __init__=namespace['__init__'],
+        __module__=__name__,
+        sObjectType=sObjectType,
+        _fields=fields,
+        _fieldSet=frozenset(fields),
+    ))
+
+
+def _makeSlottedRecord(sObjectType, fields, values):
+    cls = recordClass(sObjectType, fields)
+    if cls is None:
+        return QueryRecord(zip(fields, values))
+    return cls(values)
+
+
+class QueryRecordSet(list):
+    def __init__(self, records, done, size, **kw):
+        super(QueryRecordSet, self).__init__(records)
+        self.done = done
+        self.size = size
+        for k, v in kw.items():
+            setattr(self, k, v)
+
+    @property
+    def records(self):
+        return self
+
+    def __getitem__(self, n):
+        # If string, we can try to return a result attribute
+        if isinstance(n, string_types):
+            try:
+                return getattr(self, n)
+            except AttributeError:
+                raise KeyError("Unknown key/attribute: {}".format(n))
+        # Otherwise, return a list item
+        return super(QueryRecordSet, self).__getitem__(n)
+
+
+class _PassFrame(object):
+    # an element outside of any record, e.g. the Body or searchRecords
+    __slots__ = ()
+
+
+_PASS = _PassFrame()
+
+
+class _NilFrame(object):
+    # a nil top level result, such as retrieve gives for an id not found
+    __slots__ = ()
+
+
+_NIL = _NilFrame()
+
+
+class _FaultFrame(object):
+    __slots__ = ('fields',)
+
+    def __init__(self):
+        self.fields = {}
+
+
+class _RecordFrame(object):
+    __slots__ = ('items', 'nested')
+
+    def __init__(self):
+        # (fieldname, xsi:type, kind, payload) for each child, in order
+        self.items = []
+        # whether any child is a record or record set
+        self.nested = False
+
+
+class _ResultFrame(object):
+    __slots__ = ('nested', 'records', 'fields')
+
+    def __init__(self, nested):
+        self.nested = nested
+        self.records = []
+        self.fields = {}
+
+
+class _ValueFrame(object):
+    """
+    A field of a record, or of a QueryResult or fault. Its text is all
+    that's kept unless it has child elements, like an address, in which
+    case it is built as a small xmltramp tree for the field's marshaller.
+    """
+    __slots__ = ('name', 'xsiType', 'attrs', 'chunks', 'stack')
+
+    def __init__(self, name, xsiType, attrs):
+        self.name = name
+        self.xsiType = xsiType
+        self.attrs = attrs
+        self.chunks = []
+        self.stack = None
+
+    def _flush(self):
+        # text between elements is kept as xmltramp.Seeder would keep it
+        text = ''.join(self.chunks)
+        self.chunks = []
+        if text and not text.isspace():
+            self.stack[-1]._dir.append(text)
+
+    def startChild(self, name, attrs):
+        if self.stack is None:
+            self.stack = [Element(self.name, self.attrs)]
+        self._flush()
+        child = Element(name, dict(attrs))
+        self.stack[-1]._dir.append(child)
+        self.stack.append(child)
+
+    def endChild(self):
+        self._flush()
+        self.stack.pop()
+
+    @property
+    def depth(self):
+        return len(self.stack) - 1 if self.stack is not None else 0
+
+    def text(self):
+        text = ''.join(self.chunks)
+        return '' if text.isspace() else text
+
+    def item(self):
+        if self.stack is None:
+            return (self.name[1], self.xsiType, _TEXT, self.text())
+        self._flush()
+        return (self.name[1], self.xsiType, _ELEMENT, self.stack[0])
+
+
+class _Base64Frame(object):
+    # a base64 field decoded into a file object as it's parsed
+    __slots__ = ('writer',)
+
+    def __init__(self, writer):
+        self.writer = writer
+
+
+class RecordHandler(ContentHandler):
+    """
+    A SAX handler turning the sObjects of a query, queryMore, search or
+    retrieve response into records as they are parsed. sObjects and the
+    QueryResults of sub-queries nested in a record become its values; the
+    others are the top level records. A soap fault is raised as the
+    SoapFaultError or SessionTimeoutError it describes. A nil top level
+    result, such as retrieve gives for an id that's not found, is None.
+
+    Records are made as they are parsed once their types are described.
+    Until then they are kept as parsed, and the types found in the response
+    are described together once it has been read, so describe isn't called
+    while the response still holds its connection.
+
+    Parameters:
+        describe - a function of a list of type names returning a dict of
+                   their descriptions, called for each type the first time
+                   it's seen, e.g. PythonClient._describeTypes. If None, the
+                   records of new types are only made by finish, e.g. once
+                   AsyncClient has described newTypes.
+        recordFactory - makes a record of a list of (fieldname, value)
+                        pairs, QueryRecord by default
+        onRecord - if given, called with each top level record as it's
+                   parsed, rather than adding it to records
+        lazy - make LazyRecords, which decode fields as they're read,
+               rather than using recordFactory
+        slotted - make records of the SlottedRecord class for their type
+                  and fields (see recordClass), rather than using
+                  recordFactory
+        columns - a pyforce.columns.ColumnBuilder the fields of top level
+                  records are added to, rather than making records
+        base64Files - a function of (fieldname, fields) called for each
+                      base64 field of a record, where fields is a dict of
+                      the record's text fields parsed so far, such as its
+                      type and Id. It returns a binary file object which
+                      the field is decoded into as it's parsed, and which
+                      becomes its value, or None to keep the field's text.
+                      Only the fields of types already in typeDescs are
+                      decoded this way.
+    """
+
+    def __init__(self, describe, recordFactory=QueryRecord, onRecord=None,
+                 lazy=False, slotted=False, columns=None, base64Files=None):
+        ContentHandler.__init__(self)
+        self.describe = describe
+        self.recordFactory = recordFactory
+        self.onRecord = onRecord
+        self.lazy = lazy
+        self.slotted = slotted
+        self.columns = columns
+        self.base64Files = base64Files
+        self.typeDescs = {}
+        # records given to onRecord or columns, and files from base64Files
+        self.emitted = 0
+        self.restart()
+
+    def restart(self):
+        """
+        Forgets a partly parsed response, keeping typeDescs, so that the
+        response can be parsed again, e.g. when reading it failed.
+        """
+        self.records = []
+        self.done = True
+        self.size = 0
+        self.queryLocator = ''
+        self._stack = []
+        self._recordDepth = 0
+        # types seen but not yet described, which are described together
+        self._newTypes = set()
+        # the frames of top level records parsed since a new type was seen
+        self._pending = []
+
+    def queryResult(self):
+        """The QueryRecordSet of a query or queryMore response"""
+        return QueryRecordSet(
+            records=self.records,
+            done=self.done,
+            size=self.size,
+            queryLocator=self.queryLocator,
+        )
+
+    def startElementNS(self, name, qname, attrs):
+        stack = self._stack
+        top = stack[-1] if stack else _PASS
+        if top.__class__ is _ValueFrame:
+            top.startChild(name, attrs)
+            return
+        xsiType = attrs.get(_xsiType)
+        if xsiType == 'sf:sObject':
+            frame = _RecordFrame()
+            self._recordDepth += 1
+        elif xsiType == 'QueryResult':
+            frame = _ResultFrame(self._recordDepth > 0)
+        elif top.__class__ is not _PassFrame:
+            frame = None
+            if top.__class__ is _RecordFrame and self.base64Files is not None:
+                frame = self._base64Frame(top, name[1], xsiType, attrs)
+            if frame is None:
+                frame = _ValueFrame(name, xsiType, attrs)
+        elif name == _faultName:
+            frame = _FaultFrame()
+        elif name[1] == 'result' and attrs.get(_xsiNil) == 'true':
+            frame = _NIL
+        else:
+            frame = _PASS
+        stack.append(frame)
+
+    def characters(self, content):
+        top = self._stack[-1]
+        if top.__class__ is _ValueFrame:
+            top.chunks.append(content)
+        elif top.__class__ is _Base64Frame:
+            top.writer.write(content)
+
+    def endElementNS(self, name, qname):
+        stack = self._stack
+        frame = stack[-1]
+        cls = frame.__class__
+        if cls is _ValueFrame and frame.depth:
+            frame.endChild()
+            return
+        stack.pop()
+        parent = stack[-1] if stack else _PASS
+        if cls is _ValueFrame:
+            if parent.__class__ is _RecordFrame:
+                item = frame.item()
+                parent.items.append(item)
+                if item[0] == 'type' and item[3] not in self.typeDescs:
+                    self._newTypes.add(item[3])
+            else:
+                parent.fields[name[1]] = frame.text()
+        elif cls is _Base64Frame:
+            frame.writer.close()
+            parent.items.append((name[1], None, _VALUE, frame.writer.fileobj))
+        elif cls is _RecordFrame:
+            self._recordDepth -= 1
+            if parent.__class__ is _RecordFrame:
+                parent.items.append((name[1], None, _RECORD, frame))
+                parent.nested = True
+            elif parent.__class__ is _ResultFrame and parent.nested:
+                parent.records.append(frame)
+            elif self._newTypes or self._pending:
+                self._pending.append(frame)
+            else:
+                self._addRecord(frame)
+        elif cls is _NilFrame:
+            # kept in place so that records line up with the ids retrieved
+            if self._newTypes or self._pending:
+                self._pending.append(None)
+            else:
+                self._addRecord(None)
+        elif cls is _ResultFrame:
+            fields = frame.fields
+            done = fields.get('done') == 'true'
+            size = int(fields.get('size') or 0)
+            if parent.__class__ is _RecordFrame:
+                parent.items.append((name[1], None, _RESULT,
+                                     (frame.records, done, size)))
+                parent.nested = True
+            else:
+                self.done = done
+                self.size = size
+                self.queryLocator = fields.get('queryLocator', '')
+        elif cls is _FaultFrame:
+            fields = frame.fields
+            _raiseFault(fields.get('faultcode', '').split(':')[-1],
+                        fields.get('faultstring', ''))
+
+    @property
+    def newTypes(self):
+        """The types seen which are not described yet"""
+        return set(t for t in self._newTypes if t not in self.typeDescs)
+
+    def endDocument(self):
+        if self.describe is not None:
+            self.finish()
+
+    def finish(self, typeDescs=None):
+        """
+        Makes the records kept until their types were described, with
+        typeDescs, a dict of the descriptions of newTypes, or by calling
+        describe. Called at the end of the response unless describe is None.
+        """
+        if typeDescs is not None:
+            self.typeDescs.update(typeDescs)
+        if self._pending:
+            self._describeNewTypes()
+            pending, self._pending = self._pending, []
+            for frame in pending:
+                self._addRecord(frame)
+
+    def _addRecord(self, frame):
+        # adds a top level record to the columns, onRecord or records, where
+        # a nil result is None, and has no row in the columns
+        if frame is None:
+            if self.columns is None:
+                if self.onRecord is not None:
+                    self.emitted += 1
+                    self.onRecord(None)
+                else:
+                    self.records.append(None)
+        elif self.columns is not None:
+            self.emitted += 1
+            self._addRow(self._resolve(frame))
+        elif self.onRecord is not None:
+            self.emitted += 1
+            self.onRecord(self._build(frame))
+        else:
+            self.records.append(self._build(frame))
+
+    def _build(self, frame):
+        return self._makeRecord(self._resolve(frame))
+
+    def _resolve(self, frame):
+        # the items of a record frame, with the records and record sets
+        # nested in it made
+        items = frame.items
+        if not frame.nested:
+            return items
+        for i, (fname, xsiType, kind, payload) in enumerate(items):
+            if kind is _RECORD:
+                items[i] = (fname, None, _VALUE, self._build(payload))
+            elif kind is _RESULT:
+                records, done, size = payload
+                items[i] = (fname, None, _VALUE, QueryRecordSet(
+                    records=[self._build(r) for r in records],
+                    done=done, size=size))
+        frame.nested = False
+        return items
+
+    def _base64Frame(self, record, fname, xsiType, attrs):
+        # a _Base64Frame for the fname field of record, if it's a base64
+        # field of a described type base64Files gives a file object for,
+        # or None
+        if attrs.get(_xsiNil) == 'true':
+            return None
+        for i in record.items:
+            if i[0] == 'type' and i[2] is _TEXT:
+                typeName = i[3]
+                break
+        else:
+            return None
+        type_data = self.typeDescs.get(typeName)
+        if type_data is None or \
+                type_data.fieldType(fname, xsiType) != 'base64':
+            return None
+        fields = dict((i[0], i[3]) for i in record.items if i[2] is _TEXT)
+        self.emitted += 1
+        fileobj = self.base64Files(fname, fields)
+        if fileobj is None:
+            return None
+        return _Base64Frame(Base64Writer(fileobj))
+
+    def _describeNewTypes(self):
+        types = sorted(self.newTypes)
+        self._newTypes.clear()
+        if types:
+            self.typeDescs.update(self.describe(types))
+
+    def _typeFor(self, typeName):
+        desc = self.typeDescs.get(typeName)
+        if desc is None:
+            self._newTypes.add(typeName)
+            self._describeNewTypes()
+            desc = self.typeDescs[typeName]
+        return desc
+
+    def _decoderFor(self, items):
+        # the type name, description and decoder of a record's items
+        for fname, xsiType, kind, payload in items:
+            if fname == 'type' and kind is _TEXT:
+                typeName = payload
+                type_data = self._typeFor(typeName)
+                break
+        else:
+            raise KeyError('record has no type: {0!r}'.format(items))
+        layout = tuple((i[0], i[1], i[2]) for i in items)
+        try:
+            decoders = type_data._recordDecoders
+        except AttributeError:
+            decoders = type_data._recordDecoders = {}
+        decoder = decoders.get(layout)
+        if decoder is None:
+            if len(decoders) >= MAX_DECODERS:
+                decoders.clear()
+            decoder = decoders[layout] = _RecordDecoder(
+                _compileSteps(type_data, layout))
+        return typeName, type_data, decoder
+
+    def _addRow(self, items):
+        if not items:
+            self.columns.addRow(None, None, items)
+            return
+        typeName, type_data, decoder = self._decoderFor(items)
+        self.columns.addRow(type_data, decoder, items)
+
+    def _makeRecord(self, items):
+        if not items:
+            return self.recordFactory([])
+        typeName, type_data, decoder = self._decoderFor(items)
+        if self.lazy:
+            return LazyRecord(tuple(i[3] for i in items), decoder)
+        if self.slotted:
+            if decoder.recordClass is None:
+                decoder.recordClass = recordClass(
+                    typeName, [step[1] for step in decoder.steps]) or False
+            if decoder.recordClass:
+                return decoder.recordClass([
+                    items[i][3] if func is None else func(items[i][3])
+                    for i, fname, func in decoder.steps
+                ])
+        return self.recordFactory([
+            (fname, items[i][3] if func is None else func(items[i][3]))
+            for i, fname, func in decoder.steps
+        ])
+
+
+class _RecordDecoder(object):
+    """
+    The compiled steps of a record layout, also by field name, and the
+    SlottedRecord class of the layout once one is asked for, or False if
+    it can't have one.
+    """
+    __slots__ = ('steps', 'fields', 'recordClass')
+
+    def __init__(self, steps):
+        self.steps = steps
+        self.fields = dict((fname, (i, func)) for i, fname, func in steps)
+        self.recordClass = None
+
+
+def _compileSteps(type_data, layout):
+    """
+    Returns (index, fieldname, func) steps decoding the fields of records
+    whose children have layout, a tuple of (fieldname, xsi:type, kind).
+    func converts the field's text or element, or is None for records and
+    record sets, which are already decoded. Fields which appear more than
+    once take the value of their first element.
+    """
+    _logger.debug("compiling record decoder of %s for %r",
+                  getattr(type_data, 'name', None), layout)
+    steps = []
+    seen = set()
+    for i, (fname, xsiType, kind) in enumerate(layout):
+        if fname in seen:
+            continue
+        seen.add(fname)
+        if kind is _VALUE:
+            steps.append((i, fname, None))
+            continue
+        fieldType = type_data.fieldType(fname, xsiType)
+        fromText = textConverter(fieldType) if kind is _TEXT else None
+        if fromText is None:
+            fromText = _elementDecoder(fieldType, fname, kind)
+        steps.append((i, fname, fromText))
+    return steps
+
+
+def _elementDecoder(fieldType, fname, kind):
+    # field types without a text converter are marshalled as usual, from
+    # a record element holding just this field
+    if kind is _TEXT:
+        name = (_sobjectNs, fname)
+
+        def decode(text):
+            field = Element(name, children=[text] if text else None)
+            return marshall(fieldType, fname,
+                            Element(_recordName, children=[field]))
+    else:
+        def decode(element):
+            return marshall(fieldType, fname,
+                            Element(_recordName, children=[element]))
+    return decode
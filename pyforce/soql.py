@@ -0,0 +1,214 @@
+"""
+Helpers for building SOQL queries, taking them apart and splitting them
+into disjoint ranges, used by PythonClient.queryPartitioned and exports.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import datetime
+import re
+
+# keywords are only matched where they aren't part of a name, such as
+# My_Limit__c or Account.Offset
+_clauseRegx = re.compile(
+    r'(select|from|where|with|group\s+by|order\s+by|limit|offset|for)'
+    r'(?![\w.])',
+    re.IGNORECASE,
+)
+
+_base62 = ('0123456789'
+           'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+           'abcdefghijklmnopqrstuvwxyz')
+
+
+# field types left out of exports: base64 fields can only be queried a
+# record at a time, and the parts of compound fields are fields too
+UNEXPORTED_TYPES = ('base64', 'address', 'location')
+
+
+def exportFields(sObject):
+    """
+    Returns the names of the fields of sObject, a description, which an
+    export selects by default, in the order they're described.
+    """
+    return [name for name, field in sObject.fields.items()
+            if field.type not in UNEXPORTED_TYPES]
+
+
+def selectQuery(sObjectType, fields, where=None):
+    """Returns a query for fields of every sObjectType row matching where"""
+    soql = 'SELECT {0} FROM {1}'.format(', '.join(fields), sObjectType)
+    if where:
+        soql += ' WHERE {0}'.format(where)
+    return soql
+
+
+def selectFields(soql):
+    """
+    Returns the fields and expressions selected by soql, leaving out any
+    sub-queries.
+    """
+    for keyword, text in clauses(soql):
+        if keyword == 'select':
+            break
+    else:
+        return []
+    fields, depth, start = [], 0, len('select')
+    for i, c in enumerate(text + ','):
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            field = text[start:i].strip()
+            if field and not field.startswith('('):
+                fields.append(field)
+            start = i + 1
+    return fields
+
+
+def _isNameChar(c):
+    return c.isalnum() or c in '_.'
+
+
+def clauses(soql):
+    """
+    Returns a list of (keyword, text) pairs for the top level clauses of a
+    query, ignoring anything inside sub-queries or string literals. The
+    keyword is lower case with single spaces, e.g. 'order by'.
+    """
+    found = []
+    depth = 0
+    quoted = False
+    pos = 0
+    while pos < len(soql):
+        c = soql[pos]
+        if quoted:
+            if c == '\\':
+                pos += 1
+            elif c == "'":
+                quoted = False
+        elif c == "'":
+            quoted = True
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif depth == 0 and (pos == 0 or not _isNameChar(soql[pos - 1])):
+            match = _clauseRegx.match(soql, pos)
+            if match:
+                found.append((pos, ' '.join(match.group(1).lower().split())))
+                pos = match.end()
+                continue
+        pos += 1
+    result = []
+    for i, (start, keyword) in enumerate(found):
+        end = found[i + 1][0] if i + 1 < len(found) else len(soql)
+        result.append((keyword, soql[start:end].strip()))
+    return result
+
+
+def addCondition(soql, condition):
+    """
+    Returns soql with condition ANDed to its WHERE clause, adding a WHERE
+    clause if it doesn't have one.
+    """
+    parts = clauses(soql)
+    keywords = [k for k, text in parts]
+    out = []
+    for keyword, text in parts:
+        if keyword == 'where':
+            text = 'WHERE ({0}) AND ({1})'.format(
+                text[len('where'):].strip(), condition)
+        out.append(text)
+        if keyword == 'from' and 'where' not in keywords:
+            out.append('WHERE {0}'.format(condition))
+    return ' '.join(out)
+
+
+def boundsQuery(soql, field, descending=False):
+    """
+    Returns a query for the lowest (or highest) non-null value of field
+    among the rows matched by soql.
+    """
+    out = ['SELECT {0}'.format(field)]
+    for keyword, text in clauses(addCondition(soql, field + ' != null')):
+        if keyword in ('from', 'where', 'with'):
+            out.append(text)
+    out.append('ORDER BY {0} {1} LIMIT 1'.format(
+        field, 'DESC' if descending else 'ASC'))
+    return ' '.join(out)
+
+
+def literal(value):
+    """
+    Format an Id, date or datetime as a SOQL literal. Datetimes with a
+    timezone are converted to UTC, naive ones are taken to be UTC already,
+    as the marshaller returns them.
+    """
+    if isinstance(value, datetime.datetime):
+        offset = value.utcoffset()
+        if offset is not None:
+            # astimezone(utc), without needing a utc tzinfo on Python 2
+            value = value.replace(tzinfo=None) - offset
+        return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+    elif isinstance(value, datetime.date):
+        return value.strftime('%Y-%m-%d')
+    return "'{0}'".format(value)
+
+
+def _idToInt(recordId):
+    n = 0
+    for c in recordId[:15]:
+        n = n * 62 + _base62.index(c)
+    return n
+
+
+def _intToId(n):
+    chars = []
+    for _ in range(15):
+        n, r = divmod(n, 62)
+        chars.append(_base62[r])
+    return ''.join(reversed(chars))
+
+
+def splitRange(low, high, partitions):
+    """
+    Returns up to partitions - 1 increasing boundaries strictly between low
+    and high, which may be record Ids, dates or datetimes.
+    """
+    if isinstance(low, datetime.datetime):
+        start = low.replace(microsecond=0)
+        span = (high - start).total_seconds()
+        points = [
+            start + datetime.timedelta(seconds=int(span * i // partitions))
+            for i in range(1, partitions)]
+    elif isinstance(low, datetime.date):
+        span = (high - low).days
+        points = [low + datetime.timedelta(days=span * i // partitions)
+                  for i in range(1, partitions)]
+    else:
+        start, end = _idToInt(low), _idToInt(high)
+        points = [_intToId(start + (end - start) * i // partitions)
+                  for i in range(1, partitions)]
+    boundaries = []
+    for p in points:
+        if low < p and (not boundaries or boundaries[-1] < p):
+            boundaries.append(p)
+    return boundaries
+
+
+def partitionConditions(field, boundaries):
+    """
+    Returns one condition per range between the boundaries. Together they
+    match every row exactly once, including rows where field is null.
+    """
+    if not boundaries:
+        return []
+    literals = [literal(b) for b in boundaries]
+    conditions = ['({0} < {1} OR {0} = null)'.format(field, literals[0])]
+    for lower, upper in zip(literals, literals[1:]):
+        conditions.append('{0} >= {1} AND {0} < {2}'.format(
+            field, lower, upper))
+    conditions.append('{0} >= {1}'.format(field, literals[-1]))
+    return conditions
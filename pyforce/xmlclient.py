@@ -3,19 +3,29 @@ from __future__ import unicode_literals
 
 import datetime
 import gzip
+import itertools
 import logging
+import re
+import threading
+from collections import OrderedDict
 from numbers import Real
+from xml.sax.saxutils import escape
 from xml.sax.saxutils import quoteattr
 from xml.sax.saxutils import XMLGenerator
 from xml.sax.xmlreader import AttributesNSImpl
 
 import requests
+from requests.packages.urllib3.exceptions import ProtocolError
+from requests.packages.urllib3.exceptions import ReadTimeoutError
 from six import binary_type
 from six import BytesIO
 from six import text_type
+from six.moves.collections_abc import Mapping
 from six.moves.urllib.parse import urlparse
 
 from pyforce import xmltramp
+from pyforce.compression import CompressionPolicy
+from pyforce.pool import getDefaultPool
 
 __version__ = '1.4'
 __author__ = "Simon Fell et al. reluctantly forked by idbentley"
@@ -38,31 +48,114 @@ _tSchemaInstanceNS = xmltramp.Namespace(_schemaInstanceNs)
 
 # global config
 # TODO: Re-enable this before shipping
-gzipRequest = True    # are we going to gzip the request ?
+gzipRequest = True    # may requests be gzipped? See CompressionPolicy
 gzipResponse = True   # are we going to tell teh server to gzip the response ?
 
+# the most envelope templates kept, see SoapEnvelope.template
+MAX_TEMPLATES = 256
+
+# the most element names kept with their tags, see _tags
+MAX_TAGS = 4096
+
+# the calls that change nothing on the server, so safe to send again when the
+# connection fails after the request went out
+READ_ONLY_OPERATIONS = frozenset([
+    'describeGlobal', 'describeLayout', 'describeSObjects', 'describeTabs',
+    'getDeleted', 'getServerTimestamp', 'getUpdated', 'getUserInfo', 'login',
+    'query', 'queryMore', 'retrieve', 'search',
+])
+
+# failures reading a streamed response body, which urllib3 raises for
+# socket errors too
+_readErrors = (ProtocolError, ReadTimeoutError)
+
+# the bytes of sObjects serialized at a time by streamed requests
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_templates = OrderedDict()
+_templatesLock = threading.Lock()
+
+# the policy of requests posted without one of their own
+defaultCompression = CompressionPolicy()
+
+_tagCache = {}
+
 _logger = logging.getLogger(__name__)
 
 
 # the main sforce client proxy class
 class Client(object):
-    def __init__(self, serverUrl=None):
+    # pool is the ConnectionPool used for every call, including login. When
+    # it's None, the process-wide pool shared by all clients is used.
+    # compression is the pyforce.compression.CompressionPolicy of requests,
+    # a new default one when it's None. With streamRequests=True create,
+    # update and upsert requests are sent as they are serialized, in chunks,
+    # rather than serialized whole first.
+    def __init__(self, serverUrl=None, pool=None, compression=None,
+                 streamRequests=False):
         self.batchSize = 500
         self.serverUrl = serverUrl or DEFAULT_SERVER_URL
+        self.pool = pool
+        self.compression = compression or CompressionPolicy()
+        self.streamRequests = streamRequests
         self.__conn = None
 
-    def __del__(self):
-        if callable(getattr(self.__conn, 'close', None)):
-            self.__conn.close()
-
     @property
     def conn(self):
-        return self.__conn
+        """
+        The requests.Session calls are sent with once a session is in use,
+        otherwise None. It belongs to the pool, so is shared with the other
+        clients of the pool rather than this client's own.
+        """
+        return self.__conn.session if self.__conn is not None else None
+
+    def close(self):
+        """
+        Closes the connections of the pool given to this client, which opens
+        new ones if it's used again. The process-wide pool is left open for
+        the other clients sharing it.
+        """
+        if self.pool is not None:
+            self.pool.close()
+        self.__conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _getPool(self):
+        return self.pool if self.pool is not None else getDefaultPool()
+
+    @property
+    def instanceUrl(self):
+        """
+        The scheme and host of the server the session belongs to, which
+        serves the REST APIs too.
+        """
+        (scheme, host, path, params, query, frag) = urlparse(self.__serverUrl)
+        return '{0}://{1}'.format(scheme, host)
+
+    @property
+    def apiVersion(self):
+        """The partner API version of the session's server url, e.g. '20.0'"""
+        match = re.search(r'/Soap/u/([0-9.]+)', self.__serverUrl)
+        return match.group(1) if match else None
+
+    @property
+    def orgId(self):
+        """The 15 character id of the session's organization"""
+        return self.sessionId.split('!')[0][:15]
 
     # login, the serverUrl and sessionId are automatically handled, returns the
     # loginResult structure
     def login(self, username, password):
-        lr = LoginRequest(self.serverUrl, username, password).post()
+        lr = LoginRequest(
+            self.serverUrl,
+            username,
+            password
+        ).post(self._getPool(), compression=self.compression)
         self.useSession(str(lr[_tPartnerNS.sessionId]), str(
             lr[_tPartnerNS.serverUrl])
         )
@@ -73,40 +166,42 @@ class Client(object):
     def useSession(self, sessionId, serverUrl):
         self.sessionId = sessionId
         self.__serverUrl = serverUrl
-        (scheme, host, path, params, query, frag) = urlparse(self.__serverUrl)
-        self.__conn = requests.Session()
+        self.__conn = self._getPool()
 
     def logout(self):
         return LogoutRequest(
             self.__serverUrl,
             self.sessionId
-        ).post(self.__conn)
+        ).post(self.__conn, compression=self.compression)
 
     # set the batchSize property on the Client instance to change the batchsize
     # for query/queryMore
-    def query(self, soql):
+    def query(self, soql, handler=None):
         return QueryRequest(
             self.__serverUrl,
             self.sessionId,
             self.batchSize,
             soql
-        ).post(self.__conn)
+        ).post(self.__conn, handler=handler,
+               compression=self.compression)
 
-    def queryMore(self, queryLocator):
+    def queryMore(self, queryLocator, handler=None):
         return QueryMoreRequest(
             self.__serverUrl,
             self.sessionId,
             self.batchSize,
             queryLocator
-        ).post(self.__conn)
+        ).post(self.__conn, handler=handler,
+               compression=self.compression)
 
-    def search(self, sosl):
+    def search(self, sosl, handler=None):
         return SearchRequest(
             self.__serverUrl,
             self.sessionId,
             self.batchSize,
             sosl
-        ).post(self.__conn)
+        ).post(self.__conn, handler=handler,
+               compression=self.compression)
 
     def getUpdated(self, sObjectType, start, end):
         return GetUpdatedRequest(
@@ -115,7 +210,7 @@ class Client(object):
             sObjectType,
             start,
             end
-        ).post(self.__conn)
+        ).post(self.__conn, compression=self.compression)
 
     def getDeleted(self, sObjectType, start, end):
         return GetDeletedRequest(
@@ -124,16 +219,17 @@ class Client(object):
             sObjectType,
             start,
             end
-        ).post(self.__conn)
+        ).post(self.__conn, compression=self.compression)
 
-    def retrieve(self, fields, sObjectType, ids):
+    def retrieve(self, fields, sObjectType, ids, handler=None):
         return RetrieveRequest(
             self.__serverUrl,
             self.sessionId,
             fields,
             sObjectType,
             ids
-        ).post(self.__conn)
+        ).post(self.__conn, handler=handler,
+               compression=self.compression)
 
     # sObjects can be 1 or a list, returns a single save result or a list
     def create(self, sObjects):
@@ -141,7 +237,8 @@ class Client(object):
             self.__serverUrl,
             self.sessionId,
             sObjects
-        ).post(self.__conn)
+        ).post(self.__conn, compression=self.compression,
+               stream=self.streamRequests)
 
     # sObjects can be 1 or a list, returns a single save result or a list
     def update(self, sObjects):
@@ -149,7 +246,8 @@ class Client(object):
             self.__serverUrl,
             self.sessionId,
             sObjects
-        ).post(self.__conn)
+        ).post(self.__conn, compression=self.compression,
+               stream=self.streamRequests)
 
     # sObjects can be 1 or a list, returns a single upsert result or a list
     def upsert(self, externalIdName, sObjects):
@@ -158,7 +256,8 @@ class Client(object):
             self.sessionId,
             externalIdName,
             sObjects
-        ).post(self.__conn)
+        ).post(self.__conn, compression=self.compression,
+               stream=self.streamRequests)
 
     # ids can be 1 or a list, returns a single delete result or a list
     def delete(self, ids):
@@ -166,7 +265,7 @@ class Client(object):
             self.__serverUrl,
             self.sessionId,
             ids
-        ).post(self.__conn)
+        ).post(self.__conn, compression=self.compression)
 
     # sObjectTypes can be 1 or a list, returns a single describe result or a
     # list of them
@@ -175,42 +274,43 @@ class Client(object):
             self.__serverUrl,
             self.sessionId,
             sObjectTypes
-        ).post(self.__conn)
+        ).post(self.__conn, compression=self.compression)
 
     def describeGlobal(self):
         return AuthenticatedRequest(
             self.__serverUrl,
             self.sessionId,
             "describeGlobal"
-        ).post(self.__conn)
+        ).post(self.__conn, compression=self.compression)
 
     def describeLayout(self, sObjectType):
         return DescribeLayoutRequest(
             self.__serverUrl,
             self.sessionId,
             sObjectType
-        ).post(self.__conn)
+        ).post(self.__conn, compression=self.compression)
 
     def describeTabs(self):
         return AuthenticatedRequest(
             self.__serverUrl,
             self.sessionId,
             "describeTabs"
-        ).post(self.__conn, True)
+        ).post(self.__conn, True, compression=self.compression)
 
     def getServerTimestamp(self):
-        return str(AuthenticatedRequest(
+        res = AuthenticatedRequest(
             self.__serverUrl,
             self.sessionId,
             "getServerTimestamp"
-        ).post(self.__conn)[_tPartnerNS.timestamp])
+        ).post(self.__conn, compression=self.compression)
+        return str(res[_tPartnerNS.timestamp])
 
     def resetPassword(self, userId):
         return ResetPasswordRequest(
             self.__serverUrl,
             self.sessionId,
             userId
-        ).post(self.__conn)
+        ).post(self.__conn, compression=self.compression)
 
     def setPassword(self, userId, password):
         SetPasswordRequest(
@@ -218,21 +318,21 @@ class Client(object):
             self.sessionId,
             userId,
             password
-        ).post(self.__conn)
+        ).post(self.__conn, compression=self.compression)
 
     def getUserInfo(self):
         return AuthenticatedRequest(
             self.__serverUrl,
             self.sessionId,
             "getUserInfo"
-        ).post(self.__conn)
+        ).post(self.__conn, compression=self.compression)
 
     def convertLeads(self, convertLeads):
         return ConvertLeadsRequest(
             self.__serverUrl,
             self.sessionId,
             convertLeads
-        ).post(self.__conn)
+        ).post(self.__conn, compression=self.compression)
 
     def sendEmail(self, emails, massType='SingleEmailMessage'):
         """
@@ -255,7 +355,7 @@ class Client(object):
             self.sessionId,
             emails,
             massType
-        ).post(self.__conn)
+        ).post(self.__conn, compression=self.compression)
 
 
 # fixed version of XmlGenerator, handles unqualified attributes correctly
@@ -292,7 +392,7 @@ class BeatBoxXmlGenerator(XMLGenerator):
 # Does a bunch of useful stuff above & beyond XmlGenerator
 # TODO: What does it do, beyond XMLGenerator?
 class XmlWriter(object):
-    def __init__(self, doGzip):
+    def __init__(self, doGzip, startDocument=True):
         self.__buf = BytesIO(binary_type(b''))
         if doGzip:
             self.__gzip = gzip.GzipFile(mode='wb', fileobj=self.__buf)
@@ -301,7 +401,8 @@ class XmlWriter(object):
             stm = self.__buf
             self.__gzip = None
         self.xg = BeatBoxXmlGenerator(stm, "utf-8")
-        self.xg.startDocument()
+        if startDocument:
+            self.xg.startDocument()
         self.__elems = []
 
     def startPrefixMapping(self, prefix, namespace):
@@ -322,21 +423,31 @@ class XmlWriter(object):
         if xmltramp.islst(value):
             for v in value:
                 self.writeElement(namespace, name, v, attrs)
-        elif isinstance(value, dict):
+        elif isinstance(value, (dict, Mapping)):
             self.startElement(namespace, name, attrs)
             if 'type' in value:
                 # Type must always come first, even in embedded objects.
-                type_entry = value['type']
-                self.writeElement(namespace, 'type', type_entry, attrs)
-                del value['type']
+                self.writeElement(namespace, 'type', value['type'], attrs)
             for k, v in value.items():
-                self.writeElement(namespace, k, v, attrs)
+                if k != 'type':
+                    self.writeElement(namespace, k, v, attrs)
             self.endElement()
         else:
             self.startElement(namespace, name, attrs)
             self.characters(value)
             self.endElement()
 
+    # Writes sObjects, a dict or a list of them, as elements of namespace
+    # with their fields in the sObject namespace, type first. The same as
+    # writeElement for each field, but the tags are cached and the text of
+    # all the records is written at once.
+    def writeSObjects(self, namespace, name, sObjects):
+        context = self.xg._current_context
+        pieces = []
+        _appendSObjects(pieces, _tags(context[namespace], name),
+                        context[_sobjectNs], sObjects)
+        self.xg._write(''.join(pieces))
+
     def endElement(self):
         e = self.__elems[-1]
         self.xg.endElementNS(e, e[1])
@@ -350,6 +461,11 @@ class XmlWriter(object):
             s = str(s)
         self.xg.characters(s)
 
+    # returns what has been written so far, which must not be gzipped
+    def getvalue(self):
+        self.xg._flush()
+        return self.__buf.getvalue()
+
     def endDocument(self):
         # from ipdb import set_trace; set_trace()
         self.xg.endDocument()
@@ -358,6 +474,81 @@ class XmlWriter(object):
         return self.__buf.getvalue()
 
 
+def _tags(prefix, name):
+    # the start and end tags of name, in the namespace of prefix
+    names = _tagCache.get(prefix)
+    if names is None:
+        names = _tagCache.setdefault(prefix, {})
+    tags = names.get(name)
+    if tags is None:
+        qname = prefix + ':' + name
+        tags = ('<' + qname + '>', '</' + qname + '>')
+        if len(names) < MAX_TAGS:
+            names[name] = tags
+    return tags
+
+
+def _xmlText(value):
+    # the escaped text XmlWriter.characters writes for value
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        value = value.isoformat()
+    elif isinstance(value, Real):
+        value = str(value)
+    if not value:
+        return ''
+    if not isinstance(value, text_type):
+        value = text_type(value, 'utf-8')
+    return escape(value)
+
+
+def _appendElement(pieces, prefix, name, value):
+    # appends what XmlWriter.writeElement writes for value without attrs
+    if xmltramp.islst(value):
+        for v in value:
+            _appendElement(pieces, prefix, name, v)
+        return
+    start, end = _tags(prefix, name)
+    pieces.append(start)
+    if isinstance(value, (dict, Mapping)):
+        if 'type' in value:
+            _appendElement(pieces, prefix, 'type', value['type'])
+        _appendFields(pieces, prefix, value)
+    else:
+        pieces.append(_xmlText(value))
+    pieces.append(end)
+
+
+def _appendFields(pieces, prefix, sObject):
+    # appends the fields of sObject but its type, with text, the most
+    # common values, written here rather than by _appendElement
+    names = _tagCache.get(prefix, {})
+    append = pieces.append
+    for name, value in sObject.items():
+        if name == 'type':
+            continue
+        if value.__class__ is text_type and name in names:
+            start, end = names[name]
+            append(start)
+            # as escape() does
+            append(value.replace("&", "&amp;").replace("<", "&lt;")
+                   .replace(">", "&gt;"))
+            append(end)
+        else:
+            _appendElement(pieces, prefix, name, value)
+
+
+def _appendSObjects(pieces, tags, prefix, sObjects):
+    if xmltramp.islst(sObjects):
+        for sObject in sObjects:
+            _appendSObjects(pieces, tags, prefix, sObject)
+        return
+    pieces.append(tags[0])
+    # type has to go first
+    _appendElement(pieces, prefix, 'type', sObjects['type'])
+    _appendFields(pieces, prefix, sObjects)
+    pieces.append(tags[1])
+
+
 # exception class for soap faults
 class SoapFaultError(Exception):
     def __init__(self, faultCode, faultString):
@@ -383,14 +574,26 @@ class SessionTimeoutError(Exception):
         return repr(self.faultCode) + " " + repr(self.faultString)
 
 
+def _raiseFault(faultCode, faultString):
+    if faultCode == 'INVALID_SESSION_ID':
+        raise SessionTimeoutError(faultCode, faultString)
+    raise SoapFaultError(faultCode, faultString)
+
+
+# the prefixes of the namespaces of soap envelopes
+_envelopePrefixes = [("s", _envNs), ("p", _partnerNs), ("o", _sobjectNs),
+                     ("x", _schemaInstanceNs)]
+_prefixes = dict((namespace, prefix) for prefix, namespace in _envelopePrefixes)
+
+
 # soap specific stuff ontop of XmlWriter
 class SoapWriter(XmlWriter):
-    def __init__(self):
-        XmlWriter.__init__(self, gzipRequest)
-        self.startPrefixMapping("s", _envNs)
-        self.startPrefixMapping("p", _partnerNs)
-        self.startPrefixMapping("o", _sobjectNs)
-        self.startPrefixMapping("x", _schemaInstanceNs)
+    def __init__(self, doGzip=None):
+        if doGzip is None:
+            doGzip = gzipRequest
+        XmlWriter.__init__(self, doGzip)
+        for prefix, namespace in _envelopePrefixes:
+            self.startPrefixMapping(prefix, namespace)
         self.startElement(_envNs, "Envelope")
 
     def endDocument(self):
@@ -402,6 +605,16 @@ class SoapWriter(XmlWriter):
         return XmlWriter.endDocument(self)
 
 
+# writes the body of an operation, to go between the head and tail of an
+# envelope template, which declare its namespaces
+class BodyWriter(XmlWriter):
+    def __init__(self):
+        XmlWriter.__init__(self, False, startDocument=False)
+        for prefix, namespace in _envelopePrefixes:
+            self.startPrefixMapping(prefix, namespace)
+        self.xg._undeclared_ns_maps = []
+
+
 # processing for a single soap request / response
 class SoapEnvelope(object):
     def __init__(self, serverUrl, operationName,
@@ -416,8 +629,32 @@ class SoapEnvelope(object):
     def writeBody(self, writer):
         pass
 
-    def makeEnvelope(self):
-        s = SoapWriter()
+    # the values writeHeaders writes, which with the operation key the cached
+    # template of the envelope, or None to make the template for each
+    # request. Subclasses writing other headers override this too.
+    def headerKey(self):
+        if self.__class__.writeHeaders is SoapEnvelope.writeHeaders:
+            return ()
+        return None
+
+    # returns the serialized head and tail of the envelope, around its body
+    def template(self):
+        key = self.headerKey()
+        if key is None:
+            return self.makeTemplate()
+        key = (self.__class__, self.operationName, self.clientId) + tuple(key)
+        with _templatesLock:
+            template = _templates.get(key)
+        if template is None:
+            template = self.makeTemplate()
+            with _templatesLock:
+                _templates[key] = template
+                while len(_templates) > MAX_TEMPLATES:
+                    _templates.popitem(last=False)
+        return template
+
+    def makeTemplate(self):
+        s = SoapWriter(doGzip=False)
         s.startElement(_envNs, "Header")
         s.characters("\n")
         s.startElement(_partnerNs, "CallOptions")
@@ -429,19 +666,46 @@ class SoapEnvelope(object):
         s.startElement(_envNs, "Body")
         s.characters("\n")
         s.startElement(_partnerNs, self.operationName)
-        self.writeBody(s)
+        head = s.getvalue()
         s.endElement()  # operation
         s.endElement()  # body
-        return s.endDocument()
+        return head, s.endDocument()[len(head):]
 
-    # does all the grunt work:
-    # * serializes the request
-    # * makes a http request
-    # * passes the response to tramp
-    # * checks for soap fault
-    #  returns the relevant result from the body child
-    # TODO: check for mU='1' headers
-    def post(self, conn=None, alwaysReturnList=False):
+    # yields the serialized body in pieces, by default all of it at once.
+    # Requests with large bodies yield them as they serialize them.
+    def iterBody(self):
+        s = BodyWriter()
+        self.writeBody(s)
+        yield s.endDocument()
+
+    # yields the serialized envelope in pieces, gzipped as a stream by
+    # compression, a CompressionPolicy, if it's given
+    def iterEnvelope(self, compression=None):
+        head, tail = self.template()
+        chunks = itertools.chain([head], self.iterBody(), [tail])
+        if compression is not None:
+            chunks = compression.compressStream(chunks)
+        for chunk in chunks:
+            # an empty chunk would end a chunked request body
+            if chunk:
+                yield chunk
+
+    # serializes the request, writing only its body, into its template
+    def makeEnvelope(self):
+        head, tail = self.template()
+        s = BodyWriter()
+        self.writeBody(s)
+        return head + s.endDocument() + tail
+
+    # returns the body to post, and whether it's gzipped, by compression, a
+    # CompressionPolicy
+    def makeBody(self, compression=None):
+        envelope = self.makeEnvelope()
+        if not gzipRequest:
+            return envelope, False
+        return (compression or defaultCompression).compress(envelope)
+
+    def makeHeaders(self, compressed=False):
         headers = {
             "User-Agent": "Pyforce/{0}".format(__version__),
             "SOAPAction": '""',
@@ -449,44 +713,99 @@ class SoapEnvelope(object):
         }
         if gzipResponse:
             headers['accept-encoding'] = 'gzip'
-        if gzipRequest:
+        if compressed:
             headers['content-encoding'] = 'gzip'
+        return headers
+
+    # does all the grunt work:
+    # * serializes the request
+    # * makes a http request
+    # * passes the response to tramp
+    # * checks for soap fault
+    #  returns the relevant result from the body child
+    # The whole call is made again if reading the response fails, for read
+    # only operations, as long as the handler hasn't emitted any records.
+    # TODO: check for mU='1' headers
+    def post(self, conn=None, alwaysReturnList=False, handler=None,
+             compression=None, stream=False):
+        if stream:
+            # serialized as it is sent, and afresh for any retries. The size
+            # isn't known up front, so the policy's threshold doesn't apply.
+            compression = compression or defaultCompression
+            compressed = gzipRequest and compression.level > 0
+
+            def makeData():
+                return self.iterEnvelope(compression if compressed else None)
+        else:
+            # serialized once, and sent again by any retries
+            envelope, compressed = self.makeBody(compression)
+
+            def makeData():
+                return envelope
+        headers = self.makeHeaders(compressed)
         max_attempts = 3
-        response = None
         attempt = 1
         if conn is None:
             # Use a stateless connection
             conn = requests
+        while True:
+            response, attempt = self._send(conn, makeData, headers, attempt,
+                                           max_attempts)
+            # feed the (gunzipped) body straight to the parser as it
+            # arrives, rather than buffering and decoding it first.
+            response.raw.decode_content = True
+            try:
+                return self.parseResponse(response.raw, alwaysReturnList,
+                                          handler)
+            except _readErrors:
+                if (attempt >= max_attempts or
+                        self.operationName not in READ_ONLY_OPERATIONS or
+                        (handler is not None and
+                         getattr(handler, 'emitted', 1))):
+                    raise
+                _logger.debug("reading the %s response failed, retrying",
+                              self.operationName, exc_info=True)
+                if handler is not None:
+                    handler.restart()
+                attempt += 1
+            finally:
+                response.close()
+
+    def _send(self, conn, makeData, headers, attempt, max_attempts):
+        # posts the request, retrying connection errors, and returns the
+        # streamed response and the attempt it took
         conn_error = None
-        while response is None and attempt <= max_attempts:
+        while attempt <= max_attempts:
             try:
-                envelope = self.makeEnvelope()
-                # TODO: Can we just use the URL here?
-                # response = conn.post(self.serverUrl, data=binary_type(envelope), headers=headers)
-                response = conn.post(
+                return conn.post(
                     self.serverUrl,
-                    data=envelope,
+                    data=makeData(),
                     headers=headers,
-                )
+                    stream=True,
+                ), attempt
             except requests.exceptions.ConnectionError as ex:
                 attempt += 1
                 conn_error = ex
-        if response is None:
-            if conn_error:
-                raise conn_error
-            raise RuntimeError('No response from Salesforce')
-        tramp = xmltramp.parse(response.text)
+        if conn_error:
+            raise conn_error
+        raise RuntimeError('No response from Salesforce')
+
+    # parses a response body, which can be text, bytes or a binary file-like
+    # object, raising any soap fault it contains, and returns the relevant
+    # result from the body child. Given a SAX handler, such as a
+    # pyforce.records.RecordHandler, the body is parsed with it instead,
+    # and the handler is returned.
+    def parseResponse(self, body, alwaysReturnList=False, handler=None):
+        if handler is not None:
+            return xmltramp.parseWith(body, handler)
+        tramp = xmltramp.parseWith(body, xmltramp.Seeder()).result
         try:
-            faultString = text_type(
-                tramp[_tSoapNS.Body][_tSoapNS.Fault].faultstring)
-            faultCode = text_type(
-                tramp[_tSoapNS.Body][_tSoapNS.Fault].faultcode).split(':')[-1]
-            if faultCode == 'INVALID_SESSION_ID':
-                raise SessionTimeoutError(faultCode, faultString)
-            else:
-                raise SoapFaultError(faultCode, faultString)
+            fault = tramp[_tSoapNS.Body][_tSoapNS.Fault]
         except KeyError:
-            pass
+            fault = None
+        if fault is not None:
+            _raiseFault(text_type(fault.faultcode).split(':')[-1],
+                        text_type(fault.faultstring))
         # first child of body is XXXXResponse
         result = tramp[_tSoapNS.Body][0]
         # it contains either a single child, or for a batch call multiple
@@ -521,18 +840,30 @@ class AuthenticatedRequest(SoapEnvelope):
         s.writeElement(_partnerNs, "sessionId", self.sessionId)
         s.endElement()
 
+    def headerKey(self):
+        return (self.sessionId,)
+
     def writeSObjects(self, s, sObjects, elemName="sObjects"):
-        if xmltramp.islst(sObjects):
-            for o in sObjects:
-                self.writeSObjects(s, o, elemName)
-        else:
-            s.startElement(_partnerNs, elemName)
-            # type has to go first
-            s.writeElement(_sobjectNs, "type", sObjects['type'])
-            for fn in sObjects.keys():
-                if (fn != 'type'):
-                    s.writeElement(_sobjectNs, fn, sObjects[fn])
-            s.endElement()
+        s.writeSObjects(_partnerNs, elemName, sObjects)
+
+    # yields sObjects serialized as writeSObjects does, in UTF-8 chunks of
+    # about STREAM_CHUNK_SIZE bytes
+    def iterSObjects(self, sObjects, elemName="sObjects"):
+        if not xmltramp.islst(sObjects):
+            sObjects = [sObjects]
+        tags = _tags(_prefixes[_partnerNs], elemName)
+        prefix = _prefixes[_sobjectNs]
+        pieces = []
+        size = 0
+        for sObject in sObjects:
+            start = len(pieces)
+            _appendSObjects(pieces, tags, prefix, sObject)
+            size += sum(len(p) for p in pieces[start:])
+            if size >= STREAM_CHUNK_SIZE:
+                yield ''.join(pieces).encode('utf-8')
+                pieces = []
+                size = 0
+        yield ''.join(pieces).encode('utf-8')
 
 
 class LogoutRequest(AuthenticatedRequest):
@@ -552,6 +883,9 @@ class QueryOptionsRequest(AuthenticatedRequest):
         s.writeElement(_partnerNs, "batchSize", self.batchSize)
         s.endElement()
 
+    def headerKey(self):
+        return (self.sessionId, self.batchSize)
+
 
 class QueryRequest(QueryOptionsRequest):
     def __init__(self, serverUrl, sessionId, batchSize, soql):
@@ -615,6 +949,13 @@ class UpsertRequest(AuthenticatedRequest):
                        self.__externalIdName)
         self.writeSObjects(s, self.__sObjects)
 
+    def iterBody(self):
+        s = BodyWriter()
+        s.writeElement(_partnerNs, "externalIDFieldName",
+                       self.__externalIdName)
+        return itertools.chain([s.endDocument()],
+                               self.iterSObjects(self.__sObjects))
+
 
 class UpdateRequest(AuthenticatedRequest):
     def __init__(self, serverUrl, sessionId, sObjects, operationName="update"):
@@ -625,6 +966,9 @@ class UpdateRequest(AuthenticatedRequest):
     def writeBody(self, s):
         self.writeSObjects(s, self.__sObjects)
 
+    def iterBody(self):
+        return self.iterSObjects(self.__sObjects)
+
 
 class CreateRequest(UpdateRequest):
     def __init__(self, serverUrl, sessionId, sObjects):
@@ -0,0 +1,305 @@
+"""
+Parser backends feeding namespace aware SAX events to a ContentHandler,
+such as xmltramp.Seeder or pyforce.records.RecordHandler.
+
+Every backend keeps the protections of defusedxml: entity declarations and
+external references are refused rather than expanded or fetched. Unless
+another is asked for, the first available in BACKEND_PREFERENCE is used.
+
+Handlers get the events of the SAX driver with the namespaces feature on.
+The expat and lxml backends pass startElementNS a plain dict of
+(uri, localname) names to values as attrs, rather than an AttributesNSImpl,
+and None as the qname of elements, so handlers should only use what both
+offer, like attrs.get and attrs.items.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from xml.sax import SAXParseException
+from xml.sax.handler import feature_namespaces
+from xml.sax.xmlreader import Locator
+
+from defusedxml.common import DTDForbidden
+from defusedxml.common import EntitiesForbidden
+from defusedxml.common import ExternalReferenceForbidden
+from defusedxml.sax import make_parser
+from six import binary_type
+from six import BytesIO
+from six import ensure_str
+from six import StringIO
+from six import text_type
+
+try:
+    from xml.parsers import expat
+except ImportError:  # Python built without pyexpat
+    expat = None
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+# bytes read from a file-like source at a time
+CHUNK_SIZE = 64 * 1024
+
+# backends by name, in order of preference. This is fixed rather than
+# measured at import: expat and lxml parse SOAP responses at about the same
+# speed, and expat needs nothing but the standard library, while the sax
+# driver is much slower (see tests/benchmark_test.py)
+BACKEND_PREFERENCE = ('expat', 'lxml', 'sax')
+
+_defaultBackend = None
+
+
+class ParserBackend(object):
+    """
+    The interface of parser backends. parse feeds source, which can be
+    text, bytes or a file-like object, to handler as the SAX events of a
+    parser with the namespaces feature on.
+    """
+    name = None
+
+    @classmethod
+    def available(cls):
+        return True
+
+    def parse(self, source, handler):
+        raise NotImplementedError
+
+
+class SaxBackend(ParserBackend):
+    """The defusedxml SAX driver, which pyforce has always used"""
+    name = 'sax'
+
+    @classmethod
+    def available(cls):
+        return expat is not None
+
+    def parse(self, source, handler):
+        if isinstance(source, binary_type):
+            source = BytesIO(source)
+        elif not hasattr(source, 'read'):
+            source = StringIO(ensure_str(source))
+        parser = make_parser()
+        parser.setFeature(feature_namespaces, 1)
+        parser.setContentHandler(handler)
+        parser.parse(source)
+
+
+class ExpatBackend(ParserBackend):
+    """
+    Drives pyexpat directly, with buffered text and names split once per
+    distinct name, rather than through the xml.sax driver's wrappers.
+    """
+    name = 'expat'
+
+    @classmethod
+    def available(cls):
+        return expat is not None
+
+    def parse(self, source, handler):
+        parser = expat.ParserCreate(namespace_separator=' ')
+        parser.buffer_text = True
+        parser.buffer_size = CHUNK_SIZE
+        qname = _NameCache(' ').__getitem__
+        startElementNS = handler.startElementNS
+        endElementNS = handler.endElementNS
+
+        def startElement(name, attrs):
+            if attrs:
+                attrs = dict((qname(k), v) for k, v in attrs.items())
+            startElementNS(qname(name), None, attrs)
+
+        def endElement(name):
+            endElementNS(qname(name), None)
+
+        parser.StartElementHandler = startElement
+        parser.EndElementHandler = endElement
+        parser.CharacterDataHandler = handler.characters
+        parser.StartNamespaceDeclHandler = handler.startPrefixMapping
+        parser.EndNamespaceDeclHandler = handler.endPrefixMapping
+        parser.EntityDeclHandler = _forbidEntity
+        parser.UnparsedEntityDeclHandler = _forbidUnparsedEntity
+        parser.ExternalEntityRefHandler = _forbidExternal
+
+        handler.startDocument()
+        try:
+            for chunk in _chunks(source):
+                parser.Parse(chunk, False)
+            parser.Parse(b'', True)
+        except expat.ExpatError as e:
+            raise _parseError(expat.ErrorString(e.code), e,
+                              e.lineno, e.offset)
+        handler.endDocument()
+
+
+class LxmlBackend(ParserBackend):
+    """
+    Drives lxml's parser with a target object, so no tree is built, and
+    with entity resolution, network access and DTD loading turned off.
+    SOAP messages can't have a DTD, so any doctype is refused.
+    """
+    name = 'lxml'
+
+    @classmethod
+    def available(cls):
+        return etree is not None
+
+    def parse(self, source, handler):
+        parser = etree.XMLParser(
+            target=_LxmlTarget(handler),
+            resolve_entities=False,
+            no_network=True,
+            load_dtd=False,
+        )
+        handler.startDocument()
+        try:
+            for chunk in _chunks(source):
+                if isinstance(chunk, text_type):
+                    chunk = chunk.encode('utf-8')
+                parser.feed(chunk)
+            parser.close()
+        except etree.XMLSyntaxError as e:
+            line, column = e.position
+            raise _parseError(e.msg, e, line, column)
+        handler.endDocument()
+
+
+class _LxmlTarget(object):
+    """Passes the calls of an lxml parser on to a SAX handler"""
+
+    def __init__(self, handler):
+        qname = _NameCache().__getitem__
+        startElementNS = handler.startElementNS
+        endElementNS = handler.endElementNS
+        startPrefixMapping = handler.startPrefixMapping
+        endPrefixMapping = handler.endPrefixMapping
+
+        def start(tag, attrib):
+            attrs = {}
+            if attrib:
+                attrs = dict((qname(k), v) for k, v in attrib.items())
+            startElementNS(qname(tag), None, attrs)
+
+        def end(tag):
+            endElementNS(qname(tag), None)
+
+        def start_ns(prefix, uri):
+            startPrefixMapping(prefix or None, uri)
+
+        def end_ns(prefix):
+            endPrefixMapping(prefix or None)
+
+        self.start = start
+        self.end = end
+        self.data = handler.characters
+        self.start_ns = start_ns
+        self.end_ns = end_ns
+
+    def doctype(self, name, pubid, system):
+        raise DTDForbidden(name, system, pubid)
+
+    def close(self):
+        pass
+
+
+class _NameCache(dict):
+    """
+    Maps the names a parser reports, like '{uri}local' or 'uri local', to
+    (uri, local) pairs, splitting each distinct name once.
+    """
+
+    def __init__(self, separator=None):
+        dict.__init__(self)
+        self.separator = separator
+
+    def __missing__(self, name):
+        if self.separator is None:
+            if name[:1] == '{':
+                uri, local = name[1:].split('}', 1)
+                pair = (uri, local)
+            else:
+                pair = (None, name)
+        else:
+            parts = name.split(self.separator)
+            pair = (parts[0], parts[1]) if len(parts) == 2 else (None, name)
+        self[name] = pair
+        return pair
+
+
+class _ErrorLocator(Locator):
+    def __init__(self, line, column):
+        self.line = line
+        self.column = column
+
+    def getLineNumber(self):
+        return self.line
+
+    def getColumnNumber(self):
+        return self.column
+
+
+def _parseError(message, exception, line, column):
+    # every backend reports malformed documents as the SAX driver does
+    return SAXParseException(message, exception, _ErrorLocator(line, column))
+
+
+def _forbidEntity(name, is_parameter_entity, value, base, sysid, pubid,
+                  notation_name):
+    raise EntitiesForbidden(name, value, base, sysid, pubid, notation_name)
+
+
+def _forbidUnparsedEntity(name, base, sysid, pubid, notation_name):
+    raise EntitiesForbidden(name, None, base, sysid, pubid, notation_name)
+
+
+def _forbidExternal(context, base, sysid, pubid):
+    raise ExternalReferenceForbidden(context, base, sysid, pubid)
+
+
+def _chunks(source):
+    if isinstance(source, (binary_type, text_type)):
+        yield source
+        return
+    read = source.read
+    while True:
+        chunk = read(CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+BACKENDS = dict((b.name, b) for b in (SaxBackend, ExpatBackend, LxmlBackend))
+
+
+def availableBackends():
+    """The names of the backends which can be used here, preferred first"""
+    return [n for n in BACKEND_PREFERENCE if BACKENDS[n].available()]
+
+
+def getBackend(name=None):
+    """
+    Returns the backend called name, or with no name the default: the one
+    given to setDefaultBackend, or else the first available in
+    BACKEND_PREFERENCE.
+    """
+    if name is None:
+        if _defaultBackend is not None:
+            return _defaultBackend
+        name = availableBackends()[0]
+    try:
+        backend = BACKENDS[name]
+    except KeyError:
+        raise ValueError('unknown parser backend {0!r}'.format(name))
+    if not backend.available():
+        raise ValueError('parser backend {0!r} is not available'.format(name))
+    return backend()
+
+
+def setDefaultBackend(name=None):
+    """
+    Makes the backend called name the one used by default, or goes back to
+    BACKEND_PREFERENCE with no name.
+    """
+    global _defaultBackend
+    _defaultBackend = getBackend(name) if name is not None else None
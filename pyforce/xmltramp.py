@@ -5,15 +5,13 @@ from xml.sax.handler import ContentHandler
 from xml.sax.handler import DTDHandler
 from xml.sax.handler import EntityResolver
 from xml.sax.handler import ErrorHandler
-from xml.sax.handler import feature_namespaces
 
 import defusedxml
-from defusedxml.sax import make_parser
-from six import ensure_str
 from six import string_types
-from six import StringIO
 from six import text_type
 
+from pyforce.xmlparser import getBackend
+
 __version__ = "2.18-pyforce"
 __author__ = "Aaron Swartz"
 __credits__ = "Many thanks to pjz, bitsko, and DanC. And many changes since pyforce covered in git"
@@ -50,7 +48,28 @@ def quote(myitem, elt=True):
     return myitem
 
 
+# elements with fewer children than this are searched without an index
+INDEX_MIN_CHILDREN = 8
+
+_noChildren = ()
+
+# inverted prefix maps, shared by every element in the same namespace scope
+_prefixMaps = {}
+
+
+def _invertPrefixes(prefixes):
+    key = frozenset(prefixes.items())
+    inverted = _prefixMaps.get(key)
+    if inverted is None:
+        inverted = dict(zip(prefixes.values(), prefixes.keys()))
+        if len(_prefixMaps) < 1024:
+            _prefixMaps[key] = inverted
+    return inverted
+
+
 class Element(object):
+    __slots__ = ('_name', '_attrs', '_dir', '_prefixes', '_dNS', '_index')
+
     def __init__(self, name, attrs=None, children=None, prefixes=None):
         if islst(name) and name[0] is None:
             name = name[1]
@@ -66,15 +85,38 @@ class Element(object):
         self._name = name
         self._attrs = attrs or {}
         self._dir = children or []
+        self._index = None
 
+        # the inverted map is shared, and must not be changed in place
         prefixes = prefixes or {}
-        self._prefixes = dict(zip(prefixes.values(), prefixes.keys()))
+        self._prefixes = _invertPrefixes(prefixes)
 
         if prefixes:
             self._dNS = prefixes.get(None, None)
         else:
             self._dNS = None
 
+    def _named(self, n):
+        """
+        Returns the child elements named n, as a sequence which must not be
+        changed.
+        """
+        children = self._dir
+        index = self._index
+        # the index is rebuilt if _dir has been replaced or grown since
+        if index is not None and index[0] is children and \
+                index[1] == len(children):
+            return index[2].get(n, _noChildren)
+        if len(children) < INDEX_MIN_CHILDREN:
+            return [x for x in children
+                    if isinstance(x, Element) and x._name == n]
+        named = {}
+        for x in children:
+            if isinstance(x, Element):
+                named.setdefault(x._name, []).append(x)
+        self._index = (children, len(children), named)
+        return named.get(n, _noChildren)
+
     def __repr__(self, recursive=0, multiline=0, inprefixes=None):
         def qname(name, inprefixes):
             if islst(name):
@@ -166,9 +208,9 @@ class Element(object):
             )
         if self._dNS:
             n = (self._dNS, n)
-        for x in self._dir:
-            if isinstance(x, Element) and x._name == n:
-                return x
+        found = self._named(n)
+        if found:
+            return found[0]
         raise AttributeError('No child element named %s' % repr(n))
 
     def __hasattr__(self, n):
@@ -179,11 +221,16 @@ class Element(object):
 
     def __setattr__(self, n, v):
         if n[0] == '_':
-            self.__dict__[n] = v
+            object.__setattr__(self, n, v)
         else:
             self[n] = v
 
     def __getitem__(self, n):
+        if n.__class__ is tuple and len(n) == 2:  # d[(ns, 'foo')], the usual
+            found = self._named(n)
+            if found:
+                return found[0]
+            raise KeyError(n)
         if isinstance(n, int):  # d[1] == d._dir[1]
             return self._dir[n]
         elif isinstance(n, slice) and (
@@ -194,22 +241,19 @@ class Element(object):
             n = n[0]
             if self._dNS and not islst(n):
                 n = (self._dNS, n)
-            out = []
-            for x in self._dir:
-                if isinstance(x, Element) and x._name == n:
-                    out.append(x)
-            return out
+            return list(self._named(n))
         elif n is None:
             return self._dir
         else:  # d['foo'] == first <foo>
             if self._dNS and not islst(n):
                 n = (self._dNS, n)
-            for x in self._dir:
-                if isinstance(x, Element) and x._name == n:
-                    return x
+            found = self._named(n)
+            if found:
+                return found[0]
         raise KeyError(n)
 
     def __setitem__(self, n, v):
+        self._index = None
         if isinstance(n, type(0)):  # d[1]
             self._dir[n] = v
         elif isinstance(n, tuple) and len(n) == 1:
@@ -243,6 +287,7 @@ class Element(object):
                 del self[i]
 
     def __delitem__(self, n):
+        self._index = None
         if isinstance(n, type(0)):
             del self._dir[n]
         elif isinstance(n, slice(0).__class__):
@@ -291,42 +336,49 @@ class Namespace(object):
 class Seeder(EntityResolver, DTDHandler, ContentHandler, ErrorHandler):
     def __init__(self):
         self.stack = []
-        self.ch = ''
+        # text since the last tag, in the pieces the parser reported
+        self.ch = []
         self.prefixes = {}
+        self.scope = None
         ContentHandler.__init__(self)
 
     def startPrefixMapping(self, prefix, uri):
+        self.scope = None
         if not prefix in self.prefixes.keys():
             self.prefixes[prefix] = []
         self.prefixes[prefix].append(uri)
 
     def endPrefixMapping(self, prefix):
+        self.scope = None
         self.prefixes[prefix].pop()
         # szf: 5/15/5
         if len(self.prefixes[prefix]) == 0:
             del self.prefixes[prefix]
 
+    def _flush(self):
+        if self.ch:
+            ch = ''.join(self.ch)
+            self.ch = []
+            if not ch.isspace():
+                self.stack[-1]._dir.append(ch)
+
     def startElementNS(self, name, qname, attrs):
-        ch = self.ch
-        self.ch = ''
-        if ch and not ch.isspace():
-            self.stack[-1]._dir.append(ch)
+        self._flush()
 
         attrs = dict(attrs)
-        newprefixes = {}
-        for k in self.prefixes.keys():
-            newprefixes[k] = self.prefixes[k][-1]
+        # the prefixes in scope only change with prefix mappings
+        if self.scope is None:
+            self.scope = {}
+            for k in self.prefixes.keys():
+                self.scope[k] = self.prefixes[k][-1]
 
-        self.stack.append(Element(name, attrs, prefixes=newprefixes.copy()))
+        self.stack.append(Element(name, attrs, prefixes=self.scope))
 
     def characters(self, ch):
-        self.ch += ch
+        self.ch.append(ch)
 
     def endElementNS(self, name, qname):
-        ch = self.ch
-        self.ch = ''
-        if ch and not ch.isspace():
-            self.stack[-1]._dir.append(ch)
+        self._flush()
 
         element = self.stack.pop()
         if self.stack:
@@ -335,17 +387,23 @@ class Seeder(EntityResolver, DTDHandler, ContentHandler, ErrorHandler):
             self.result = element
 
 
-def seed(fileobj):
-    seeder = Seeder()
-    parser = make_parser()
-    parser.setFeature(feature_namespaces, 1)
-    parser.setContentHandler(seeder)
-    parser.parse(fileobj)
-    return seeder.result
+def parseWith(source, handler, backend=None):
+    """
+    Feeds source, which can be text, bytes or a file-like object, to the
+    namespace aware SAX handler, with the parser backend called backend or
+    the default one (see pyforce.xmlparser), and returns handler.
+    """
+    getBackend(backend).parse(source, handler)
+    return handler
+
+
+def seed(fileobj, backend=None):
+    return parseWith(fileobj, Seeder(), backend).result
 
 
-def parse(text):
-    return seed(StringIO(ensure_str(text)))
+def parse(text, backend=None):
+    # bytes are decoded by the parser, rather than keeping a decoded copy
+    return parseWith(text, Seeder(), backend).result
 
 
 def load(url):
@@ -7,7 +7,16 @@ setup(
     name='pyforce',
     version='1.9.1',
     install_requires=['defusedxml>=0.5.0', 'requests>=2.0.0', 'six>=1.10.0', ],
+    extras_require={
+        'lxml': ['lxml>=4.4.0'],
+        'numpy': ['numpy'],
+        'pandas': ['numpy', 'pandas'],
+        'arrow': ['numpy', 'pyarrow'],
+    },
     packages=['pyforce'],
+    entry_points={
+        'console_scripts': ['pyforce-export = pyforce.export:main'],
+    },
     author="Simon Fell et al.  reluctantly Forked by idbentley",
     author_email='ian.bentley@gmail.com, alanjcastonguay@gmail.com',
     description="A Python client wrapping the Salesforce.com SOAP API",
@@ -0,0 +1,274 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import asyncio
+import threading
+import unittest
+
+from pyforce.aioclient import AsyncClient
+from pyforce.aioclient import AsyncConnectionPool
+from pyforce.aioclient import AsyncResponse
+from pyforce.aioclient import HttpStatusError
+from pyforce.aioclient import ResponseLostError
+from pyforce.compression import CompressionPolicy
+from tests.util import describeSObjectXml
+from tests.util import FakeSalesforce
+from tests.util import queryResultXml
+from tests.util import saveResultXml
+from tests.util import sObjectXml
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def contact(n):
+    return sObjectXml('Contact', [
+        ('Id', '003%015d' % n),
+        ('LastName', 'Doe %d' % n),
+        ('Favorite_Integer__c', n),
+    ])
+
+
+class TestAsyncClient(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeSalesforce().start()
+        self.fake.responses['describeSObjects'] = describeSObjectXml(
+            'Contact',
+            [('Id', 'id'), ('LastName', 'string'),
+             ('Favorite_Integer__c', 'int')],
+        )
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def testLoginAndQuery(self):
+        self.fake.responses['query'] = queryResultXml(
+            [contact(1), contact(2)])
+
+        async def go():
+            async with AsyncClient(self.fake.loginUrl) as svc:
+                login = await svc.login('username', 'password')
+                self.assertEqual(login['userInfo']['userFullName'],
+                                 'John Doe')
+                return await svc.query('SELECT Id FROM Contact')
+
+        res = run(go())
+        self.assertEqual(res.size, 2)
+        self.assertTrue(res.done)
+        self.assertEqual(res[1].LastName, 'Doe 2')
+        self.assertEqual(res[1].Favorite_Integer__c, 2)
+
+    def testSearchAndRetrieve(self):
+        self.fake.responses['search'] = (
+            '<result><searchRecords>' + contact(1).replace(
+                'records', 'record') + '</searchRecords></result>')
+        self.fake.responses['retrieve'] = contact(2).replace(
+            'records', 'result')
+
+        async def go():
+            async with AsyncClient(self.fake.loginUrl) as svc:
+                await svc.login('username', 'password')
+                found = await svc.search('FIND {Doe} RETURNING Contact')
+                retrieved = await svc.retrieve(
+                    'LastName, Favorite_Integer__c', 'Contact',
+                    ['003000000000000002'])
+                return found, retrieved
+
+        found, retrieved = run(go())
+        self.assertEqual(found[0].Favorite_Integer__c, 1)
+        self.assertEqual(retrieved, [{'LastName': 'Doe 2',
+                                      'Favorite_Integer__c': 2}])
+        self.assertEqual(self.fake.operations().count('describeSObjects'), 2)
+
+    def testConcurrentCalls(self):
+        self.fake.responses['getServerTimestamp'] = (
+            '<result><timestamp>2020-01-01T00:00:00.000Z</timestamp></result>'
+        )
+
+        async def go():
+            async with AsyncClient(self.fake.loginUrl) as svc:
+                svc.pool.maxPerHost = 4
+                await svc.login('username', 'password')
+                results = await asyncio.gather(
+                    *[svc.getServerTimestamp() for _ in range(50)])
+                return results, svc.pool.stats()
+
+        results, stats = run(go())
+        self.assertEqual(set(results), set(['2020-01-01T00:00:00.000Z']))
+        self.assertEqual(stats['requests'], 51)
+        self.assertTrue(stats['misses'] <= 4)
+        self.assertTrue(self.fake.connections <= 4)
+
+    def testQueryPages(self):
+        self.fake.responses['query'] = queryResultXml(
+            [contact(1), contact(2)], done=False, queryLocator='01gA-2',
+            size=3)
+        self.fake.responses['queryMore'] = queryResultXml(
+            [contact(3)], size=3)
+
+        async def go():
+            async with AsyncClient(self.fake.loginUrl) as svc:
+                await svc.login('username', 'password')
+                pages = []
+                async for page in svc.queryPages('SELECT Id FROM Contact'):
+                    pages.append([r.LastName for r in page])
+                return pages
+
+        self.assertEqual(run(go()), [['Doe 1', 'Doe 2'], ['Doe 3']])
+        queryMore = [r for r in self.fake.requests
+                     if r.operationName == 'queryMore'][0]
+        self.assertEqual(str(queryMore.operation[0]), '01gA-2')
+
+    def testCreate(self):
+        self.fake.responses['create'] = (
+            saveResultXml('003000000000001AAA') +
+            saveResultXml(None, success=False))
+
+        async def go():
+            async with AsyncClient(self.fake.loginUrl) as svc:
+                await svc.login('username', 'password')
+                return await svc.create([
+                    dict(type='Contact', LastName='Doe'),
+                    dict(type='Contact', LastName=None),
+                ])
+
+        res = run(go())
+        self.assertTrue(res[0]['success'])
+        self.assertEqual(res[0]['id'], '003000000000001AAA')
+        self.assertFalse(res[1]['success'])
+        self.assertEqual(res[1]['errors'][0]['statusCode'],
+                         'FIELD_CUSTOM_VALIDATION_EXCEPTION')
+
+    def testCompressionOffThread(self):
+        policy = CompressionPolicy(threshold=0, offThreadSize=1000)
+        compress = policy.compress
+        threads = []
+
+        def recordThread(data):
+            threads.append(threading.current_thread())
+            return compress(data)
+        policy.compress = recordThread
+        self.fake.responses['create'] = saveResultXml('003000000000001AAA')
+
+        async def go():
+            async with AsyncClient(self.fake.loginUrl,
+                                   compression=policy) as svc:
+                await svc.login('username', 'password')
+                await svc.create([dict(type='Contact', LastName='Doe %d' % n)
+                                  for n in range(20)])
+
+        run(go())
+        main = threading.current_thread()
+        # the small login inline, the large create in the executor
+        self.assertTrue(threads[0] is main)
+        self.assertFalse(threads[1] is main)
+        self.assertEqual(policy.stats()['compressed'], 2)
+        self.assertEqual(self.fake.requests[1].operationName, 'create')
+
+
+class FailingPool(AsyncConnectionPool):
+    """Fails the posts after login with errors in turn, None sends them"""
+
+    def __init__(self, errors):
+        AsyncConnectionPool.__init__(self)
+        self.errors = [None] + errors
+        self.posts = 0
+
+    async def post(self, url, data=b'', headers=None):
+        self.posts += 1
+        error = self.errors.pop(0) if self.errors else None
+        if isinstance(error, AsyncResponse):
+            return error
+        if error is not None:
+            raise error
+        return await AsyncConnectionPool.post(self, url, data, headers)
+
+
+class TestFailures(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeSalesforce().start()
+        self.fake.responses['query'] = queryResultXml([])
+        self.fake.responses['create'] = saveResultXml('003000000000001AAA')
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def call(self, pool, method, *args):
+        async def go():
+            async with AsyncClient(self.fake.loginUrl, pool=pool) as svc:
+                await svc.login('username', 'password')
+                return await getattr(svc, method)(*args)
+        return run(go())
+
+    def testRetriesUnsentRequests(self):
+        pool = FailingPool([ConnectionResetError()])
+        res = self.call(pool, 'create', [dict(type='Contact')])
+        self.assertTrue(res[0]['success'])
+        self.assertEqual(pool.posts, 3)
+
+    def testRetriesSentReadOnlyRequests(self):
+        pool = FailingPool([ResponseLostError()])
+        res = self.call(pool, 'query', 'SELECT Id FROM Contact')
+        self.assertEqual(res.size, 0)
+        self.assertEqual(pool.posts, 3)
+
+    def testDoesNotResendWrites(self):
+        pool = FailingPool([ResponseLostError()])
+        with self.assertRaises(ResponseLostError):
+            self.call(pool, 'create', [dict(type='Contact')])
+        self.assertEqual(pool.posts, 2)
+        self.assertEqual(self.fake.operations(), ['login'])
+
+    def testLostResponse(self):
+        async def serve(reader, writer):
+            await reader.readline()
+            writer.close()
+
+        async def go():
+            server = await asyncio.start_server(serve, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            try:
+                await AsyncConnectionPool().post(
+                    'http://127.0.0.1:{0}/'.format(port), b'<x/>')
+            finally:
+                server.close()
+
+        with self.assertRaises(ResponseLostError):
+            run(go())
+
+    def testResponseTimeout(self):
+        async def serve(reader, writer):
+            await reader.readline()
+            await asyncio.sleep(10)
+
+        async def go():
+            server = await asyncio.start_server(serve, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            try:
+                await AsyncConnectionPool(readTimeout=0.1).post(
+                    'http://127.0.0.1:{0}/'.format(port), b'<x/>')
+            finally:
+                server.close()
+
+        with self.assertRaises(ResponseLostError) as cm:
+            run(go())
+        self.assertIn('Timed out', str(cm.exception))
+
+    def testHttpStatus(self):
+        pool = FailingPool([AsyncResponse(
+            502, {'content-type': 'text/html'}, b'<html>', 'Bad Gateway')])
+        with self.assertRaises(HttpStatusError) as cm:
+            self.call(pool, 'query', 'SELECT Id FROM Contact')
+        self.assertEqual(cm.exception.status, 502)
+        self.assertIn('HTTP 502 Bad Gateway', str(cm.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import datetime
+import unittest
+
+from six import BytesIO
+
+import pyforce
+from pyforce import arrow
+from tests.util import describeSObjectXml
+from tests.util import FakeSalesforce
+from tests.util import queryResultXml
+from tests.util import sObjectXml
+
+OPPORTUNITY_FIELDS = [
+    ('Id', 'id'),
+    ('Name', 'string'),
+    ('Amount', 'currency'),
+    ('Quantity__c', 'int'),
+    ('IsWon', 'boolean'),
+    ('CloseDate', 'date'),
+    ('LastModifiedDate', 'datetime'),
+    ('Stages__c', 'multipicklist'),
+    ('Attachment__c', 'base64'),
+]
+
+
+def opportunityXml(n):
+    return sObjectXml('Opportunity', [
+        ('Id', '006%015d' % n),
+        ('Id', '006%015d' % n),
+        ('Name', 'Deal %d' % n),
+        ('Amount', '%d.5' % n),
+        ('Quantity__c', n if n % 3 else None),
+        ('IsWon', n % 2 == 0),
+        ('CloseDate', '2020-01-%02d' % (n % 28 + 1)),
+        ('LastModifiedDate', '2020-01-02T10:20:%02d.000Z' % (n % 60)),
+        ('Stages__c', 'New;Won'),
+    ])
+
+
+@unittest.skipIf(arrow.pyarrow is None, "pyarrow is not installed")
+class TestArrowExport(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = fake = FakeSalesforce().start()
+        fake.responses['describeSObjects'] = describeSObjectXml(
+            'Opportunity', OPPORTUNITY_FIELDS)
+        self.svc = pyforce.PythonClient(serverUrl=fake.loginUrl)
+        self.svc.login('username', 'password')
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def pagedQuery(self, pages, pageSize=2):
+        responses = []
+        for p in range(pages):
+            done = p == pages - 1
+            responses.append(queryResultXml(
+                [opportunityXml(p * pageSize + n) for n in range(pageSize)],
+                done=done,
+                queryLocator=None if done else '01gA-%d' % (p + 1),
+                size=pages * pageSize,
+            ))
+        self.fake.responses['query'] = responses[0]
+        self.fake.responses['queryMore'] = responses[1:]
+
+    def testRecordBatches(self):
+        self.pagedQuery(3)
+        batches = arrow.recordBatches(self.svc, 'Opportunity',
+                                      where='Amount > 0')
+        self.assertEqual(self.fake.operations().count('query'), 0)
+        batches = list(batches)
+        self.assertEqual([b.num_rows for b in batches], [2, 2, 2])
+        self.assertEqual(self.fake.operations().count('queryMore'), 2)
+        soql = [str(r.operation[0]) for r in self.fake.requests
+                if r.operationName == 'query'][0]
+        self.assertEqual(
+            soql, 'SELECT Id, Name, Amount, Quantity__c, IsWon, CloseDate, '
+                  'LastModifiedDate, Stages__c FROM Opportunity '
+                  'WHERE Amount > 0')
+
+        schema = batches[0].schema
+        self.assertEqual(schema.field('Amount').type, arrow.pyarrow.float64())
+        self.assertEqual(schema.field('CloseDate').type,
+                         arrow.pyarrow.date32())
+        self.assertEqual(str(schema.field('LastModifiedDate').type),
+                         'timestamp[ms, tz=UTC]')
+        rows = batches[1].to_pylist()
+        self.assertEqual(rows[0]['Name'], 'Deal 2')
+        self.assertEqual(rows[1]['Quantity__c'], None)
+        self.assertEqual(rows[0]['Quantity__c'], 2)
+        self.assertEqual(rows[0]['IsWon'], True)
+        self.assertEqual(rows[0]['CloseDate'], datetime.date(2020, 1, 3))
+        self.assertEqual(rows[0]['LastModifiedDate'].replace(tzinfo=None),
+                         datetime.datetime(2020, 1, 2, 10, 20, 2))
+        self.assertEqual(rows[0]['Stages__c'], ['New', 'Won'])
+
+    def testWriteParquet(self):
+        self.pagedQuery(4)
+        out = BytesIO()
+        rows = arrow.writeParquet(self.svc, 'Opportunity', out,
+                                  fields=['Id', 'Quantity__c'],
+                                  rowGroupSize=3)
+        self.assertEqual(rows, 8)
+        out.seek(0)
+        parquet = arrow.pyarrow.parquet.ParquetFile(out)
+        self.assertEqual(
+            [parquet.metadata.row_group(i).num_rows
+             for i in range(parquet.num_row_groups)], [3, 3, 2])
+        table = parquet.read()
+        self.assertEqual(table.column_names, ['Id', 'Quantity__c'])
+        self.assertEqual(table.column('Quantity__c').to_pylist(),
+                         [None, 1, 2, None, 4, 5, None, 7])
+
+    def testUnknownField(self):
+        self.assertRaises(ValueError, arrow.writeParquet, self.svc,
+                          'Opportunity', BytesIO(), fields=['Nope__c'])
+
+
+if __name__ == '__main__':
+    unittest.main()
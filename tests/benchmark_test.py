@@ -1,18 +1,55 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+import base64
+import copy
 import datetime
 import gc
+import gzip
 import os
+import shutil
+import tempfile
 import unittest
 from time import time
 
+import mock
 import six
 
 import pyforce
+from pyforce import arrow
+from pyforce import columns
+from pyforce import xmlparser
+from pyforce.columns import ColumnBuilder
+from pyforce.compression import CompressionPolicy
+from pyforce import xmltramp
+from pyforce.pyclient import _prepareSObjects
+from pyforce.pyclient import Field
+from pyforce.pyclient import isObject
+from pyforce.pyclient import isQueryResult
+from pyforce.pyclient import QueryRecord
+from pyforce.pyclient import SObject
+from pyforce.records import recordClass
+from pyforce.records import RecordHandler
+from pyforce import xmlclient
+from pyforce.xmlclient import SoapEnvelope
+from tests.util import describeSObjectXml
+from tests.util import ENVELOPE
+from tests.util import queryResultXml
+from tests.util import sObjectXml
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
 
 BENCHMARK_REPS = 1
 
+# the offline benchmarks take about a minute, and only report their numbers,
+# so they only run when asked for, e.g.
+# PYFORCE_BENCHMARK=1 python -m pytest -s tests/benchmark_test.py
+skipUnlessBenchmarking = unittest.skipUnless(
+    os.getenv('PYFORCE_BENCHMARK'), "set PYFORCE_BENCHMARK to run")
+
 SERVER_URL = "https://test.salesforce.com/services/Soap/u/20.0"
 
 
@@ -30,6 +67,99 @@ def benchmark(func):
     return benchmarked_func
 
 
+def peak_memory(func, *args):
+    """Returns the result of func(*args), and the peak bytes it allocated"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = func(*args)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+
+def wide_query_page(records=2000, fields=20):
+    """A gzipped queryMore response body for a page of wide records"""
+    rows = [
+        sObjectXml('Account', [
+            ('Field%d__c' % f, 'value %d of record %d' % (f, r))
+            for f in range(fields)
+        ])
+        for r in range(records)
+    ]
+    body = '<queryMoreResponse>{0}</queryMoreResponse>'.format(
+        queryResultXml(rows))
+    return gzip_bytes(ENVELOPE.format(body).encode('utf-8'))
+
+
+WIDE_FIELD_TYPES = [
+    ('string', 'value {0}'),
+    ('int', '{0}'),
+    ('double', '{0}.5'),
+    ('date', '2020-01-{1:02d}'),
+    ('datetime', '2020-01-{1:02d}T10:20:30.000Z'),
+    ('boolean', 'true'),
+    ('multipicklist', 'Apple;Pear'),
+    ('textarea', 'line one\nline {0}'),
+]
+
+
+def typed_query_page(records=2000, fields=40):
+    """
+    A query response body for a page of wide Accounts with a mix of field
+    types, and the type descriptions to marshall them with.
+    """
+    types = [WIDE_FIELD_TYPES[f % len(WIDE_FIELD_TYPES)] for f in range(fields)]
+    rows = [
+        sObjectXml('Account', [('Id', '001%015d' % r)] + [
+            ('Field%d__c' % f, value.format(r, r % 28 + 1))
+            for f, (t, value) in enumerate(types)
+        ])
+        for r in range(records)
+    ]
+    body = '<queryResponse>{0}</queryResponse>'.format(queryResultXml(rows))
+    describe = SObject(name='Account', fields=dict(
+        ('Field%d__c' % f, Field(name='Field%d__c' % f, type=t))
+        for f, (t, value) in enumerate(types)
+    ))
+    return ENVELOPE.format(body).encode('utf-8'), {'Account': describe}
+
+
+def legacy_extract_record(r, typeDescs):
+    """PythonClient's record extraction before compiled decoders"""
+    record = QueryRecord()
+    if r:
+        row_type = six.text_type(r[pyforce.xmlclient._tSObjectNS.type])
+        pyforce.pyclient._logger.debug("row type: {0}".format(row_type))
+        type_data = typeDescs[row_type]
+        pyforce.pyclient._logger.debug("type data: {0}".format(type_data))
+        for field in r:
+            fname = six.text_type(field._name[1])
+            if isObject(field):
+                record[fname] = legacy_extract_record(
+                    r[field._name, ][0], typeDescs)
+            elif isQueryResult(field):
+                raise NotImplementedError
+            else:
+                record[fname] = type_data.marshall(fname, r)
+    return record
+
+
+def handler_records(body, typeDescs):
+    """The records of a response body, as PythonClient parses them"""
+    handler = RecordHandler(lambda types: typeDescs)
+    xmltramp.parseWith(body, handler)
+    return handler.records
+
+
+def gzip_bytes(data):
+    buf = six.BytesIO()
+    with gzip.GzipFile(mode='wb', fileobj=buf) as gz:
+        gz.write(data)
+    return buf.getvalue()
+
+
 class TestUtils(unittest.TestCase):
 
     def setUp(self):
@@ -117,9 +247,584 @@ class TestUtils(unittest.TestCase):
         self.tearDown()
 
 
+@skipUnlessBenchmarking
+@unittest.skipIf(tracemalloc is None, "tracemalloc is not available")
+class TestResponseParsingMemory(unittest.TestCase):
+
+    def testStreamedParsing(self):
+        page = wide_query_page()
+
+        def buffered(body):
+            # the old SoapEnvelope.post path: read and decode response.text,
+            # then let xmltramp re-encode it
+            text = gzip.GzipFile(fileobj=six.BytesIO(body)).read()
+            return xmltramp.parse(text.decode('utf-8'))
+
+        def streamed(body):
+            return xmltramp.seed(gzip.GzipFile(fileobj=six.BytesIO(body)))
+
+        old, oldPeak = peak_memory(buffered, page)
+        del old
+        new, newPeak = peak_memory(streamed, page)
+        print("\nparse %d byte page, peak bytes: buffered %d streamed %d\n" %
+              (len(page), oldPeak, newPeak))
+        result = new[pyforce.xmlclient._tSoapNS.Body][0][0]
+        self.assertEqual(len(result[pyforce.xmlclient._tPartnerNS.records, ]),
+                         2000)
+        self.assertTrue(newPeak < oldPeak)
+
+
+def linear_lookup(element, name):
+    """How xmltramp found a named child before it kept an index"""
+    for x in element._dir:
+        if isinstance(x, xmltramp.Element) and x._name == name:
+            return x
+    raise KeyError(name)
+
+
+@skipUnlessBenchmarking
+class TestElementLookups(unittest.TestCase):
+
+    def testWideRecordLookups(self):
+        fields = 200
+        body = gzip.GzipFile(fileobj=six.BytesIO(
+            wide_query_page(records=250, fields=fields))).read()
+        tree, retained = peak_memory(xmltramp.parse, body)
+        records = tree[pyforce.xmlclient._tSoapNS.Body][0][0][
+            pyforce.xmlclient._tPartnerNS.records, ]
+        names = [getattr(pyforce.xmlclient._tSObjectNS, 'Field%d__c' % f)
+                 for f in range(fields)]
+
+        def lookups(lookup):
+            t0 = time()
+            for r in records:
+                for n in names:
+                    lookup(r, n)
+            return len(records) * len(names) / (time() - t0)
+        scanRate = lookups(linear_lookup)
+        indexRate = lookups(lambda r, n: r[n])
+        elements = len(records) * (fields + 2)
+        print("\n%d records of %d fields: %d bytes per element, "
+              "lookups/sec: linear scan %d indexed %d\n" %
+              (len(records), fields, retained // elements, scanRate,
+               indexRate))
+        self.assertFalse(hasattr(records[0], '__dict__'))
+        self.assertTrue(records[0]._prefixes is records[1]._prefixes)
+
+
+@skipUnlessBenchmarking
+class TestRecordDecoding(unittest.TestCase):
+
+    def testCompiledDecoders(self):
+        body, typeDescs = typed_query_page()
+
+        def tree(body):
+            page = xmltramp.parse(body)
+            result = page[pyforce.xmlclient._tSoapNS.Body][0][0]
+            return [legacy_extract_record(r, typeDescs)
+                    for r in result[pyforce.xmlclient._tPartnerNS.records, ]]
+
+        t0 = time()
+        old = tree(body)
+        oldRate = len(old) / (time() - t0)
+        t0 = time()
+        new = handler_records(body, typeDescs)
+        newRate = len(new) / (time() - t0)
+        print("\nparse and decode %d records of %d fields, records/sec: "
+              "per-field marshall %d compiled %d\n" %
+              (len(new), len(new[0]), oldRate, newRate))
+        self.assertEqual(old, new)
+        self.assertEqual(new[1]['Field3__c'], datetime.date(2020, 1, 2))
+
+
+@skipUnlessBenchmarking
+@unittest.skipIf(tracemalloc is None, "tracemalloc is not available")
+class TestRecordMemory(unittest.TestCase):
+
+    def testSlottedRecords(self):
+        decoded = handler_records(*typed_query_page())
+        fields = list(decoded[0].keys())
+        cls = recordClass('Account', fields)
+
+        # the field values are shared, so only the records are counted
+        dicts, dictBytes = peak_memory(
+            lambda: [QueryRecord(r) for r in decoded])
+        slotted, slottedBytes = peak_memory(
+            lambda: [cls([r[f] for f in fields]) for r in decoded])
+        print("\n%d records of %d fields, bytes per record: "
+              "QueryRecord %d slotted %d\n" %
+              (len(decoded), len(fields), dictBytes // len(decoded),
+               slottedBytes // len(decoded)))
+        self.assertEqual(slotted, dicts)
+        self.assertEqual(slotted[1].Field3__c, datetime.date(2020, 1, 2))
+        self.assertTrue(slottedBytes < dictBytes)
+
+
+@skipUnlessBenchmarking
+@unittest.skipIf(columns.pandas is None, "pandas is not installed")
+class TestColumnarResults(unittest.TestCase):
+
+    def testDataFrame(self):
+        body, typeDescs = typed_query_page()
+
+        def parse(**kw):
+            handler = RecordHandler(
+                lambda types: dict((t, typeDescs[t]) for t in types), **kw)
+            return SoapEnvelope('', 'query').parseResponse(
+                body, handler=handler)
+
+        def fromRecords():
+            # what callers did with query results before queryDataFrame
+            records = parse().records
+            return columns.pandas.DataFrame.from_records(
+                [dict(r) for r in records], columns=list(records[0]))
+
+        def fromColumns():
+            builder = ColumnBuilder()
+            parse(columns=builder)
+            return builder.toDataFrame()
+
+        oldFrame, newFrame = fromRecords(), fromColumns()
+        oldTime = best_seconds(fromRecords, reps=3)
+        newTime = best_seconds(fromColumns, reps=3)
+        print("\nDataFrame of %d records of %d fields, seconds: "
+              "from records %.3f from columns %.3f\n" %
+              (len(newFrame), len(newFrame.columns), oldTime, newTime))
+        self.assertEqual(list(newFrame.columns), list(oldFrame.columns))
+        self.assertEqual(newFrame['Field1__c'].dtype.kind, 'i')
+        self.assertEqual(oldFrame['Field3__c'][1],
+                         newFrame['Field3__c'][1].date())
+
+
+class PagedClient(object):
+    """Serves a typed_query_page for every page of a query"""
+
+    def __init__(self, pages, body, typeDescs):
+        self.pages = pages
+        self.body = body
+        self.typeDescs = typeDescs
+
+    def queryTypesDescriptions(self, types):
+        return dict((t, self.typeDescs[t]) for t in types)
+
+    def iterColumnPages(self, soql):
+        for i in range(self.pages):
+            page = ColumnBuilder()
+            handler = RecordHandler(self.queryTypesDescriptions,
+                                    columns=page)
+            SoapEnvelope('', 'query').parseResponse(self.body, handler=handler)
+            yield page
+
+
+@skipUnlessBenchmarking
+@unittest.skipIf(tracemalloc is None or arrow.pyarrow is None,
+                 "tracemalloc or pyarrow is not available")
+class TestParquetExport(unittest.TestCase):
+
+    def testBoundedMemory(self):
+        body, typeDescs = typed_query_page()
+        directory = tempfile.mkdtemp()
+
+        def export(pages):
+            path = os.path.join(directory, '%d.parquet' % pages)
+            t0 = time()
+            rows = arrow.writeParquet(PagedClient(pages, body, typeDescs),
+                                      'Account', path, rowGroupSize=4000)
+            return rows, time() - t0
+
+        try:
+            (fewRows, fewTime), fewPeak = peak_memory(export, 2)
+            (manyRows, manyTime), manyPeak = peak_memory(export, 6)
+        finally:
+            shutil.rmtree(directory)
+        print("\nParquet export, peak bytes: %d rows %d, %d rows %d; "
+              "rows/sec %d\n" %
+              (fewRows, fewPeak, manyRows, manyPeak, manyRows / manyTime))
+        self.assertEqual(manyRows, 3 * fewRows)
+        self.assertTrue(manyPeak < fewPeak * 1.5)
+
+
+def response_corpus():
+    """
+    Uncompressed response bodies like those a client parses most: pages of
+    wide and of nested query results, and a describeSObjects response.
+    """
+    wide = gzip.GzipFile(fileobj=six.BytesIO(wide_query_page())).read()
+    nested = [
+        sObjectXml('Contact', [
+            ('Id', '003%015d' % r),
+            ('LastName', 'Doe & Sons %d' % r),
+            ('Birthdate', '1970-01-%02d' % (r % 28 + 1)),
+            ('Account', sObjectXml('Account', [
+                ('Name', 'Acme %d' % r), ('AnnualRevenue', '1.5E7'),
+            ], tag='Account', prefix='sf:')),
+        ])
+        for r in range(2000)
+    ]
+    nested = ENVELOPE.format('<queryResponse>{0}</queryResponse>'.format(
+        queryResultXml(nested))).encode('utf-8')
+    fields = [('Field%d__c' % f, 'string') for f in range(100)]
+    describe = ENVELOPE.format(
+        '<describeSObjectsResponse>{0}</describeSObjectsResponse>'.format(
+            ''.join(describeSObjectXml('Type%d' % t, fields)
+                    for t in range(10)))).encode('utf-8')
+    return [wide, nested, describe]
+
+
+def best_seconds(func, reps=5):
+    """The least time func() takes in reps calls"""
+    gc.collect()
+    best = None
+    for i in range(reps):
+        t0 = time()
+        func()
+        elapsed = time() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def megabytes_per_second(parse, corpus, reps=5):
+    """The best throughput of parse over the corpus, in MB/s"""
+    size = sum(len(body) for body in corpus)
+
+    def parseAll():
+        for body in corpus:
+            parse(body)
+    return size / best_seconds(parseAll, reps) / 1e6
+
+
+def legacy_make_envelope(request, doGzip):
+    """Serializes the whole of request, as makeEnvelope did before templates"""
+    s = xmlclient.SoapWriter(doGzip)
+    s.startElement(xmlclient._envNs, "Header")
+    s.characters("\n")
+    s.startElement(xmlclient._partnerNs, "CallOptions")
+    s.writeElement(xmlclient._partnerNs, "client", request.clientId)
+    s.endElement()
+    s.characters("\n")
+    request.writeHeaders(s)
+    s.endElement()
+    s.startElement(xmlclient._envNs, "Body")
+    s.characters("\n")
+    s.startElement(xmlclient._partnerNs, request.operationName)
+    request.writeBody(s)
+    s.endElement()
+    s.endElement()
+    return s.endDocument()
+
+
+@skipUnlessBenchmarking
+class TestEnvelopeTemplates(unittest.TestCase):
+
+    def testSmallCalls(self):
+        requests = [
+            xmlclient.RetrieveRequest(SERVER_URL, 'SESSION', ['Id', 'Name'],
+                                      'Account', ['001000000000001']),
+            xmlclient.AuthenticatedRequest(SERVER_URL, 'SESSION',
+                                           'getServerTimestamp'),
+        ]
+        calls = 2000
+
+        def envelopesPerSecond(make):
+            def makeAll():
+                for i in range(calls):
+                    for request in requests:
+                        make(request)
+            return calls * len(requests) / best_seconds(makeAll)
+
+        for request in requests:
+            self.assertEqual(request.makeEnvelope(),
+                             legacy_make_envelope(request, False))
+        # every request gzipped at level 9, as they were
+        always = CompressionPolicy(threshold=0, level=9)
+        for doGzip in (False, True):
+            if doGzip:
+                newRate = envelopesPerSecond(lambda r: r.makeBody(always))
+            else:
+                newRate = envelopesPerSecond(SoapEnvelope.makeEnvelope)
+            oldRate = envelopesPerSecond(
+                lambda r: legacy_make_envelope(r, doGzip))
+            print("\nretrieve and getServerTimestamp envelopes/sec%s: "
+                  "whole %d templated %d\n" %
+                  (' gzipped' if doGzip else '', oldRate, newRate))
+
+
+def wide_sobjects(records=200, fields=50):
+    """A batch of records to update, with nulls, multi-selects and lookups"""
+    sObjects = []
+    for r in range(records):
+        sObject = {'type': 'Account', 'Id': '001%015d' % r}
+        for f in range(fields):
+            name = 'Field%d__c' % f
+            if f % 10 == 0:
+                sObject[name] = None
+            elif f % 10 == 1:
+                sObject[name] = ['Apple', 'Pear', 'Plum']
+            elif f % 10 == 2:
+                sObject[name] = datetime.date(2020, 1, f % 28 + 1)
+            else:
+                sObject[name] = 'value %d of record %d' % (f, r)
+        sObject['Parent'] = {'type': 'Account', 'External__c': 'P%d' % r}
+        sObjects.append(sObject)
+    return sObjects
+
+
+def legacy_do_prep(field_dict):
+    """_doPrep as it was, converting a deep copy of an sObject in place"""
+    fieldsToNull = []
+    for key, value in field_dict.items():
+        if value is None:
+            fieldsToNull.append(key)
+            field_dict[key] = []
+        elif not isinstance(value, six.string_types) and \
+                hasattr(value, '__iter__'):
+            if len(value) == 0:
+                fieldsToNull.append(key)
+            elif isinstance(value, dict):
+                innerCopy = copy.deepcopy(value)
+                legacy_do_prep(innerCopy)
+                field_dict[key] = innerCopy
+            else:
+                try:
+                    field_dict[key] = ";".join(value)
+                except TypeError:
+                    pass
+    field_dict['fieldsToNull'] = fieldsToNull
+
+
+def legacy_prepare_sobjects(sObjects):
+    sObjectsCopy = copy.deepcopy(sObjects)
+    for sObject in sObjectsCopy:
+        legacy_do_prep(sObject)
+    return sObjectsCopy
+
+
+@skipUnlessBenchmarking
+class TestSObjectPreparation(unittest.TestCase):
+
+    def testWideBatches(self):
+        sObjects = wide_sobjects()
+        original = copy.deepcopy(sObjects)
+
+        def envelope(prepare):
+            return xmlclient.UpdateRequest(
+                SERVER_URL, 'SESSION', prepare(sObjects)).makeEnvelope()
+
+        self.assertEqual(envelope(legacy_prepare_sobjects),
+                         envelope(_prepareSObjects))
+        self.assertEqual(sObjects, original)
+        prepSeconds = [best_seconds(lambda: prepare(sObjects))
+                       for prepare in (legacy_prepare_sobjects,
+                                       _prepareSObjects)]
+        callSeconds = [best_seconds(lambda: envelope(prepare))
+                       for prepare in (legacy_prepare_sobjects,
+                                       _prepareSObjects)]
+        print("\nupdate of %d records of %d fields, ms: deep copies %.1f "
+              "(%.1f preparing) views %.1f (%.1f preparing)\n" %
+              (len(sObjects), len(sObjects[0]), callSeconds[0] * 1e3,
+               prepSeconds[0] * 1e3, callSeconds[1] * 1e3,
+               prepSeconds[1] * 1e3))
+
+
+def legacy_write_sobjects(s, sObjects, elemName="sObjects"):
+    """writeSObjects as it was, a writeElement call for each field"""
+    if xmltramp.islst(sObjects):
+        for o in sObjects:
+            legacy_write_sobjects(s, o, elemName)
+    else:
+        s.startElement(xmlclient._partnerNs, elemName)
+        s.writeElement(xmlclient._sobjectNs, "type", sObjects['type'])
+        for fn, value in sObjects.items():
+            if fn != 'type':
+                s.writeElement(xmlclient._sobjectNs, fn, value)
+        s.endElement()
+
+
+@skipUnlessBenchmarking
+class TestSObjectSerializer(unittest.TestCase):
+
+    def testBatchEnvelopes(self):
+        sObjects = _prepareSObjects(wide_sobjects())
+        requests = [
+            xmlclient.CreateRequest(SERVER_URL, 'SESSION', sObjects),
+            xmlclient.UpdateRequest(SERVER_URL, 'SESSION', sObjects),
+            xmlclient.UpsertRequest(SERVER_URL, 'SESSION', 'External__c',
+                                    sObjects),
+        ]
+
+        def makeAll():
+            return [r.makeEnvelope() for r in requests]
+
+        new = makeAll()
+        newSeconds = best_seconds(makeAll)
+        with mock.patch.object(xmlclient.AuthenticatedRequest,
+                               'writeSObjects',
+                               lambda self, s, o: legacy_write_sobjects(s, o)):
+            old = makeAll()
+            oldSeconds = best_seconds(makeAll)
+        self.assertEqual(old, new)
+        print("\ncreate, update and upsert of %d records of %d fields, ms: "
+              "per-element %.1f batched %.1f\n" %
+              (len(sObjects), len(sObjects[0]), oldSeconds * 1e3,
+               newSeconds * 1e3))
+
+
+@skipUnlessBenchmarking
+class TestRequestCompression(unittest.TestCase):
+
+    def testPolicies(self):
+        small = [
+            xmlclient.RetrieveRequest(SERVER_URL, 'SESSION', ['Id', 'Name'],
+                                      'Account', ['001000000000001']),
+            xmlclient.AuthenticatedRequest(SERVER_URL, 'SESSION',
+                                           'getServerTimestamp'),
+        ]
+        large = [xmlclient.UpdateRequest(SERVER_URL, 'SESSION',
+                                         _prepareSObjects(wide_sobjects()))]
+        # 100 small calls to each large one
+        bodies = ([r.makeEnvelope() for r in small] * 50 +
+                  [r.makeEnvelope() for r in large])
+        policies = [
+            ('every request at level 9', CompressionPolicy(0, 9)),
+            ('default', CompressionPolicy()),
+            ('level 1', CompressionPolicy(level=1)),
+        ]
+        stats = {}
+        for name, policy in policies:
+            best_seconds(lambda: [policy.compress(b) for b in bodies])
+            stats[name] = policy.stats()
+            print("\n%s: %d of %d requests compressed, %d bytes saved of "
+                  "%d, %.1fms per workload, %d bytes saved per ms\n" % (
+                      name, stats[name]['compressed'] // 5,
+                      stats[name]['requests'] // 5,
+                      stats[name]['bytesSaved'] // 5,
+                      stats[name]['bytesIn'] // 5,
+                      stats[name]['seconds'] * 1e3 / 5,
+                      stats[name]['bytesSavedPerSecond'] / 1e3))
+        always, default = stats['every request at level 9'], stats['default']
+        self.assertTrue(always['bytesSaved'] >= default['bytesSaved'] > 0)
+
+
+@skipUnlessBenchmarking
+@unittest.skipIf(tracemalloc is None, "tracemalloc is not available")
+class TestStreamedRequests(unittest.TestCase):
+
+    def testBoundedMemory(self):
+        # every record shares one long text, so only the envelope is counted
+        description = 'A long description. ' * 2500
+        policy = CompressionPolicy()
+
+        def request(records):
+            return xmlclient.CreateRequest(SERVER_URL, 'SESSION', [
+                {'type': 'Case', 'Subject': 'Case %d' % n,
+                 'Description': description} for n in range(records)])
+
+        def whole(request):
+            return len(request.makeBody(policy)[0])
+
+        def streamed(request):
+            return sum(len(chunk) for chunk in request.iterEnvelope(policy))
+
+        peaks = {}
+        for send in (whole, streamed):
+            for records in (50, 200):
+                r = request(records)
+                size, peaks[send, records] = peak_memory(send, r)
+        print("\ncreate of 50 and 200 records of %d bytes, peak bytes: "
+              "whole %d, %d streamed %d, %d\n" %
+              (len(description), peaks[whole, 50], peaks[whole, 200],
+               peaks[streamed, 50], peaks[streamed, 200]))
+        self.assertTrue(peaks[whole, 200] > peaks[whole, 50] * 3)
+        self.assertTrue(peaks[streamed, 200] < peaks[streamed, 50] * 1.5)
+        self.assertTrue(peaks[streamed, 200] * 10 < peaks[whole, 200])
+
+
+class CountingFile(object):
+    """A binary file object which only counts the bytes written to it"""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+
+@skipUnlessBenchmarking
+@unittest.skipIf(tracemalloc is None, "tracemalloc is not available")
+class TestBase64Files(unittest.TestCase):
+
+    def testStreamedAttachmentBody(self):
+        data = bytes(bytearray(range(256))) * (80 * 1024)
+        response = ENVELOPE.format(
+            '<retrieveResponse>' + sObjectXml('Attachment', [
+                ('Id', '00P000000000001AAA'),
+                ('Body', base64.b64encode(data).decode('ascii')),
+            ], tag='result') + '</retrieveResponse>').encode('ascii')
+        attachment = SObject(name='Attachment', fields={
+            'Id': Field(name='Id', type='id'),
+            'Body': Field(name='Body', type='base64')})
+
+        def describe(types):
+            return {'Attachment': attachment}
+
+        def whole(response):
+            handler = RecordHandler(describe)
+            xmltramp.parseWith(six.BytesIO(response), handler)
+            out = CountingFile()
+            out.write(base64.b64decode(handler.records[0]['Body']))
+            return out.size
+
+        def streamed(response):
+            out = CountingFile()
+            handler = RecordHandler(describe,
+                                    base64Files=lambda fname, fields: out)
+            handler.typeDescs.update(describe(['Attachment']))
+            xmltramp.parseWith(six.BytesIO(response), handler)
+            return out.size
+
+        wholeSize, wholePeak = peak_memory(whole, response)
+        streamedSize, streamedPeak = peak_memory(streamed, response)
+        seconds = best_seconds(lambda: streamed(response), reps=3)
+        print("\nretrieve of a %d byte attachment, peak bytes: whole %d "
+              "streamed %d, streamed in %.3fs\n" %
+              (len(data), wholePeak, streamedPeak, seconds))
+        self.assertEqual(wholeSize, len(data))
+        self.assertEqual(streamedSize, len(data))
+        self.assertTrue(streamedPeak * 50 < wholePeak)
+
+
+@skipUnlessBenchmarking
+class TestParserBackends(unittest.TestCase):
+
+    def testThroughput(self):
+        corpus = response_corpus()
+        rates = {}
+        for name in xmlparser.availableBackends():
+            backend = xmlparser.getBackend(name)
+            rates[name] = megabytes_per_second(
+                lambda body: backend.parse(body, xmltramp.Seeder()), corpus)
+            print("\n%s backend: %.1f MB/s building trees of %d bytes\n" %
+                  (name, rates[name], sum(len(b) for b in corpus)))
+        self.assertEqual(xmlparser.getBackend().name,
+                         xmlparser.availableBackends()[0])
+
+
 def test_suite():
     return unittest.TestSuite((
         unittest.makeSuite(TestUtils),
+        unittest.makeSuite(TestResponseParsingMemory),
+        unittest.makeSuite(TestElementLookups),
+        unittest.makeSuite(TestRecordDecoding),
+        unittest.makeSuite(TestRecordMemory),
+        unittest.makeSuite(TestColumnarResults),
+        unittest.makeSuite(TestParquetExport),
+        unittest.makeSuite(TestEnvelopeTemplates),
+        unittest.makeSuite(TestSObjectPreparation),
+        unittest.makeSuite(TestSObjectSerializer),
+        unittest.makeSuite(TestRequestCompression),
+        unittest.makeSuite(TestStreamedRequests),
+        unittest.makeSuite(TestBase64Files),
+        unittest.makeSuite(TestParserBackends),
     ))
 
 
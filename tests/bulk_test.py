@@ -0,0 +1,120 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import datetime
+import unittest
+
+from six import BytesIO
+
+import pyforce
+from pyforce import BulkApiError
+from pyforce import BulkClient
+from pyforce import SessionTimeoutError
+from pyforce.bulk import _csvBody
+from pyforce.bulk import _splitLines
+from tests.util import FakeSalesforce
+
+
+class TestBulkClient(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeSalesforce().start()
+        self.svc = pyforce.PythonClient(self.fake.loginUrl)
+        self.svc.login('username', 'password')
+        self.bulk = BulkClient(self.svc, pollInterval=0.01)
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def testIngestRecords(self):
+        records = (
+            dict(LastName='Doe %d' % n, Birthdate=datetime.date(1970, 1, 2),
+                 Email=None, HasOptedOutOfEmail=n % 2 == 0)
+            for n in range(3)
+        )
+        job = self.bulk.ingest(
+            'Contact', 'insert', records,
+            fields=['LastName', 'Birthdate', 'Email', 'HasOptedOutOfEmail'])
+        self.assertEqual(job['state'], 'JobComplete')
+        self.assertEqual(job['numberRecordsProcessed'], 3)
+        self.assertEqual(job['object'], 'Contact')
+        self.assertEqual(job['operation'], 'insert')
+        self.assertEqual(
+            self.fake.bulkUploads[job['id']],
+            b'LastName,Birthdate,Email,HasOptedOutOfEmail\n'
+            b'Doe 0,1970-01-02,#N/A,true\n'
+            b'Doe 1,1970-01-02,#N/A,false\n'
+            b'Doe 2,1970-01-02,#N/A,true\n')
+        methods = [m for m, path in self.fake.restRequests]
+        self.assertEqual(methods, ['POST', 'PUT', 'PATCH', 'GET', 'GET'])
+
+        results = b''.join(self.bulk.getSuccessfulResults(job['id']))
+        self.assertTrue(results.startswith(
+            b'"sf__Id","sf__Created",LastName,'))
+        self.assertEqual(len(results.splitlines()), 4)
+        self.assertEqual(b''.join(self.bulk.getFailedResults(job['id'])),
+                         b'LastName,Birthdate,Email,HasOptedOutOfEmail')
+
+    def testIngestFile(self):
+        data = BytesIO(b'Id\n003000000000001AAA\n003000000000002AAA\n')
+        job = self.bulk.ingest('Contact', 'hardDelete', data)
+        self.assertEqual(job['numberRecordsProcessed'], 2)
+        self.assertEqual(self.fake.bulkUploads[job['id']], data.getvalue())
+        with self.assertRaises(ValueError):
+            self.bulk.createIngestJob('Contact', 'merge')
+
+    def testQueryPages(self):
+        self.fake.bulkQueryPages = [
+            '"Id","Name"\n"001A","Acme, Inc."\n"001B","Multi\nLine"\n',
+            '"Id","Name"\n"001C","Éclair"\n',
+        ]
+        rows = list(self.bulk.query('SELECT Id, Name FROM Account',
+                                    maxRecords=2))
+        self.assertEqual(rows, [
+            {'Id': '001A', 'Name': 'Acme, Inc.'},
+            {'Id': '001B', 'Name': 'Multi\nLine'},
+            {'Id': '001C', 'Name': 'Éclair'},
+        ])
+        job = list(self.fake.bulkJobs.values())[0]
+        self.assertEqual(job['operation'], 'query')
+        self.assertEqual(job['query'], 'SELECT Id, Name FROM Account')
+
+    def testErrors(self):
+        with self.assertRaises(BulkApiError) as cm:
+            self.bulk.getJob('750000000000000999')
+        self.assertEqual(cm.exception.errorCode, 'NOT_FOUND')
+        self.assertEqual(cm.exception.status, 404)
+        self.svc.sessionId = 'expired'
+        with self.assertRaises(SessionTimeoutError):
+            self.bulk.createQueryJob('SELECT Id FROM Account')
+
+    def testTimeout(self):
+        self.fake.bulkPolls = 1000
+        self.bulk.timeout = 0.05
+        job = self.bulk.createQueryJob('SELECT Id FROM Account')
+        with self.assertRaises(BulkApiError) as cm:
+            self.bulk.waitForJob(job['id'], query=True)
+        self.assertEqual(cm.exception.errorCode, 'TIMEOUT')
+
+
+class TestCsv(unittest.TestCase):
+
+    def testNullsAndMissingFields(self):
+        body = b''.join(_csvBody(
+            [dict(Id='003000000000001AAA', Email=None),
+             dict(Id='003000000000002AAA', Phone='555')],
+            fields=['Id', 'Email', 'Phone']))
+        self.assertEqual(body, b'Id,Email,Phone\n'
+                               b'003000000000001AAA,#N/A,\n'
+                               b'003000000000002AAA,,555\n')
+
+    def testSplitLines(self):
+        chunks = [b'Id,Na', b'me\n1,', b'A', b'\n2,B\n3', b',C']
+        self.assertEqual(list(_splitLines(chunks)),
+                         [b'Id,Name\n', b'1,A\n', b'2,B\n', b'3,C'])
+        self.assertEqual(list(_splitLines([b'a\n', b'', b'b\n'])),
+                         [b'a\n', b'b\n'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,234 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import pyforce
+from pyforce.cache import describeKey
+from pyforce.cache import DiskDescribeCache
+from pyforce.cache import getDefaultDescribeCache
+from pyforce.cache import MemoryDescribeCache
+from pyforce.pyclient import Field
+from pyforce.pyclient import SObject
+from tests.util import describeSObjectXml
+from tests.util import FakeSalesforce
+from tests.util import queryResultXml
+from tests.util import sObjectXml
+
+
+def contactDescribe():
+    return SObject(name='Contact', label='Contact', fields={
+        'Birthdate': Field(name='Birthdate', type='date',
+                           picklistValues=[], referenceTo=[]),
+    })
+
+
+class TestDiskDescribeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = DiskDescribeCache(self.directory, ttl=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testGetAndSet(self):
+        key = describeKey('00D000000000001', '20.0', 'Contact')
+        self.assertEqual(self.cache.get(key), None)
+        self.cache.set(key, contactDescribe(), now=1000)
+        desc = self.cache.get(key, now=1030)
+        self.assertEqual(desc.name, 'Contact')
+        self.assertEqual(desc.fields['Birthdate'].type, 'date')
+        # a fresh cache on the same directory, as in another process
+        other = DiskDescribeCache(self.directory, ttl=60)
+        self.assertEqual(other.get(key, now=1030).label, 'Contact')
+        self.assertEqual(other.get(key, now=1061), None)
+        self.assertEqual(os.listdir(os.path.dirname(self.cache._path(key))),
+                         ['contact.json'])
+
+    def testInvalidate(self):
+        for org in ('00D000000000001', '00D000000000002'):
+            for name in ('Contact', 'Account'):
+                self.cache.set(describeKey(org, '20.0', name),
+                               contactDescribe())
+        self.cache.invalidate('00D000000000001', sObjectType='Contact')
+        self.assertEqual(self.cache.get(
+            describeKey('00D000000000001', '20.0', 'Contact')), None)
+        self.assertNotEqual(self.cache.get(
+            describeKey('00D000000000001', '20.0', 'Account')), None)
+        self.cache.invalidate('00D000000000002')
+        self.assertEqual(self.cache.get(
+            describeKey('00D000000000002', '20.0', 'Account')), None)
+        self.cache.clear()
+        self.assertEqual(self.cache.get(
+            describeKey('00D000000000001', '20.0', 'Account')), None)
+
+    def testUnknownApiVersion(self):
+        key = describeKey('00D000000000001', None, 'Contact')
+        self.cache.set(key, contactDescribe())
+        self.assertEqual(self.cache.get(key).name, 'Contact')
+        self.cache.invalidate('00D000000000001')
+        self.assertEqual(self.cache.get(key), None)
+
+    def testSharedByClients(self):
+        fake = FakeSalesforce().start()
+        self.addCleanup(fake.stop)
+        fake.responses['describeSObjects'] = describeSObjectXml(
+            'Contact', [('Id', 'id'), ('Birthdate', 'date')])
+        fake.responses['query'] = queryResultXml([sObjectXml('Contact', [
+            ('Id', '003000000000001AAA'), ('Birthdate', '1970-01-02'),
+        ])])
+        for _ in range(2):
+            svc = pyforce.PythonClient(fake.loginUrl, describeCache=self.cache)
+            svc.login('username', 'password')
+            res = svc.query('SELECT Id, Birthdate FROM Contact')
+            self.assertEqual(res[0].Birthdate, datetime.date(1970, 1, 2))
+        self.assertEqual(fake.operations().count('describeSObjects'), 1)
+        key = describeKey(svc.orgId, '20.0', 'Contact')
+        self.assertEqual(svc.orgId, '00D000000000001')
+        self.assertNotEqual(self.cache.get(key), None)
+
+
+def key(name, org='00D000000000001'):
+    return describeKey(org, '20.0', name)
+
+
+class TestMemoryDescribeCache(unittest.TestCase):
+
+    def testLeastRecentlyUsedEviction(self):
+        cache = MemoryDescribeCache(maxSize=2)
+        cache.set(key('Contact'), 'contact')
+        cache.set(key('Account'), 'account')
+        self.assertEqual(cache.get(key('Contact')), 'contact')
+        cache.set(key('Lead'), 'lead')
+        self.assertEqual(cache.get(key('Account')), None)
+        self.assertEqual(cache.get(key('Contact')), 'contact')
+        self.assertEqual(cache.stats(), dict(
+            hits=2, misses=1, evictions=1, size=2))
+
+    def testGetMany(self):
+        cache = MemoryDescribeCache()
+        cache.set(key('Contact'), 'contact')
+        loads = []
+
+        def load(keys):
+            loads.append(keys)
+            return [k[2] for k in keys]
+        found = cache.getMany([key('Contact'), key('Account')], load)
+        self.assertEqual(found, {key('Contact'): 'contact',
+                                 key('Account'): 'account'})
+        self.assertEqual(loads, [[key('Account')]])
+        cache.invalidate('00D000000000001', sObjectType='CONTACT')
+        self.assertEqual(cache.stats()['size'], 1)
+
+    def testSingleDescribeInFlight(self):
+        cache = MemoryDescribeCache()
+        loads = []
+
+        def load(keys):
+            loads.append(keys)
+            time.sleep(0.1)
+            return ['described'] * len(keys)
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                cache.getMany([key('Contact')], load)))
+            for _ in range(10)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(loads, [[key('Contact')]])
+        self.assertEqual(results, [{key('Contact'): 'described'}] * 10)
+        self.assertEqual(cache.stats()['misses'], 1)
+        self.assertEqual(cache.stats()['hits'], 9)
+
+    def testFailedLoadIsRetried(self):
+        cache = MemoryDescribeCache()
+
+        def fail(keys):
+            raise IOError('no route to host')
+        with self.assertRaises(IOError):
+            cache.getMany([key('Contact')], fail)
+        found = cache.getMany([key('Contact')], lambda keys: ['contact'])
+        self.assertEqual(found, {key('Contact'): 'contact'})
+
+    def testDiskBackend(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        DiskDescribeCache(directory).set(key('Contact'), contactDescribe())
+        cache = MemoryDescribeCache(backend=DiskDescribeCache(directory))
+        found = cache.getMany([key('Contact')], None)
+        self.assertEqual(found[key('Contact')].name, 'Contact')
+
+    def testDefaultCache(self):
+        self.assertTrue(getDefaultDescribeCache() is getDefaultDescribeCache())
+
+    def testCacheReplacesTypeDescs(self):
+        fake = FakeSalesforce().start()
+        self.addCleanup(fake.stop)
+        fake.responses['describeSObjects'] = describeSObjectXml(
+            'Contact', [('Id', 'id'), ('Birthdate', 'date')])
+        fake.responses['query'] = queryResultXml([sObjectXml('Contact', [
+            ('Id', '003000000000001AAA'), ('Birthdate', '1970-01-02'),
+        ])])
+        cache = MemoryDescribeCache()
+        for describeCache in (cache, cache, None):
+            svc = pyforce.PythonClient(fake.loginUrl,
+                                       cacheTypeDescriptions=True,
+                                       describeCache=describeCache)
+            svc.login('username', 'password')
+            res = svc.query('SELECT Id, Birthdate FROM Contact')
+            self.assertEqual(res[0].Birthdate, datetime.date(1970, 1, 2))
+        self.assertEqual(fake.operations().count('describeSObjects'), 2)
+        self.assertEqual(list(svc.typeDescs.keys()), ['Contact'])
+
+        svc = pyforce.PythonClient(fake.loginUrl, cacheTypeDescriptions=True,
+                                   describeCache=cache)
+        svc.login('username', 'password')
+        svc.query('SELECT Id, Birthdate FROM Contact')
+        self.assertEqual(fake.operations().count('describeSObjects'), 2)
+        self.assertEqual(svc.typeDescs, {})
+        svc.flushTypeDescriptionsCache()
+        svc.query('SELECT Id, Birthdate FROM Contact')
+        self.assertEqual(fake.operations().count('describeSObjects'), 3)
+
+    def testSharedByClients(self):
+        fake = FakeSalesforce().start()
+        self.addCleanup(fake.stop)
+        fake.responses['describeSObjects'] = describeSObjectXml(
+            'Contact', [('Id', 'id'), ('Birthdate', 'date')])
+        contact = sObjectXml('Contact', [
+            ('Id', '003000000000001AAA'), ('Birthdate', '1970-01-02'),
+        ])
+        fake.responses['query'] = queryResultXml([contact])
+        fake.responses['search'] = (
+            '<result><searchRecords><record xsi:type="sf:sObject">' +
+            contact[len('<records xsi:type="sf:sObject">'):-len('</records>')] +
+            '</record></searchRecords></result>')
+        fake.responses['retrieve'] = contact.replace(
+            '<records ', '<result ').replace('</records>', '</result>')
+        cache = MemoryDescribeCache()
+        for _ in range(3):
+            svc = pyforce.PythonClient(fake.loginUrl, describeCache=cache)
+            svc.login('username', 'password')
+            res = svc.query('SELECT Id, Birthdate FROM Contact')
+            self.assertEqual(res[0].Birthdate, datetime.date(1970, 1, 2))
+            res = svc.search('FIND {Doe} RETURNING Contact(Id, Birthdate)')
+            self.assertEqual(res[0].Birthdate, datetime.date(1970, 1, 2))
+            res = svc.retrieve('Birthdate', 'Contact',
+                               ['003000000000001AAA'])
+            self.assertEqual(res[0]['Birthdate'], datetime.date(1970, 1, 2))
+        self.assertEqual(fake.operations().count('describeSObjects'), 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
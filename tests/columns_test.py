@@ -0,0 +1,123 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import datetime
+import math
+import unittest
+
+from pyforce import columns
+from pyforce.columns import ColumnBuilder
+from pyforce.pyclient import Field
+from pyforce.pyclient import SObject
+from pyforce.records import RecordHandler
+from pyforce.xmlclient import SoapEnvelope
+from tests.util import ENVELOPE
+from tests.util import queryResultXml
+from tests.util import sObjectXml
+
+TYPES = {
+    'Opportunity': SObject(name='Opportunity', fields=dict(
+        (n, Field(name=n, type=t)) for n, t in [
+            ('Id', 'id'), ('Amount', 'currency'), ('Probability', 'percent'),
+            ('Quantity__c', 'int'), ('IsWon', 'boolean'),
+            ('CloseDate', 'date'), ('LastActivity__c', 'datetime'),
+            ('Stages__c', 'multipicklist'),
+        ])),
+    'Account': SObject(name='Account', fields={
+        'Name': Field(name='Name', type='string')}),
+}
+
+
+def opportunityXml(n, **extra):
+    fields = [
+        ('Id', '006%015d' % n),
+        ('Amount', '%d.5' % n if n % 3 else None),
+        ('Probability', '10'),
+        ('Quantity__c', n if n % 4 else None),
+        ('IsWon', n % 2 == 0),
+        ('CloseDate', '2020-01-%02d' % (n % 28 + 1) if n % 5 else None),
+        ('LastActivity__c', '2020-01-02T10:20:%02d.250Z' % (n % 60)),
+        ('Stages__c', 'New;Won'),
+    ]
+    fields.extend(extra.items())
+    return sObjectXml('Opportunity', fields)
+
+
+def queryResponse(records):
+    return ENVELOPE.format(
+        '<queryResponse>' + queryResultXml(records) + '</queryResponse>')
+
+
+@unittest.skipIf(columns.numpy is None, "numpy is not installed")
+class TestColumnBuilder(unittest.TestCase):
+
+    def parse(self, body, **kw):
+        handler = RecordHandler(
+            lambda types: dict((t, TYPES[t]) for t in types), **kw)
+        return SoapEnvelope('', 'query').parseResponse(body, handler=handler)
+
+    def testTypedColumns(self):
+        body = queryResponse([opportunityXml(n) for n in range(1, 9)])
+        records = self.parse(body).records
+        builder = ColumnBuilder()
+        handler = self.parse(body, columns=builder)
+        self.assertEqual(handler.records, [])
+        self.assertEqual(builder.rows, 8)
+        arrays = builder.toArrays()
+        self.assertEqual(list(arrays), list(records[0]))
+
+        self.assertEqual(arrays['Amount'].dtype.kind, 'f')
+        self.assertEqual(arrays['Amount'][0], 1.5)
+        self.assertTrue(math.isnan(arrays['Amount'][2]))
+        self.assertEqual(arrays['Probability'].tolist(), [10.0] * 8)
+        # int columns with nulls are floats, as pandas has them
+        self.assertEqual(arrays['Quantity__c'].dtype.kind, 'f')
+        self.assertTrue(math.isnan(arrays['Quantity__c'][3]))
+        self.assertEqual(arrays['IsWon'].dtype.kind, 'b')
+        self.assertEqual(arrays['IsWon'].tolist(),
+                         [r.IsWon for r in records])
+        self.assertEqual(str(arrays['CloseDate'].dtype), 'datetime64[D]')
+        self.assertEqual(arrays['CloseDate'].tolist(),
+                         [r.CloseDate for r in records])
+        self.assertEqual(str(arrays['LastActivity__c'].dtype),
+                         'datetime64[ms]')
+        self.assertEqual(arrays['LastActivity__c'].tolist(),
+                         [r.LastActivity__c for r in records])
+        self.assertEqual(arrays['Stages__c'].dtype.kind, 'O')
+        self.assertEqual(arrays['Stages__c'][0], ['New', 'Won'])
+        self.assertEqual(arrays['Id'].tolist(), [r.Id for r in records])
+
+    def testLayoutsAndPages(self):
+        account = sObjectXml('Account', [('Name', 'Acme')],
+                             tag='Account', prefix='sf:')
+        builder = ColumnBuilder()
+        self.parse(queryResponse([opportunityXml(4)]), columns=builder)
+        self.parse(queryResponse([opportunityXml(6, Account=account),
+                                  opportunityXml(7)]), columns=builder)
+        arrays = builder.toArrays()
+        self.assertEqual(builder.rows, 3)
+        self.assertTrue(all(len(a) == 3 for a in arrays.values()))
+        # a field first seen on the second page, and missing from a row
+        self.assertEqual(list(arrays)[-1], 'Account')
+        self.assertEqual(arrays['Account'][0], None)
+        self.assertEqual(arrays['Account'][1].Name, 'Acme')
+        self.assertEqual(arrays['Account'][2], None)
+        self.assertEqual(arrays['Quantity__c'].dtype.kind, 'f')
+        self.assertEqual(arrays['Quantity__c'].tolist()[1:], [6.0, 7.0])
+
+    @unittest.skipIf(columns.pandas is None, "pandas is not installed")
+    def testDataFrame(self):
+        builder = ColumnBuilder()
+        self.parse(queryResponse([opportunityXml(n) for n in range(1, 4)]),
+                   columns=builder)
+        frame = builder.toDataFrame()
+        self.assertEqual(list(frame.columns), list(builder.columns))
+        self.assertEqual(len(frame), 3)
+        self.assertEqual(frame['Quantity__c'].dtype.kind, 'i')
+        self.assertEqual(frame['Quantity__c'].sum(), 6)
+        self.assertEqual(frame['CloseDate'][0].date(),
+                         datetime.date(2020, 1, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import gzip
+import unittest
+
+import mock
+from six import BytesIO
+
+import pyforce
+from pyforce import xmlclient
+from pyforce.compression import CompressionPolicy
+from tests.util import FakeSalesforce
+from tests.util import saveResultXml
+
+
+def gunzip(data):
+    return gzip.GzipFile(fileobj=BytesIO(data)).read()
+
+
+class TestCompressionPolicy(unittest.TestCase):
+
+    def testThreshold(self):
+        policy = CompressionPolicy(threshold=100, level=1)
+        small, large = b'x' * 99, b'<a>x</a>' * 100
+        self.assertEqual(policy.compress(small), (small, False))
+        body, compressed = policy.compress(large)
+        self.assertTrue(compressed)
+        self.assertEqual(gunzip(body), large)
+
+        stats = policy.stats()
+        self.assertEqual(stats['requests'], 2)
+        self.assertEqual(stats['compressed'], 1)
+        self.assertEqual(stats['bytesIn'], 899)
+        self.assertEqual(stats['bytesOut'], 99 + len(body))
+        self.assertEqual(stats['bytesSaved'], 800 - len(body))
+        self.assertTrue(stats['seconds'] > 0)
+        self.assertTrue(stats['bytesSavedPerSecond'] > 0)
+        policy.resetStats()
+        self.assertEqual(policy.stats()['requests'], 0)
+
+    def testLevels(self):
+        data = b''.join(b'<o:Name>Account %d</o:Name>' % n
+                        for n in range(2000))
+        fast, _ = CompressionPolicy(level=1).compress(data)
+        small, _ = CompressionPolicy(level=9).compress(data)
+        self.assertTrue(len(small) < len(fast))
+        self.assertEqual(CompressionPolicy(level=0).compress(data),
+                         (data, False))
+        self.assertRaises(ValueError, CompressionPolicy, level=10)
+
+    def testOffThread(self):
+        policy = CompressionPolicy(threshold=10, offThreadSize=1000)
+        self.assertFalse(policy.offThread(999))
+        self.assertTrue(policy.offThread(1000))
+        self.assertFalse(CompressionPolicy().offThread(10 ** 6))
+
+
+class TestClientCompression(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeSalesforce().start()
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def encodings(self):
+        return [dict((k.lower(), v) for k, v in r.headers.items())
+                .get('content-encoding') for r in self.fake.requests]
+
+    def testSmallCallsUncompressed(self):
+        self.fake.responses['create'] = saveResultXml('001000000000001') * 50
+        policy = CompressionPolicy(threshold=2000)
+        svc = pyforce.PythonClient(self.fake.loginUrl, compression=policy)
+        svc.login('username', 'password')
+        svc.getServerTimestamp()
+        svc.create([dict(type='Account', Name='Account %d' % n)
+                    for n in range(50)])
+        self.assertEqual(self.encodings(), [None, None, 'gzip'])
+        self.assertEqual(self.fake.requests[-1].operationName, 'create')
+        stats = policy.stats()
+        self.assertEqual((stats['requests'], stats['compressed']), (3, 1))
+        self.assertTrue(stats['bytesSaved'] > 0)
+
+    def testStreamedRequests(self):
+        self.fake.responses['create'] = saveResultXml('001000000000001') * 50
+        svc = pyforce.PythonClient(self.fake.loginUrl, streamRequests=True)
+        svc.login('username', 'password')
+        results = svc.create([dict(type='Account', Name='Account %d' % n)
+                              for n in range(50)])
+        self.assertEqual(len(results), 50)
+        self.assertTrue(results[0]['success'])
+        request = self.fake.requests[-1]
+        headers = dict((k.lower(), v) for k, v in request.headers.items())
+        self.assertEqual(headers.get('transfer-encoding'), 'chunked')
+        self.assertEqual(headers.get('content-encoding'), 'gzip')
+        self.assertEqual(len(request.operation), 50)
+
+    def testGzipRequestTurnsCompressionOff(self):
+        svc = pyforce.XMLClient(self.fake.loginUrl,
+                                compression=CompressionPolicy(threshold=0))
+        with mock.patch.object(xmlclient, 'gzipRequest', False):
+            svc.login('username', 'password')
+        svc.getServerTimestamp()
+        self.assertEqual(self.encodings(), [None, 'gzip'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,204 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import csv
+import gzip
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+import pyforce
+from pyforce import SoapFaultError
+from pyforce.export import export
+from pyforce.export import main
+from pyforce.export import Output
+from tests.util import describeSObjectXml
+from tests.util import FakeSalesforce
+from tests.util import FAULT
+from tests.util import queryResultXml
+from tests.util import sObjectXml
+
+CONTACT_FIELDS = [
+    ('Id', 'id'),
+    ('LastName', 'string'),
+    ('Birthdate', 'date'),
+    ('LastModifiedDate', 'datetime'),
+    ('Favorite_Fruit__c', 'multipicklist'),
+    ('Photo__c', 'base64'),
+]
+ACCOUNT_FIELDS = [('Id', 'id'), ('Name', 'string')]
+
+
+class FakeContacts(object):
+    """Serves query and queryMore for the contacts matching a query"""
+
+    def __init__(self, fake, count, pageSize=3):
+        self.ids = ['003%012dAAA' % (n * 7) for n in range(count)]
+        self.pageSize = pageSize
+        self.pending = {}
+        # queryMore calls to fail after, or None
+        self.failAfter = None
+        fake.responses['query'] = self.query
+        fake.responses['queryMore'] = self.queryMore
+
+    def contactXml(self, recordId):
+        n = self.ids.index(recordId)
+        account = sObjectXml('Account', [('Name', 'Acme "%d"' % n)],
+                             tag='Account', prefix='sf:')
+        return sObjectXml('Contact', [
+            ('Id', recordId),
+            ('LastName', 'Doe, %d' % n),
+            ('Birthdate', '1970-01-%02d' % (n % 28 + 1)),
+            ('LastModifiedDate', '2020-01-02T10:20:30.250Z'),
+            ('Favorite_Fruit__c', 'Apple;Pear'),
+            ('Account', account),
+        ])
+
+    def query(self, request):
+        soql = str(request.operation[0])
+        if soql.endswith('LIMIT 1'):
+            return self.page([self.ids[-1] if 'DESC' in soql
+                              else self.ids[0]])
+        chosen = self.ids
+        for pattern, test in [(r"Id >= '(\w+)'", lambda i, v: i >= v),
+                              (r"Id < '(\w+)'", lambda i, v: i < v),
+                              (r"Id > '(\w+)'", lambda i, v: i > v)]:
+            match = re.search(pattern, soql)
+            if match:
+                chosen = [i for i in chosen if test(i, match.group(1))]
+        return self.page(chosen)
+
+    def queryMore(self, request):
+        if self.failAfter is not None:
+            if self.failAfter == 0:
+                self.failAfter = None
+                return FAULT.format('QUERY_TIMEOUT', 'timed out')
+            self.failAfter -= 1
+        return self.page(self.pending.pop(str(request.operation[0])))
+
+    def page(self, ids):
+        first, rest = ids[:self.pageSize], ids[self.pageSize:]
+        locator = None
+        if rest:
+            locator = '01gA-%s' % rest[0]
+            self.pending[locator] = rest
+        return queryResultXml([self.contactXml(i) for i in first],
+                              done=not rest, queryLocator=locator,
+                              size=len(ids))
+
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = fake = FakeSalesforce().start()
+        fake.responses['describeSObjects'] = self.describe
+        self.contacts = FakeContacts(fake, 20)
+        self.svc = pyforce.PythonClient(serverUrl=fake.loginUrl)
+        self.svc.login('username', 'password')
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.fake.stop()
+        shutil.rmtree(self.directory)
+
+    def describe(self, request):
+        types = {'Contact': CONTACT_FIELDS, 'Account': ACCOUNT_FIELDS}
+        return ''.join(describeSObjectXml(str(t), types[str(t)])
+                       for t in request.operation)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def queries(self):
+        return [str(r.operation[0]) for r in self.fake.requests
+                if r.operationName == 'query']
+
+    def testCsvOfType(self):
+        path = self.path('contacts.csv.gz')
+        rows = export(self.svc, 'Contact', path, compress=True,
+                      where="LastName != null", prefetch=2)
+        self.assertEqual(rows, 20)
+        self.assertEqual(self.queries(), [
+            'SELECT Id, LastName, Birthdate, LastModifiedDate, '
+            'Favorite_Fruit__c FROM Contact WHERE LastName != null'])
+        with gzip.open(path, 'rt') as f:
+            lines = list(csv.reader(f))
+        self.assertEqual(lines[0], ['Id', 'LastName', 'Birthdate',
+                                    'LastModifiedDate', 'Favorite_Fruit__c'])
+        self.assertEqual(lines[2], [self.contacts.ids[1], 'Doe, 1',
+                                    '1970-01-02', '2020-01-02T10:20:30.250Z',
+                                    'Apple;Pear'])
+        self.assertEqual([line[0] for line in lines[1:]], self.contacts.ids)
+
+    def testJsonLinesOfQuery(self):
+        path = self.path('contacts.jsonl')
+        export(self.svc, 'SELECT Id, Account.Name, Birthdate FROM Contact',
+               path, format='jsonl')
+        with io.open(path, encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual(len(rows), 20)
+        self.assertEqual(list(rows[3].items()), [
+            ('Id', self.contacts.ids[3]),
+            ('Account.Name', 'Acme "3"'),
+            ('Birthdate', '1970-01-04'),
+        ])
+
+    def testPartitionedResume(self):
+        path = self.path('contacts.csv.gz')
+        checkpoint = self.path('contacts.checkpoint')
+        self.contacts.failAfter = 3
+        kw = dict(compress=True, fields=['Id', 'LastName'], partitions=3,
+                  workers=2, checkpoint=checkpoint, checkpointRows=1,
+                  chunkRows=2)
+        outputs = []
+
+        class RecordedOutput(Output):
+            def __init__(self, *args):
+                Output.__init__(self, *args)
+                outputs.append(self)
+
+        with mock.patch('pyforce.export.Output', RecordedOutput):
+            self.assertRaises(SoapFaultError, export, self.svc, 'Contact',
+                              path, **kw)
+        self.assertTrue(outputs[0].raw.closed)
+        with io.open(checkpoint, encoding='utf-8') as f:
+            state = json.load(f)
+        self.assertEqual(len(state['partitions']), 3)
+        self.assertTrue(any(p['lastId'] for p in state['partitions']))
+        # the file holds the checkpointed rows, and perhaps some since
+        self.assertTrue(os.path.getsize(path) >= state['offset'])
+
+        del self.fake.requests[:]
+        export(self.svc, 'Contact', path, **kw)
+        self.assertFalse(os.path.exists(checkpoint))
+        for soql in self.queries():
+            self.assertTrue(soql.endswith(' ORDER BY Id'))
+        self.assertTrue(any("Id > '003" in q for q in self.queries()))
+        with gzip.open(path, 'rt') as f:
+            lines = list(csv.reader(f))
+        self.assertEqual(lines[0], ['Id', 'LastName'])
+        self.assertEqual(sorted(line[0] for line in lines[1:]),
+                         self.contacts.ids)
+
+    def testMain(self):
+        path = self.path('contacts.jsonl.gz')
+        self.assertEqual(main(['--quiet', '--fields', 'Id, LastName',
+                               'Contact', path], client=self.svc), 0)
+        with gzip.open(path, 'rt') as f:
+            self.assertEqual(len(f.readlines()), 20)
+        self.assertEqual(main(['--quiet', '--where', 'Id = null',
+                               'SELECT Id FROM Contact', path],
+                              client=self.svc), 2)
+        self.assertEqual(main(['--quiet', '--checkpoint', self.path('c'),
+                               'SELECT Name FROM Contact', path],
+                              client=self.svc), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+import unittest
+
+import pyforce
+from pyforce.pool import ConnectionPool
+from pyforce.pool import getDefaultPool
+from pyforce.pool import setDefaultPool
+from tests.util import FakeSalesforce
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeSalesforce().start()
+        self.pool = ConnectionPool(maxPerHost=2)
+
+    def tearDown(self):
+        self.pool.close()
+        self.fake.stop()
+
+    def testLoginAndCallsShareConnections(self):
+        svc = pyforce.XMLClient(self.fake.loginUrl, pool=self.pool)
+        svc.login('username', 'password')
+        svc.getServerTimestamp()
+        svc.getServerTimestamp()
+        stats = self.pool.stats()
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(self.fake.connections, 1)
+
+    def testClientsShareThePool(self):
+        for _ in range(3):
+            svc = pyforce.PythonClient(self.fake.loginUrl, pool=self.pool)
+            svc.login('username', 'password')
+            self.assertTrue(svc.conn is self.pool.session)
+        stats = self.pool.stats()
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['misses'], 1)
+
+    def testDefaultPool(self):
+        svc = pyforce.XMLClient(self.fake.loginUrl)
+        svc.login('username', 'password')
+        self.assertTrue(svc.conn is getDefaultPool().session)
+
+    def testClose(self):
+        with pyforce.PythonClient(self.fake.loginUrl, pool=self.pool) as svc:
+            svc.login('username', 'password')
+        self.assertFalse(svc.isConnected())
+        self.assertEqual(self.pool.stats()['hosts'], 0)
+        # the process-wide pool stays open for other clients, a fresh one
+        # here as other tests leave theirs holding their servers' hosts
+        self.addCleanup(setDefaultPool, getDefaultPool())
+        setDefaultPool(ConnectionPool())
+        self.addCleanup(getDefaultPool().close)
+        with pyforce.PythonClient(self.fake.loginUrl) as svc:
+            svc.login('username', 'password')
+        self.assertEqual(getDefaultPool().stats()['hosts'], 1)
+
+    def testPruneIdleHosts(self):
+        self.pool.idleTimeout = 60
+        svc = pyforce.XMLClient(self.fake.loginUrl, pool=self.pool)
+        svc.login('username', 'password')
+        self.assertEqual(self.pool.stats()['hosts'], 1)
+        self.pool.prune()
+        self.assertEqual(self.pool.stats()['hosts'], 1)
+        lastUsed = max(self.pool._lastUsed.values())
+        self.pool.prune(lastUsed + 61)
+        stats = self.pool.stats()
+        self.assertEqual(stats['hosts'], 0)
+        self.assertEqual(stats['pruned'], 1)
+        # the handshake count survives the pruned host
+        self.assertEqual(stats['misses'], 1)
+        svc.getServerTimestamp()
+        self.assertEqual(self.pool.stats()['misses'], 2)
+        self.assertEqual(self.fake.connections, 2)
+
+    def testResetAfterFork(self):
+        svc = pyforce.XMLClient(self.fake.loginUrl, pool=self.pool)
+        svc.login('username', 'password')
+        session = self.pool.session
+        # pretend we are the child of a fork
+        self.pool._pid = os.getpid() + 1
+        self.assertFalse(self.pool.session is session)
+        self.assertEqual(self.pool.stats()['requests'], 0)
+        svc.getServerTimestamp()
+        self.assertEqual(self.pool.stats()['misses'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,16 +1,28 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+import base64
 import datetime
 import os
+import re
+import threading
 import unittest
 from time import sleep
 
+from requests.packages.urllib3.exceptions import ProtocolError
+from six import BytesIO
 from six import string_types
 
 import pyforce
 from pyforce import SoapFaultError
 from pyforce.pyclient import _prepareSObjects
+from tests.util import describeSObjectXml
+from tests.util import FakeSalesforce
+from tests.util import FAULT
+from tests.util import queryResultXml
+from tests.util import RawXml
+from tests.util import saveResultXml
+from tests.util import sObjectXml
 
 
 SERVER_URL = "https://test.salesforce.com/services/Soap/u/20.0"
@@ -240,7 +252,7 @@ class TestUtils(unittest.TestCase):
         fieldnames = [f.name for f in fields]
         fieldnames = ', '.join(fieldnames)
         contacts = svc.retrieve(fieldnames, 'Contact', [id])
-        self.assertEqual(len(contacts), 0)
+        self.assertEqual(contacts, [None])
 
     def testDelete(self):
         svc = self.svc
@@ -955,9 +967,552 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(cm.exception.faultCode, 'INVALID_SESSION_ID', "Session didn't fail with INVALID_SESSION_ID.")
 
 
+CONTACT_FIELDS = [
+    ('Id', 'id'),
+    ('LastName', 'string'),
+    ('Birthdate', 'date'),
+    ('Favorite_Integer__c', 'int'),
+    ('Favorite_Fruit__c', 'multipicklist'),
+    ('AccountId', 'reference'),
+]
+ACCOUNT_FIELDS = [
+    ('Id', 'id'),
+    ('Name', 'string'),
+    ('AnnualRevenue', 'currency'),
+]
+ATTACHMENT_FIELDS = [
+    ('Id', 'id'),
+    ('Name', 'string'),
+    ('Body', 'base64'),
+]
+
+
+def fakeContact(n, **extra):
+    fields = [
+        ('Id', '003%015d' % n),
+        ('Id', '003%015d' % n),
+        ('LastName', 'Doe %d' % n),
+        ('Birthdate', '1970-01-%02d' % (n % 28 + 1)),
+        ('Favorite_Integer__c', n),
+        ('Favorite_Fruit__c', 'Apple;Pear'),
+    ]
+    fields.extend(extra.items())
+    return sObjectXml('Contact', fields)
+
+
+class TestFakeServer(unittest.TestCase):
+    """PythonClient against the in-process stand-in for Salesforce"""
+
+    def setUp(self):
+        self.fake = fake = FakeSalesforce().start()
+        fake.responses['describeSObjects'] = self.describe
+        self.svc = pyforce.PythonClient(serverUrl=fake.loginUrl)
+        self.svc.login('username', 'password')
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def describe(self, request):
+        types = {'Contact': CONTACT_FIELDS, 'Account': ACCOUNT_FIELDS,
+                 'Attachment': ATTACHMENT_FIELDS}
+        return ''.join(
+            describeSObjectXml(str(t), types[str(t)])
+            for t in request.operation
+        )
+
+    def testQuery(self):
+        account = sObjectXml('Account', [
+            ('Id', None), ('Name', 'Acme'), ('AnnualRevenue', '1.5E7'),
+        ], tag='Account', prefix='sf:')
+        self.fake.responses['query'] = queryResultXml(
+            [fakeContact(1, Account=account), fakeContact(2)],
+            done=False, queryLocator='01gA-2', size=3)
+        res = self.svc.query('SELECT Id FROM Contact')
+        self.assertEqual(len(res), 2)
+        self.assertFalse(res.done)
+        self.assertEqual(res.size, 3)
+        self.assertEqual(res.queryLocator, '01gA-2')
+        self.assertEqual(res[0]['Id'], '003000000000000001')
+        self.assertEqual(res[0].type, 'Contact')
+        self.assertEqual(res[0].Birthdate, datetime.date(1970, 1, 2))
+        self.assertEqual(res[0].Favorite_Integer__c, 1)
+        self.assertEqual(res[0].Favorite_Fruit__c, ['Apple', 'Pear'])
+        self.assertEqual(res[0].Account.Name, 'Acme')
+        self.assertEqual(res[0].Account.AnnualRevenue, 1.5e7)
+        self.assertEqual(self.fake.operations().count('describeSObjects'), 1)
+
+        self.fake.responses['queryMore'] = queryResultXml(
+            [fakeContact(3)], size=3)
+        res = self.svc.queryMore(res.queryLocator)
+        self.assertTrue(res.done)
+        self.assertEqual(res[0].LastName, 'Doe 3')
+
+    def pagedQuery(self, pages, pageSize=2):
+        """Serve `pages` pages of contacts from query and queryMore"""
+        total = pages * pageSize
+        responses = []
+        for p in range(pages):
+            done = p == pages - 1
+            responses.append(queryResultXml(
+                [fakeContact(p * pageSize + n) for n in range(pageSize)],
+                done=done,
+                queryLocator=None if done else '01gA-%d' % (p + 1),
+                size=total,
+            ))
+        self.fake.responses['query'] = responses[0]
+        self.fake.responses['queryMore'] = responses[1:]
+
+    def testIterQuery(self):
+        for prefetch in (0, 1, 3):
+            self.pagedQuery(4)
+            names = [r.LastName for r in
+                     self.svc.iterQuery('SELECT Id FROM Contact', prefetch)]
+            self.assertEqual(names, ['Doe %d' % n for n in range(8)])
+        locators = [str(r.operation[0]) for r in self.fake.requests
+                    if r.operationName == 'queryMore']
+        self.assertEqual(locators[-3:], ['01gA-1', '01gA-2', '01gA-3'])
+
+    @unittest.skipIf(pyforce.columns.pandas is None,
+                     "pandas is not installed")
+    def testQueryDataFrame(self):
+        self.pagedQuery(3)
+        frame = self.svc.queryDataFrame('SELECT Id FROM Contact')
+        self.assertEqual(list(frame.LastName), ['Doe %d' % n for n in range(6)])
+        self.assertEqual(frame.Favorite_Integer__c.dtype.kind, 'i')
+        self.assertEqual(frame.Birthdate[5].date(), datetime.date(1970, 1, 6))
+        self.assertEqual(self.fake.operations().count('queryMore'), 2)
+        self.assertEqual(self.fake.operations().count('describeSObjects'), 1)
+
+        self.pagedQuery(1)
+        arrays = self.svc.queryArrays('SELECT Id FROM Contact')
+        self.assertEqual(arrays['Favorite_Fruit__c'].tolist(),
+                         [['Apple', 'Pear']] * 2)
+
+    def testIterQueryPrefetches(self):
+        self.pagedQuery(4)
+        requested = threading.Event()
+        more = self.fake.responses['queryMore']
+
+        def queryMore(request):
+            requested.set()
+            return more.pop(0)
+        self.fake.responses['queryMore'] = queryMore
+        records = self.svc.iterQuery('SELECT Id FROM Contact', prefetch=1)
+        self.assertEqual(next(records).LastName, 'Doe 0')
+        # the second page is on its way before the first is consumed
+        self.assertTrue(requested.wait(5))
+        records.close()
+        sleep(0.5)
+        # one page queued, and at most one more fetched while waiting
+        self.assertTrue(self.fake.operations().count('queryMore') <= 2)
+
+    def testIterQueryError(self):
+        self.pagedQuery(2)
+        self.fake.responses['queryMore'] = FAULT.format(
+            'INVALID_QUERY_LOCATOR', 'invalid query locator')
+        records = self.svc.iterQuery('SELECT Id FROM Contact', prefetch=2)
+        self.assertEqual(next(records).LastName, 'Doe 0')
+        self.assertEqual(next(records).LastName, 'Doe 1')
+        with self.assertRaises(SoapFaultError) as cm:
+            next(records)
+        self.assertEqual(cm.exception.faultCode, 'INVALID_QUERY_LOCATOR')
+
+    def testQueryPartitioned(self):
+        ids = ['0030000000%05dAAA' % (n * 7) for n in range(100)]
+
+        def query(request):
+            soql = str(request.operation[0])
+            if soql.endswith('LIMIT 1'):
+                chosen = [ids[-1] if 'DESC' in soql else ids[0]]
+            else:
+                lower = re.search(r"Id >= '(\w+)'", soql)
+                upper = re.search(r"Id < '(\w+)'", soql)
+                chosen = [i for i in ids
+                          if (not lower or i[:15] >= lower.group(1)) and
+                          (not upper or i[:15] < upper.group(1))]
+            return queryResultXml([
+                sObjectXml('Contact', [('Id', i), ('LastName', i)])
+                for i in chosen
+            ])
+        self.fake.responses['query'] = query
+        records = self.svc.queryPartitioned(
+            "SELECT Id, LastName FROM Contact WHERE LastName != 'x'",
+            partitions=4, workers=2)
+        self.assertEqual(sorted(r.LastName for r in records), ids)
+        queries = [str(r.operation[0]) for r in self.fake.requests
+                   if r.operationName == 'query']
+        self.assertEqual(len(queries), 6)
+        for soql in queries[2:]:
+            self.assertTrue(soql.startswith(
+                "SELECT Id, LastName FROM Contact WHERE (LastName != 'x') AND"))
+
+    def testQueryPartitionedErrors(self):
+        with self.assertRaises(ValueError):
+            next(self.svc.queryPartitioned(
+                'SELECT Id FROM Contact ORDER BY Name'))
+        self.fake.responses['query'] = [
+            queryResultXml([fakeContact(0)]),
+            queryResultXml([fakeContact(999)]),
+            queryResultXml([fakeContact(1)], done=False, queryLocator='01gA-1'),
+        ]
+        self.fake.responses['queryMore'] = FAULT.format(
+            'INVALID_QUERY_LOCATOR', 'invalid query locator')
+        records = self.svc.queryPartitioned(
+            'SELECT Id FROM Contact', partitions=2, workers=1)
+        self.assertEqual(next(records).LastName, 'Doe 1')
+        with self.assertRaises(SoapFaultError):
+            list(records)
+
+    def testLazyRecords(self):
+        svc = pyforce.PythonClient(serverUrl=self.fake.loginUrl,
+                                   lazyRecords=True)
+        svc.login('username', 'password')
+        account = sObjectXml('Account', [
+            ('Id', None), ('Name', 'Acme'), ('AnnualRevenue', '1.5E7'),
+        ], tag='Account', prefix='sf:')
+        records = [fakeContact(n) for n in range(1, 4)]
+        records.append(fakeContact(4, Account=account))
+        self.fake.responses['query'] = queryResultXml(records)
+        res = svc.query('SELECT Id FROM Contact')
+        self.assertEqual(len(res), 4)
+        self.assertEqual(res.size, 4)
+        self.assertFalse(any(r.decoded for r in res))
+
+        young = [r for r in res if r.Birthdate > datetime.date(1970, 1, 3)]
+        self.assertEqual([r.Id for r in young],
+                         ['003000000000000003', '003000000000000004'])
+        self.assertFalse(any(r.decoded for r in res))
+        self.assertEqual(young[1].Account.AnnualRevenue, 1.5e7)
+
+        self.svc.lazyRecords = False
+        self.assertEqual(res, self.svc.query('SELECT Id FROM Contact'))
+        self.assertTrue(all(r.decoded for r in res))
+        self.assertEqual(res[0].Favorite_Fruit__c, ['Apple', 'Pear'])
+
+    def testSlottedRecords(self):
+        svc = pyforce.PythonClient(serverUrl=self.fake.loginUrl,
+                                   slottedRecords=True)
+        svc.login('username', 'password')
+        account = sObjectXml('Account', [
+            ('Id', None), ('Name', 'Acme'), ('AnnualRevenue', '1.5E7'),
+        ], tag='Account', prefix='sf:')
+        self.fake.responses['query'] = queryResultXml(
+            [fakeContact(1, Account=account), fakeContact(2), fakeContact(3)])
+        res = svc.query('SELECT Id FROM Contact')
+        self.assertEqual(res, self.svc.query('SELECT Id FROM Contact'))
+        self.assertFalse(hasattr(res[0], '__dict__'))
+        self.assertEqual(type(res[0]).__name__, 'ContactRecord')
+        # a class per field layout
+        self.assertFalse(type(res[0]) is type(res[1]))
+        self.assertTrue(type(res[1]) is type(res[2]))
+        self.assertEqual(res[0].Birthdate, datetime.date(1970, 1, 2))
+        self.assertEqual(res[0]['Favorite_Fruit__c'], ['Apple', 'Pear'])
+        self.assertEqual(res[0].Account.AnnualRevenue, 1.5e7)
+        res[1].LastName = 'Roe'
+        self.assertEqual(res[1]['LastName'], 'Roe')
+        self.assertRaises(KeyError, res[1].__setitem__, 'Nope__c', 1)
+
+        self.fake.responses['retrieve'] = fakeContact(7).replace(
+            '<records ', '<result ').replace('</records>', '</result>')
+        res = svc.retrieve('LastName, Birthdate', 'Contact',
+                           ['003000000000000007'])
+        self.assertEqual(res, [{'LastName': 'Doe 7',
+                                'Birthdate': datetime.date(1970, 1, 8)}])
+        self.assertEqual(list(res[0].keys()), ['LastName', 'Birthdate'])
+        self.assertRaises(ValueError, pyforce.PythonClient,
+                          lazyRecords=True, slottedRecords=True)
+
+    def testRetriesCutResponses(self):
+        self.fake.responses['query'] = queryResultXml(
+            [fakeContact(n) for n in range(2000)])
+        self.fake.gzipResponses = False
+        self.fake.cutResponses = 1
+        res = self.svc.query('SELECT Id FROM Contact')
+        self.assertEqual(len(res), 2000)
+        self.assertEqual(res[1999].Favorite_Integer__c, 1999)
+        self.assertEqual(self.fake.operations().count('query'), 2)
+
+        # records already passed on can't be taken back
+        emitted = []
+        handler = self.svc._recordHandler(onRecord=emitted.append)
+        handler.typeDescs.update(self.svc._describeTypes(['Contact']))
+        self.fake.cutResponses = 1
+        with self.assertRaises(ProtocolError):
+            pyforce.XMLClient.query(self.svc, 'SELECT Id FROM Contact',
+                                    handler=handler)
+        self.assertTrue(0 < len(emitted) < 2000)
+        self.assertEqual(self.fake.operations().count('query'), 3)
+
+        # nor are writes sent again
+        self.fake.responses['create'] = saveResultXml('003000000000001AAA')
+        self.fake.cutResponses = 1
+        with self.assertRaises(ProtocolError):
+            self.svc.create([dict(type='Contact', LastName='Doe')])
+        self.assertEqual(self.fake.operations().count('create'), 1)
+
+    def testQueryWithoutDescribe(self):
+        svc = pyforce.PythonClient(
+            serverUrl=self.fake.loginUrl, describeTypes=False,
+            fieldTypes={'Contact.Birthdate': 'date',
+                        'Favorite_Fruit__c': 'multipicklist'})
+        svc.login('username', 'password')
+        account = sObjectXml('Account', [
+            ('Id', '001000000000000001'),
+            ('AnnualRevenue', RawXml(
+                '<sf:AnnualRevenue xsi:type="xsd:double">1.5E7'
+                '</sf:AnnualRevenue>')),
+        ], tag='Account', prefix='sf:')
+        self.fake.responses['query'] = queryResultXml([
+            fakeContact(1, Account=account),
+        ])
+        res = svc.query('SELECT Id, LastName, Birthdate, Favorite_Integer__c, '
+                        'Favorite_Fruit__c, Account.AnnualRevenue '
+                        'FROM Contact')
+        self.assertEqual(res[0].Birthdate, datetime.date(1970, 1, 2))
+        self.assertEqual(res[0].Favorite_Fruit__c, ['Apple', 'Pear'])
+        self.assertEqual(res[0].Favorite_Integer__c, '1')
+        self.assertEqual(res[0].Account.AnnualRevenue, 1.5e7)
+        self.assertEqual(self.fake.operations()[-2:], ['login', 'query'])
+
+        self.fake.responses['retrieve'] = fakeContact(7).replace(
+            '<records ', '<result ').replace('</records>', '</result>')
+        res = svc.retrieve('LastName, Birthdate', 'Contact',
+                           ['003000000000000007'])
+        self.assertEqual(res[0]['Birthdate'], datetime.date(1970, 1, 8))
+        self.assertFalse('describeSObjects' in self.fake.operations())
+
+    def testInferredTypesReused(self):
+        svc = pyforce.PythonClient(
+            serverUrl=self.fake.loginUrl, describeTypes=False,
+            fieldTypes={'Contact.Birthdate': 'date'})
+        first = svc._describeTypes(['Contact'])['Contact']
+        self.assertTrue(svc._describeTypes(['Contact'])['Contact'] is first)
+        svc.fieldTypes['Favorite_Integer__c'] = 'int'
+        changed = svc._describeTypes(['Contact'])['Contact']
+        self.assertFalse(changed is first)
+        self.assertEqual(changed.fieldType('Favorite_Integer__c'), 'int')
+        self.assertEqual(first.fieldType('Favorite_Integer__c'), 'string')
+
+    def testParentToChildQuery(self):
+        contacts = queryResultXml(
+            [fakeContact(1), fakeContact(2)], tag='Contacts', prefix='sf:')
+        account = sObjectXml('Account', [
+            ('Id', '001000000000000001'), ('Name', 'Acme'),
+            ('Contacts', contacts),
+        ])
+        self.fake.responses['query'] = queryResultXml([account])
+        res = self.svc.query('SELECT Name, (SELECT Id FROM Contacts) '
+                             'FROM Account')
+        self.assertEqual(res[0].Contacts.size, 2)
+        self.assertEqual(res[0].Contacts[1].Favorite_Integer__c, 2)
+
+    def testRetrieve(self):
+        self.fake.responses['retrieve'] = fakeContact(7).replace(
+            '<records ', '<result ').replace('</records>', '</result>')
+        res = self.svc.retrieve('LastName, Birthdate', 'Contact',
+                                ['003000000000000007'])
+        self.assertEqual(res, [{'LastName': 'Doe 7',
+                                'Birthdate': datetime.date(1970, 1, 8)}])
+
+    def testRetrieveMissing(self):
+        # the nil result of an id not found keeps its place
+        found = [fakeContact(n).replace('<records ', '<result ')
+                 .replace('</records>', '</result>') for n in (1, 3)]
+        self.fake.responses['retrieve'] = (
+            found[0] + '<result xsi:nil="true"/>' + found[1])
+        ids = ['00300000000000000%d' % n for n in (1, 2, 3)]
+        for slotted in (False, True):
+            self.svc.slottedRecords = slotted
+            res = self.svc.retrieve('Id, LastName', 'Contact', ids)
+            self.assertEqual([r and r['LastName'] for r in res],
+                             ['Doe 1', None, 'Doe 3'])
+
+    def testCreate(self):
+        self.fake.responses['create'] = (
+            saveResultXml('003000000000000001') +
+            saveResultXml(None, success=False))
+        res = self.svc.create([
+            dict(type='Contact', LastName='Doe'),
+            dict(type='Contact', LastName=None),
+        ])
+        self.assertEqual(res[0], {'id': '003000000000000001',
+                                  'success': True, 'errors': []})
+        self.assertFalse(res[1]['success'])
+        sent = self.fake.requests[-1].operation
+        self.assertEqual(len(sent), 2)
+        self.assertEqual(
+            str(sent[1][pyforce.pyclient._tSObjectNS.fieldsToNull]),
+            'LastName')
+
+    def testDescribesAfterResponse(self):
+        # with one connection the response must be read before the
+        # describe call can be sent
+        pool = pyforce.ConnectionPool(maxPerHost=1, block=True)
+        svc = pyforce.PythonClient(serverUrl=self.fake.loginUrl, pool=pool)
+        svc.login('username', 'password')
+        # more than the parser reads at once, so the connection is still
+        # busy with the response when the first record ends
+        self.fake.responses['search'] = (
+            '<result><searchRecords>' + ''.join(
+                sObjectXml('Contact', [
+                    ('Id', '003000000000001'),
+                    ('Description',
+                     base64.b64encode(os.urandom(48)).decode('ascii')),
+                ], tag='record') for n in range(2000)) +
+            sObjectXml('Account', [('Id', '001000000000001')],
+                       tag='record') +
+            '</searchRecords></result>')
+        res = []
+        thread = threading.Thread(target=lambda: res.extend(
+            svc.search('FIND {Acme} RETURNING Contact(Id), Account(Id)')))
+        thread.daemon = True
+        thread.start()
+        thread.join(10)
+        self.assertFalse(thread.is_alive(), 'search deadlocked')
+        self.assertEqual([r.type for r in res],
+                         ['Contact'] * 2000 + ['Account'])
+        self.assertEqual(self.fake.operations().count('describeSObjects'), 1)
+
+    def testRetrieveBase64Files(self):
+        data = os.urandom(200000)
+        self.fake.responses['retrieve'] = sObjectXml('Attachment', [
+            ('Id', '00P000000000001AAA'), ('Name', 'photo.jpg'),
+            ('Body', base64.b64encode(data).decode('ascii')),
+        ], tag='result')
+        files = {}
+
+        def base64Files(fname, fields):
+            files[fields['Id'], fname] = BytesIO()
+            return files[fields['Id'], fname]
+
+        res = self.svc.retrieve('Name, Body', 'Attachment',
+                                ['00P000000000001AAA'],
+                                base64Files=base64Files)
+        body = files['00P000000000001AAA', 'Body']
+        self.assertEqual(res, [{'Name': 'photo.jpg', 'Body': body}])
+        self.assertEqual(body.getvalue(), data)
+
+    def testCreateLeavesSObjectsUnchanged(self):
+        self.fake.responses['create'] = saveResultXml('003000000000000001')
+        account = dict(type='Account', Name='Acme', Site=None)
+        contact = dict(type='Contact', LastName='Doe', Phone=None,
+                       Favorite_Fruit__c=['Apple', 'Pear'], Account=account)
+        self.svc.create(contact)
+        self.assertEqual(contact, dict(
+            type='Contact', LastName='Doe', Phone=None,
+            Favorite_Fruit__c=['Apple', 'Pear'],
+            Account=dict(type='Account', Name='Acme', Site=None)))
+        sObjectNS = pyforce.pyclient._tSObjectNS
+        sent = self.fake.requests[-1].operation[0]
+        self.assertEqual(str(sent[sObjectNS.type]), 'Contact')
+        self.assertEqual(str(sent[sObjectNS.Favorite_Fruit__c]), 'Apple;Pear')
+        self.assertEqual(str(sent[sObjectNS.fieldsToNull]), 'Phone')
+        self.assertEqual(str(sent[sObjectNS.Account][sObjectNS.type]),
+                         'Account')
+        self.assertEqual(
+            str(sent[sObjectNS.Account][sObjectNS.fieldsToNull]), 'Site')
+        self.assertRaises(ValueError, self.svc.create,
+                          dict(type='Contact', fieldsToNull=['Phone']))
+
+    def testCreateBatches(self):
+        lock = threading.Lock()
+        inFlight = [0]
+        allInFlight = threading.Event()
+
+        def create(request):
+            # holds each batch until all three are being sent at once
+            with lock:
+                inFlight[0] += 1
+                if inFlight[0] == 3:
+                    allInFlight.set()
+            allInFlight.wait(10)
+            return ''.join(
+                saveResultXml('003%015d' % int(str(
+                    r[pyforce.pyclient._tSObjectNS.LastName])))
+                for r in request.operation
+            )
+        self.fake.responses['create'] = create
+        records = (dict(type='Contact', LastName=str(n)) for n in range(450))
+        res = self.svc.create(records, workers=3)
+        self.assertEqual([r['id'] for r in res],
+                         ['003%015d' % n for n in range(450)])
+        sizes = [len(r.operation) for r in self.fake.requests
+                 if r.operationName == 'create']
+        self.assertEqual(sorted(sizes), [50, 200, 200])
+        self.assertTrue(allInFlight.is_set())
+
+    def testBatchesReadAsSent(self):
+        lock = threading.Lock()
+        inFlight = [0]
+        bothInFlight = threading.Event()
+        read = []
+        readWhileInFlight = []
+
+        def records():
+            for n in range(1000):
+                read.append(n)
+                yield dict(type='Contact', LastName=str(n))
+
+        def create(request):
+            with lock:
+                inFlight[0] += 1
+                if inFlight[0] == 2:
+                    bothInFlight.set()
+            bothInFlight.wait(10)
+            with lock:
+                if not readWhileInFlight:
+                    readWhileInFlight.append(len(read))
+            return ''.join(
+                saveResultXml('003%015d' % int(str(
+                    r[pyforce.pyclient._tSObjectNS.LastName])))
+                for r in request.operation
+            )
+        self.fake.responses['create'] = create
+        res = self.svc.create(records(), workers=2)
+        self.assertEqual(len(res), 1000)
+        self.assertTrue(bothInFlight.is_set())
+        # with the first two batches being sent, at most one more was read
+        self.assertTrue(readWhileInFlight[0] <= 600)
+
+    def testFailedBatches(self):
+        def update(request):
+            ids = [str(r[pyforce.pyclient._tSObjectNS.Id])
+                   for r in request.operation]
+            if '001000000000000250' in ids:
+                return FAULT.format('REQUEST_LIMIT_EXCEEDED', 'too many')
+            return ''.join(saveResultXml(i) for i in ids)
+        self.fake.responses['update'] = update
+        ids = ['001%015d' % n for n in range(450)]
+        records = (dict(type='Account', Id=i, Name='Acme') for i in ids)
+        try:
+            self.svc.update(records, workers=2)
+            self.fail('expected a BatchError')
+        except pyforce.BatchError as e:
+            self.assertEqual(len(e.errors), 1)
+            batch, error = e.errors[0]
+            self.assertEqual([r['Id'] for r in batch], ids[200:400])
+            self.assertEqual(error.faultCode, 'REQUEST_LIMIT_EXCEEDED')
+            self.assertEqual(len(e.results), 450)
+            self.assertEqual([r['id'] for r in e.results[:200]], ids[:200])
+            self.assertEqual(e.results[200:400], [None] * 200)
+            self.assertEqual([r['id'] for r in e.results[400:]], ids[400:])
+        self.assertEqual(self.fake.operations().count('update'), 3)
+
+    def testDeleteBatches(self):
+        self.fake.responses['delete'] = lambda request: ''.join(
+            saveResultXml(str(i)) for i in request.operation)
+        ids = ['003%015d' % n for n in range(201)]
+        res = self.svc.delete(ids)
+        self.assertEqual([r['id'] for r in res], ids)
+        self.assertEqual(self.fake.operations().count('delete'), 2)
+        res = self.svc.delete(ids[0])
+        self.assertEqual([r['id'] for r in res], ids[:1])
+
+
 def test_suite():
     return unittest.TestSuite((
         unittest.makeSuite(TestUtils),
+        unittest.makeSuite(TestFakeServer),
     ))
 
 
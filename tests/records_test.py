@@ -0,0 +1,268 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import base64
+import binascii
+import copy
+import datetime
+import pickle
+import unittest
+
+from six import BytesIO
+
+from pyforce import xmlparser
+from pyforce import xmltramp
+from pyforce.marshall import Base64Writer
+from pyforce.pyclient import Field
+from pyforce.pyclient import SObject
+from pyforce.records import QueryRecord
+from pyforce.records import recordClass
+from pyforce.records import RecordHandler
+from pyforce.xmlclient import SessionTimeoutError
+from pyforce.xmlclient import SoapEnvelope
+from pyforce.xmlclient import SoapFaultError
+from tests.util import ENVELOPE
+from tests.util import FAULT
+from tests.util import queryResultXml
+from tests.util import RawXml
+from tests.util import sObjectXml
+
+
+def describe(name, **fieldTypes):
+    fields = dict((n, Field(name=n, type=t)) for n, t in fieldTypes.items())
+    return SObject(name=name, fields=fields)
+
+
+TYPES = {
+    'Contact': describe(
+        'Contact', Id='id', Birthdate='date', Count__c='int',
+        Fruit__c='multipicklist', MailingAddress='address',
+        Notes__c='textarea'),
+    'Account': describe('Account', Id='id', Name='string',
+                        AnnualRevenue='currency'),
+    'Attachment': describe('Attachment', Id='id', Name='string',
+                           Body='base64'),
+}
+
+ADDRESS = RawXml(
+    '<sf:MailingAddress xsi:type="address"><city>Springfield</city>'
+    '<country>US</country></sf:MailingAddress>')
+
+
+def contactXml(n, account=True):
+    fields = [
+        ('Id', '003000000000000%03d' % n),
+        ('Id', '003000000000000%03d' % n),
+        ('Birthdate', '1970-01-%02d' % (n % 28 + 1)),
+        ('Count__c', n),
+        ('Fruit__c', 'Apple;Pear'),
+        ('MailingAddress', ADDRESS),
+        ('Notes__c', '  spaced out  '),
+        ('Blank__c', '   '),
+        ('Unknown__c', None),
+    ]
+    if account:
+        contacts = queryResultXml(
+            [sObjectXml('Contact', [('Id', '003000000000000999')])],
+            tag='Contacts', prefix='sf:')
+        fields.append(('Account', sObjectXml('Account', [
+            ('Name', 'Acme & Co'), ('AnnualRevenue', 1.5e7),
+            ('Contacts', contacts),
+        ], tag='Account', prefix='sf:')))
+    else:
+        fields.append(('Account', None))
+    return sObjectXml('Contact', fields)
+
+
+def queryResponse(records, **kw):
+    return ENVELOPE.format(
+        '<queryResponse>' + queryResultXml(records, **kw) + '</queryResponse>')
+
+
+class TestRecordHandler(unittest.TestCase):
+    def setUp(self):
+        self.described = []
+
+    def describe(self, types):
+        self.described.append(sorted(types))
+        return dict((t, TYPES[t]) for t in types)
+
+    def parse(self, body, **kw):
+        handler = RecordHandler(self.describe, **kw)
+        return SoapEnvelope('', 'query').parseResponse(body, handler=handler)
+
+    def testDecoding(self):
+        body = queryResponse(
+            [contactXml(n, account=n % 2 == 0) for n in range(5)],
+            done=False, queryLocator='01g000000000001-500', size=12)
+        result = self.parse(body.encode('utf-8')).queryResult()
+        self.assertEqual(len(result), 5)
+        self.assertFalse(result.done)
+        self.assertEqual(result.size, 12)
+        self.assertEqual(result.queryLocator, '01g000000000001-500')
+
+        record = result[0]
+        self.assertEqual(list(record.keys()), [
+            'type', 'Id', 'Birthdate', 'Count__c', 'Fruit__c',
+            'MailingAddress', 'Notes__c', 'Blank__c', 'Unknown__c',
+            'Account'])
+        self.assertEqual(record.type, 'Contact')
+        self.assertEqual(record.Id, '003000000000000000')
+        self.assertEqual(record.Count__c, 0)
+        self.assertEqual(record.Fruit__c, ['Apple', 'Pear'])
+        self.assertEqual(record.Unknown__c, '')
+        self.assertEqual(record.Birthdate, datetime.date(1970, 1, 1))
+        self.assertEqual(record.MailingAddress,
+                         {'city': 'Springfield', 'country': 'US'})
+        self.assertEqual(record.Notes__c, '  spaced out  ')
+        self.assertEqual(record.Blank__c, '')
+        self.assertEqual(record.Account.Name, 'Acme & Co')
+        self.assertEqual(record.Account.Contacts.size, 1)
+        self.assertTrue(record.Account.Contacts.done)
+        self.assertEqual(record.Account.Contacts[0].Id, '003000000000000999')
+        self.assertEqual(result[1].Account, '')
+
+    def testDescribesTypesTogether(self):
+        self.parse(queryResponse([contactXml(n) for n in range(3)]))
+        self.assertEqual(self.described, [['Account', 'Contact']])
+
+    def testLazyRecords(self):
+        body = queryResponse([contactXml(n, account=n % 2 == 0)
+                              for n in range(3)])
+        expected = self.parse(body).queryResult()
+        result = self.parse(body, lazy=True).queryResult()
+        record = result[0]
+        self.assertFalse(record.decoded)
+        self.assertEqual(record.Count__c, 0)
+        self.assertEqual(record.get('Birthdate'), datetime.date(1970, 1, 1))
+        self.assertEqual(record.get('Missing__c', 'none'), 'none')
+        self.assertTrue('Fruit__c' in record)
+        self.assertFalse('Missing__c' in record)
+        self.assertEqual(dict.__len__(record), 2)
+        self.assertFalse(record.decoded)
+
+        record.Count__c = 7
+        self.assertEqual(list(record.keys()), list(expected[0].keys()))
+        self.assertTrue(record.decoded)
+        self.assertEqual(record.Count__c, 7)
+        record.Count__c = 0
+        self.assertEqual(result, expected)
+        self.assertEqual(pickle.loads(pickle.dumps(result[1])), expected[1])
+        self.assertEqual(type(result[2].copy()), QueryRecord)
+        self.assertEqual(len(result[2]), len(expected[2]))
+
+    def testSlottedRecords(self):
+        body = queryResponse([contactXml(n, account=n % 2 == 0)
+                              for n in range(3)])
+        expected = self.parse(body).queryResult()
+        result = self.parse(body, slotted=True).queryResult()
+        self.assertEqual(result, expected)
+        record = result[0]
+        self.assertEqual(type(record).__name__, 'ContactRecord')
+        self.assertFalse(hasattr(record, '__dict__'))
+        self.assertEqual(list(record.keys()), list(expected[0].keys()))
+        self.assertEqual(record.Account.Name, 'Acme & Co')
+        self.assertEqual(record['Account']['Contacts'][0].Id,
+                         '003000000000000999')
+
+        record.Count__c = 7
+        self.assertEqual(record['Count__c'], 7)
+        self.assertRaises(KeyError, record.__setitem__, 'Missing__c', 1)
+        self.assertRaises(AttributeError, setattr, record, 'Missing__c', 1)
+        self.assertRaises(KeyError, record.__getitem__, 'Missing__c')
+        self.assertEqual(pickle.loads(pickle.dumps(record)), record)
+        self.assertEqual(type(copy.copy(record)), type(record))
+        self.assertEqual(record.copy(), record)
+
+    def testRecordClasses(self):
+        cls = recordClass('Contact', ['Id', 'LastName'])
+        self.assertTrue(recordClass('Contact', ('Id', 'LastName')) is cls)
+        record = cls(['003', 'Doe'])
+        self.assertEqual(record, {'Id': '003', 'LastName': 'Doe'})
+        self.assertEqual(repr(record),
+                         "ContactRecord({0!r})".format(dict(record)))
+        # names which can't be slots, or would hide the mapping methods
+        self.assertEqual(recordClass('Contact', ['Id', 'get']), None)
+        self.assertEqual(recordClass('Contact', ['Id', 'class']), None)
+        self.assertEqual(recordClass('Contact', ['Id', 'Id']), None)
+
+    def testRecordFactoryAndOnRecord(self):
+        seen = []
+        handler = self.parse(
+            queryResponse([contactXml(n, account=False) for n in range(3)]),
+            recordFactory=dict, onRecord=seen.append)
+        self.assertEqual(handler.records, [])
+        self.assertEqual([r['Count__c'] for r in seen], [0, 1, 2])
+        self.assertEqual([type(r) for r in seen], [dict] * 3)
+
+    def testSearchRecords(self):
+        body = ENVELOPE.format(
+            '<searchResponse><result>' + ''.join(
+                '<searchRecords>{0}</searchRecords>'.format(
+                    sObjectXml('Contact', [('Id', '00300000000000%d' % n)],
+                               tag='record'))
+                for n in range(3)) + '</result></searchResponse>')
+        records = self.parse(body).records
+        self.assertEqual([r.Id for r in records],
+                         ['00300000000000%d' % n for n in range(3)])
+        self.assertTrue(all(isinstance(r, QueryRecord) for r in records))
+
+    def testBase64Files(self):
+        data = [b'', b'\x00\xff', bytes(bytearray(range(256))) * 500]
+        attachments = []
+        for n, d in enumerate(data):
+            text = base64.b64encode(d).decode('ascii')
+            # in lines of 76 characters, as MIME has them
+            text = '\n'.join(text[i:i + 76] for i in range(0, len(text), 76))
+            attachments.append(sObjectXml('Attachment', [
+                ('Id', '00P00000000000%d' % n), ('Name', 'file%d' % n),
+                ('Body', text)], tag='result'))
+        attachments.append(sObjectXml('Attachment', [
+            ('Id', '00P000000000003'), ('Name', 'kept'), ('Body', 'AAEC')],
+            tag='result'))
+        attachments.append(sObjectXml('Attachment', [
+            ('Id', '00P000000000004'), ('Name', 'none'), ('Body', None)],
+            tag='result'))
+        body = ENVELOPE.format('<retrieveResponse>' + ''.join(attachments) +
+                               '</retrieveResponse>').encode('utf-8')
+
+        def base64Files(fname, fields):
+            self.assertEqual(fname, 'Body')
+            if fields['Name'] != 'kept':
+                return BytesIO()
+
+        for backend in xmlparser.availableBackends():
+            handler = RecordHandler(self.describe, base64Files=base64Files)
+            handler.typeDescs.update(self.describe(['Attachment']))
+            xmltramp.parseWith(BytesIO(body), handler, backend)
+            records = handler.records
+            self.assertEqual([r.Body.getvalue() for r in records[:3]], data)
+            self.assertEqual(records[3].Body, 'AAEC')
+            self.assertEqual(records[4].Body, '')
+            self.assertEqual(records[2].Name, 'file2')
+
+    def testBase64Writer(self):
+        out = BytesIO()
+        writer = Base64Writer(out)
+        for piece in ['aGVs', 'bG8', 'gd2\n9y', 'bGQ', '=']:
+            writer.write(piece)
+        writer.close()
+        self.assertEqual(out.getvalue(), b'hello world')
+        self.assertEqual(writer.size, 11)
+        writer.write('aGV')
+        self.assertRaises(binascii.Error, writer.close)
+
+    def testFaults(self):
+        body = ENVELOPE.format(FAULT.format('INVALID_SESSION_ID', 'expired'))
+        self.assertRaises(SessionTimeoutError, self.parse, body)
+        body = ENVELOPE.format(FAULT.format('MALFORMED_QUERY', 'bad'))
+        try:
+            self.parse(body)
+            self.fail('expected a SoapFaultError')
+        except SoapFaultError as e:
+            self.assertEqual(e.faultCode, 'MALFORMED_QUERY')
+            self.assertEqual(e.faultString, 'bad')
+
+
+if __name__ == '__main__':
+    unittest.main()
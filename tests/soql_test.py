@@ -0,0 +1,130 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import datetime
+import unittest
+
+from pyforce.pyclient import Field
+from pyforce.pyclient import SObject
+from pyforce.soql import addCondition
+from pyforce.soql import boundsQuery
+from pyforce.soql import clauses
+from pyforce.soql import exportFields
+from pyforce.soql import literal
+from pyforce.soql import partitionConditions
+from pyforce.soql import selectFields
+from pyforce.soql import selectQuery
+from pyforce.soql import splitRange
+
+
+class TestSoql(unittest.TestCase):
+
+    def testClauses(self):
+        soql = ("SELECT Id, (SELECT Id FROM Contacts WHERE Name = 'from') "
+                "FROM Account WHERE Name LIKE 'a limit%' ORDER BY  Name "
+                "LIMIT 10")
+        self.assertEqual(clauses(soql), [
+            ('select', 'SELECT Id, (SELECT Id FROM Contacts '
+                       "WHERE Name = 'from')"),
+            ('from', 'FROM Account'),
+            ('where', "WHERE Name LIKE 'a limit%'"),
+            ('order by', 'ORDER BY  Name'),
+            ('limit', 'LIMIT 10'),
+        ])
+
+    def testFieldsNamedLikeKeywords(self):
+        soql = ('SELECT Days_Offset__c, My_Limit, Account.Limit__c '
+                'FROM Order_For__c WHERE Account.Offset = 1')
+        self.assertEqual([k for k, text in clauses(soql)],
+                         ['select', 'from', 'where'])
+        self.assertEqual(selectFields(soql),
+                         ['Days_Offset__c', 'My_Limit', 'Account.Limit__c'])
+
+    def testAddCondition(self):
+        self.assertEqual(
+            addCondition('SELECT Id FROM Task', "Id < '00T'"),
+            "SELECT Id FROM Task WHERE Id < '00T'")
+        self.assertEqual(
+            addCondition('select Id from Task where A = 1 or B = 2 '
+                         'with SECURITY_ENFORCED', "Id < '00T'"),
+            "select Id from Task WHERE (A = 1 or B = 2) AND (Id < '00T') "
+            "with SECURITY_ENFORCED")
+
+    def testBoundsQuery(self):
+        self.assertEqual(
+            boundsQuery('SELECT Id, Subject FROM Task WHERE IsClosed = true',
+                        'CreatedDate', descending=True),
+            'SELECT CreatedDate FROM Task WHERE (IsClosed = true) AND '
+            '(CreatedDate != null) ORDER BY CreatedDate DESC LIMIT 1')
+
+    def testSplitIds(self):
+        boundaries = splitRange('00T000000000000AAA', '00T0000000000zzAAA', 4)
+        self.assertEqual(len(boundaries), 3)
+        self.assertEqual(boundaries, sorted(boundaries))
+        self.assertTrue(all(len(b) == 15 for b in boundaries))
+        self.assertTrue('00T000000000000' < boundaries[0])
+        self.assertTrue(boundaries[-1] < '00T0000000000zz')
+        # a range too narrow to split is left alone
+        self.assertEqual(
+            splitRange('00T000000000001AAA', '00T000000000001AAA', 4), [])
+
+    def testSplitDates(self):
+        low = datetime.datetime(2020, 1, 1, 0, 0, 0, 500)
+        high = datetime.datetime(2020, 1, 5)
+        self.assertEqual(splitRange(low, high, 4), [
+            datetime.datetime(2020, 1, 2),
+            datetime.datetime(2020, 1, 3),
+            datetime.datetime(2020, 1, 4),
+        ])
+        self.assertEqual(
+            splitRange(datetime.date(2020, 1, 1), datetime.date(2020, 1, 2), 4),
+            [])
+
+    def testPartitionConditions(self):
+        self.assertEqual(partitionConditions('CreatedDate', []), [])
+        self.assertEqual(
+            partitionConditions('CreatedDate', [
+                datetime.datetime(2020, 1, 2),
+                datetime.datetime(2020, 1, 3),
+            ]),
+            [
+                '(CreatedDate < 2020-01-02T00:00:00Z OR CreatedDate = null)',
+                'CreatedDate >= 2020-01-02T00:00:00Z AND '
+                'CreatedDate < 2020-01-03T00:00:00Z',
+                'CreatedDate >= 2020-01-03T00:00:00Z',
+            ])
+
+    def testDatetimeLiterals(self):
+        class Offset(datetime.tzinfo):
+            def utcoffset(self, dt):
+                return datetime.timedelta(hours=-5)
+
+        self.assertEqual(literal(datetime.datetime(2020, 1, 1, 22, 30)),
+                         '2020-01-01T22:30:00Z')
+        self.assertEqual(
+            literal(datetime.datetime(2020, 1, 1, 22, 30, tzinfo=Offset())),
+            '2020-01-02T03:30:00Z')
+
+    def testSelectQuery(self):
+        fields = dict((n, Field(name=n, type=t)) for n, t in [
+            ('Id', 'id'), ('Body', 'base64'), ('BillingAddress', 'address'),
+            ('BillingCity', 'string')])
+        self.assertEqual(
+            sorted(exportFields(SObject(name='Account', fields=fields))),
+            ['BillingCity', 'Id'])
+        self.assertEqual(selectQuery('Account', ['Id', 'Name']),
+                         'SELECT Id, Name FROM Account')
+        self.assertEqual(
+            selectQuery('Account', ['Id'], where="Name LIKE 'a%'"),
+            "SELECT Id FROM Account WHERE Name LIKE 'a%'")
+
+    def testSelectFields(self):
+        self.assertEqual(
+            selectFields("SELECT Id, Account.Name, (SELECT Id, Name FROM "
+                         "Contacts), COUNT(Id) FROM Account WHERE Name = ','"),
+            ['Id', 'Account.Name', 'COUNT(Id)'])
+        self.assertEqual(selectFields('FROM Account'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,437 @@
+"""
+An in-process stand-in for the Salesforce partner SOAP endpoint, so the
+clients can be exercised without an org or network access.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import gzip
+import json
+import re
+import threading
+
+from six import BytesIO
+from six import text_type
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+from six.moves.urllib.parse import parse_qs
+from six.moves.urllib.parse import urlparse
+
+from pyforce import xmltramp
+from pyforce.xmlclient import _tSoapNS
+
+ORG_ID = '00D000000000001EAA'
+USER_ID = '005000000000001AAA'
+SESSION_ID = ORG_ID + '!AQ0AQFakeSessionId'
+
+ENVELOPE = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<soapenv:Envelope'
+    ' xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"'
+    ' xmlns="urn:partner.soap.sforce.com"'
+    ' xmlns:sf="urn:sobject.partner.soap.sforce.com"'
+    ' xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+    '<soapenv:Body>{0}</soapenv:Body></soapenv:Envelope>'
+)
+
+FAULT = (
+    '<soapenv:Fault><faultcode>sf:{0}</faultcode>'
+    '<faultstring>{1}</faultstring></soapenv:Fault>'
+)
+
+
+def escape(value):
+    return (text_type(value).replace('&', '&amp;')
+            .replace('<', '&lt;').replace('>', '&gt;'))
+
+
+def element(name, value):
+    if value is None:
+        return '<{0} xsi:nil="true"/>'.format(name)
+    if isinstance(value, bool):
+        value = 'true' if value else 'false'
+    return '<{0}>{1}</{0}>'.format(name, escape(value))
+
+
+def sObjectXml(sObjectType, fields, tag='records', prefix=''):
+    """
+    Serialize a record the way the partner API does. fields is a list of
+    (name, value) pairs; values may be nested records, made with
+    sObjectXml(tag=name, prefix='sf:'), or child QueryResults made with
+    queryResultXml(tag=name, prefix='sf:').
+    """
+    out = ['<{0}{1} xsi:type="sf:sObject">'.format(prefix, tag)]
+    out.append(element('sf:type', sObjectType))
+    for name, value in fields:
+        if isinstance(value, RawXml):
+            out.append(value)
+        else:
+            out.append(element('sf:' + name, value))
+    out.append('</{0}{1}>'.format(prefix, tag))
+    return RawXml(''.join(out))
+
+
+def queryResultXml(records, done=True, queryLocator=None, size=None,
+                   tag='result', prefix=''):
+    if size is None:
+        size = len(records)
+    return RawXml(''.join([
+        '<{0}{1} xsi:type="QueryResult">'.format(prefix, tag),
+        element('done', done),
+        element('queryLocator', queryLocator),
+        ''.join(records),
+        element('size', size),
+        '</{0}{1}>'.format(prefix, tag),
+    ]))
+
+
+def fieldXml(name, fieldType, soapType='xsd:string'):
+    return ''.join([
+        '<fields>',
+        element('autoNumber', False),
+        element('byteLength', 0),
+        element('calculated', False),
+        element('createable', True),
+        element('custom', name.endswith('__c')),
+        element('defaultedOnCreate', False),
+        element('digits', 0),
+        element('filterable', True),
+        element('label', name),
+        element('length', 0),
+        element('name', name),
+        element('nameField', name == 'Name'),
+        element('nillable', True),
+        element('precision', 0),
+        element('restrictedPicklist', False),
+        element('scale', 0),
+        element('soapType', soapType),
+        element('type', fieldType),
+        element('updateable', True),
+        '</fields>',
+    ])
+
+
+def describeSObjectXml(name, fields):
+    """fields is a list of (name, type) pairs"""
+    return RawXml(''.join([
+        '<result>',
+        element('activateable', False),
+        element('createable', True),
+        element('custom', False),
+        element('deletable', True),
+        element('deprecatedAndHidden', False),
+        ''.join(fieldXml(f, t) for f, t in fields),
+        element('keyPrefix', '001'),
+        element('label', name),
+        element('labelPlural', name + 's'),
+        element('layoutable', True),
+        element('mergeable', False),
+        element('name', name),
+        element('queryable', True),
+        element('replicateable', True),
+        element('retrieveable', True),
+        element('searchable', True),
+        element('triggerable', True),
+        element('undeletable', True),
+        element('updateable', True),
+        element('urlDetail', 'https://example.com/{ID}'),
+        element('urlEdit', 'https://example.com/{ID}/e'),
+        element('urlNew', 'https://example.com/e'),
+        '</result>',
+    ]))
+
+
+def saveResultXml(recordId, success=True, created=None):
+    out = ['<result>', element('id', recordId), element('success', success)]
+    if not success:
+        out.append(
+            '<errors><message>failed</message>'
+            '<statusCode>FIELD_CUSTOM_VALIDATION_EXCEPTION</statusCode>'
+            '</errors>'
+        )
+    if created is not None:
+        out.append(element('created', created))
+    out.append('</result>')
+    return RawXml(''.join(out))
+
+
+class RawXml(text_type):
+    """Marks a string as already serialized"""
+
+
+def userInfoXml(serverUrl):
+    return ''.join([
+        element('accessibilityMode', False),
+        element('currencySymbol', '$'),
+        element('organizationId', ORG_ID),
+        element('organizationMultiCurrency', False),
+        element('organizationName', 'Fake Org'),
+        element('userDefaultCurrencyIsoCode', 'USD'),
+        element('userEmail', 'jdoe@example.com'),
+        element('userFullName', 'John Doe'),
+        element('userId', USER_ID),
+        element('userLanguage', 'en_US'),
+        element('userLocale', 'en_US'),
+        element('userTimeZone', 'America/Los_Angeles'),
+        element('userUiSkin', 'Theme3'),
+    ])
+
+
+class SoapRequest(object):
+    """A request received by the FakeSalesforce server"""
+
+    def __init__(self, headers, body):
+        self.headers = headers
+        self.body = body
+        self.envelope = xmltramp.parse(body)
+        self.operation = self.envelope[_tSoapNS.Body][0]
+        self.operationName = self.operation._name[1]
+
+
+class FakeSalesforce(object):
+    """
+    Serves canned partner API responses on localhost.
+
+    Register a response per operation name in self.responses, either as a
+    string of the response element's children, a list of those which are
+    served in turn, or a callable taking the SoapRequest. Responses that
+    start with '<soapenv:Fault' are sent as faults. The next cutResponses
+    responses stop halfway through, with the connection closed.
+
+    The Bulk API 2.0 jobs endpoints are served too. Jobs report InProgress
+    for bulkPolls checks before completing, ingest jobs succeed for every
+    uploaded row, and query jobs serve the CSV pages in bulkQueryPages.
+    """
+
+    def __init__(self):
+        self.responses = {}
+        self.requests = []
+        self.connections = 0
+        self.gzipResponses = True
+        self.cutResponses = 0
+        self._lock = threading.Lock()
+        self.server = _ThreadingServer(('127.0.0.1', 0), _makeHandler(self))
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.bulkJobs = {}
+        self.bulkUploads = {}
+        self.bulkPolls = 1
+        self.bulkQueryPages = []
+        self.restRequests = []
+        self.responses['login'] = self._login
+        self.responses['logout'] = ''
+        self.responses['getServerTimestamp'] = (
+            '<result><timestamp>2020-01-01T00:00:00.000Z</timestamp></result>'
+        )
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def baseUrl(self):
+        return 'http://127.0.0.1:{0}'.format(self.server.server_address[1])
+
+    @property
+    def loginUrl(self):
+        return self.baseUrl + '/services/Soap/u/20.0'
+
+    @property
+    def serverUrl(self):
+        return self.baseUrl + '/services/Soap/u/20.0/' + ORG_ID
+
+    def operations(self):
+        return [r.operationName for r in self.requests]
+
+    def _login(self, request):
+        return ''.join([
+            '<result>',
+            element('passwordExpired', False),
+            element('serverUrl', self.serverUrl),
+            element('sessionId', SESSION_ID),
+            element('userId', USER_ID),
+            '<userInfo>', userInfoXml(self.serverUrl), '</userInfo>',
+            '</result>',
+        ])
+
+    def respond(self, request):
+        with self._lock:
+            self.requests.append(request)
+            response = self.responses[request.operationName]
+            if isinstance(response, list):
+                response = response.pop(0)
+        if callable(response):
+            response = response(request)
+        if response.startswith('<soapenv:Fault'):
+            body = response
+        else:
+            body = '<{0}Response>{1}</{0}Response>'.format(
+                request.operationName, response)
+        return ENVELOPE.format(body).encode('utf-8')
+
+    def respondRest(self, method, url, headers, body):
+        """Returns the (status, content type, body, headers) of a response"""
+        parsed = urlparse(url)
+        with self._lock:
+            self.restRequests.append((method, parsed.path))
+        if headers.get('Authorization') != 'Bearer ' + SESSION_ID:
+            return _jsonResponse(401, [{
+                'errorCode': 'INVALID_SESSION_ID',
+                'message': 'Session expired or invalid',
+            }])
+        match = re.match(
+            r'/services/data/v[0-9.]+/jobs/(ingest|query)/?([^/]*)/?([^/]*)',
+            parsed.path)
+        if not match:
+            return _jsonResponse(404, [{
+                'errorCode': 'NOT_FOUND',
+                'message': 'The requested resource does not exist',
+            }])
+        kind, jobId, resource = match.groups()
+        if method == 'POST' and not jobId:
+            return self._createJob(kind, json.loads(body.decode('utf-8')))
+        job = self.bulkJobs.get(jobId)
+        if job is None:
+            return _jsonResponse(404, [{
+                'errorCode': 'NOT_FOUND',
+                'message': 'Unknown job ' + jobId,
+            }])
+        if method == 'PUT' and resource == 'batches':
+            self.bulkUploads[jobId] = body
+            return 201, 'text/plain', b'', {}
+        if method == 'PATCH':
+            job['state'] = json.loads(body.decode('utf-8'))['state']
+            return _jsonResponse(200, job)
+        if method == 'DELETE':
+            del self.bulkJobs[jobId]
+            return 204, 'text/plain', b'', {}
+        if resource == 'successfulResults':
+            rows = self.bulkUploads[jobId].decode('utf-8').splitlines()
+            csv = ['"sf__Id","sf__Created",' + rows[0]]
+            for n, row in enumerate(rows[1:]):
+                csv.append('"001%015d","true",%s' % (n, row))
+            return 200, 'text/csv', '\n'.join(csv).encode('utf-8'), {}
+        if resource in ('failedResults', 'unprocessedrecords'):
+            rows = self.bulkUploads[jobId].decode('utf-8').splitlines()
+            return 200, 'text/csv', rows[0].encode('utf-8'), {}
+        if resource == 'results':
+            query = parse_qs(parsed.query)
+            page = int(query.get('locator', ['0'])[0])
+            last = page + 1 >= len(self.bulkQueryPages)
+            return 200, 'text/csv', self.bulkQueryPages[page].encode('utf-8'), {
+                'Sforce-Locator': 'null' if last else str(page + 1),
+            }
+        return _jsonResponse(200, self._pollJob(job))
+
+    def _createJob(self, kind, request):
+        with self._lock:
+            jobId = '750%015d' % (len(self.bulkJobs) + 1)
+        job = dict(request, id=jobId, polls=0,
+                   state='Open' if kind == 'ingest' else 'UploadComplete')
+        self.bulkJobs[jobId] = job
+        return _jsonResponse(200, job)
+
+    def _pollJob(self, job):
+        if job['state'] in ('UploadComplete', 'InProgress'):
+            job['polls'] += 1
+            if job['polls'] > self.bulkPolls:
+                job['state'] = 'JobComplete'
+                rows = self.bulkUploads.get(job['id'], b'').count(b'\n')
+                job['numberRecordsProcessed'] = max(rows - 1, 0)
+                job['numberRecordsFailed'] = 0
+            else:
+                job['state'] = 'InProgress'
+        return job
+
+
+def _jsonResponse(status, body):
+    return status, 'application/json', json.dumps(body).encode('utf-8'), {}
+
+
+class _ThreadingServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def _makeHandler(fake):
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+            with fake._lock:
+                fake.connections += 1
+
+        def log_message(self, *args):
+            pass
+
+        def readBody(self):
+            if self.headers.get('transfer-encoding', '') == 'chunked':
+                chunks = []
+                while True:
+                    size = int(self.rfile.readline().strip(), 16)
+                    chunk = self.rfile.read(size)
+                    self.rfile.readline()
+                    if not size:
+                        break
+                    chunks.append(chunk)
+                body = b''.join(chunks)
+            else:
+                body = self.rfile.read(int(self.headers['content-length']))
+            if self.headers.get('content-encoding', '') == 'gzip':
+                body = gzip.GzipFile(fileobj=BytesIO(body)).read()
+            return body
+
+        def do_POST(self):
+            path = urlparse(self.path).path
+            if path.startswith('/services/data/'):
+                self.doRest()
+                return
+            if not path.startswith('/services/Soap/'):
+                self.send_error(404)
+                return
+            request = SoapRequest(dict(self.headers.items()), self.readBody())
+            body = fake.respond(request)
+            status = 500 if b'<soapenv:Fault>' in body else 200
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/xml; charset=utf-8')
+            accept = self.headers.get('accept-encoding', '')
+            if fake.gzipResponses and 'gzip' in accept:
+                buf = BytesIO()
+                with gzip.GzipFile(mode='wb', fileobj=buf) as gz:
+                    gz.write(body)
+                body = buf.getvalue()
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            with fake._lock:
+                cut = fake.cutResponses > 0
+                if cut:
+                    fake.cutResponses -= 1
+            if cut:
+                self.wfile.write(body[:len(body) // 2])
+                self.close_connection = True
+                return
+            self.wfile.write(body)
+
+        def doRest(self):
+            body = b''
+            if ('content-length' in self.headers or
+                    'transfer-encoding' in self.headers):
+                body = self.readBody()
+            status, contentType, body, headers = fake.respondRest(
+                self.command, self.path, dict(self.headers.items()), body)
+            self.send_response(status)
+            self.send_header('Content-Type', contentType)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = do_PUT = do_PATCH = do_DELETE = doRest
+
+    return Handler
@@ -3,10 +3,17 @@ from __future__ import unicode_literals
 
 import datetime
 import os
+import gzip
 import unittest
 from time import sleep
 
+import mock
+import requests
+from six import BytesIO
+
 import pyforce
+from pyforce import xmlclient
+from pyforce.compression import CompressionPolicy
 
 partnerns = pyforce.pyclient._tPartnerNS
 sobjectns = pyforce.pyclient._tSObjectNS
@@ -227,9 +234,118 @@ class TestBeatbox(unittest.TestCase):
         )
 
 
+RETRIEVE_ENVELOPE = (
+    '<?xml version="1.0" encoding="utf-8"?>\n'
+    '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" '
+    'xmlns:p="urn:partner.soap.sforce.com" '
+    'xmlns:o="urn:sobject.partner.soap.sforce.com" '
+    'xmlns:x="http://www.w3.org/2001/XMLSchema-instance"><s:Header>\n'
+    '<p:CallOptions><p:client>Pyforce/1.4</p:client></p:CallOptions>\n'
+    '<p:SessionHeader><p:sessionId>{0}</p:sessionId></p:SessionHeader>'
+    '</s:Header><s:Body>\n'
+    '<p:retrieve><p:fieldList>Id</p:fieldList>'
+    '<p:sObjectType>Account</p:sObjectType><p:ids>001</p:ids>'
+    '<p:ids>002&amp;</p:ids></p:retrieve></s:Body></s:Envelope>'
+)
+
+
+class TestSoapEnvelope(unittest.TestCase):
+
+    def retrieve(self, sessionId='SESSION'):
+        return xmlclient.RetrieveRequest(SERVER_URL, sessionId, ['Id'],
+                                         'Account', ['001', '002&'])
+
+    def testTemplates(self):
+        envelope = self.retrieve().makeEnvelope()
+        self.assertEqual(envelope.decode('utf-8'),
+                         RETRIEVE_ENVELOPE.format('SESSION'))
+        envelope, compressed = self.retrieve('OTHER').makeBody(
+            CompressionPolicy(threshold=0))
+        self.assertTrue(compressed)
+        self.assertEqual(
+            gzip.GzipFile(fileobj=BytesIO(envelope)).read().decode('utf-8'),
+            RETRIEVE_ENVELOPE.format('OTHER'))
+
+        # templates are shared by requests with the same headers
+        self.assertTrue(self.retrieve().template() is
+                        self.retrieve().template())
+        self.assertFalse(self.retrieve().template() is
+                         self.retrieve('OTHER').template())
+        query = xmlclient.QueryRequest(SERVER_URL, 'SESSION', 200, 'SOQL')
+        self.assertEqual(query.headerKey(), ('SESSION', 200))
+        self.assertFalse(query.template() is self.retrieve().template())
+
+    def testSObjects(self):
+        sObjects = [
+            {'type': 'Contact', 'LastName': 'D\xe9 & <Co>',
+             'Birthdate': datetime.date(1970, 1, 2), 'Age__c': 3,
+             'Fruit__c': ['Apple', 'Pear'], 'Title': None,
+             'Account': {'Name': 'Acme', 'type': 'Account'}},
+            {'type': 'Lead', 'Company': b'caf\xc3\xa9'},
+        ]
+        request = xmlclient.CreateRequest(SERVER_URL, 'SESSION', sObjects)
+        envelope = request.makeEnvelope().decode('utf-8')
+        body = envelope[envelope.index('<p:create>'):]
+        self.assertEqual(body, (
+            '<p:create><p:sObjects><o:type>Contact</o:type>'
+            '<o:LastName>D\xe9 &amp; &lt;Co&gt;</o:LastName>'
+            '<o:Birthdate>1970-01-02</o:Birthdate><o:Age__c>3</o:Age__c>'
+            '<o:Fruit__c>Apple</o:Fruit__c><o:Fruit__c>Pear</o:Fruit__c>'
+            '<o:Title></o:Title><o:Account><o:type>Account</o:type>'
+            '<o:Name>Acme</o:Name></o:Account></p:sObjects>'
+            '<p:sObjects><o:type>Lead</o:type>'
+            '<o:Company>caf\xe9</o:Company></p:sObjects>'
+            '</p:create></s:Body></s:Envelope>'))
+        self.assertEqual(sObjects[0]['Account'],
+                         {'Name': 'Acme', 'type': 'Account'})
+
+    def testStreamedEnvelope(self):
+        sObjects = [{'type': 'Account', 'Name': 'Account %d' % n}
+                    for n in range(100)]
+        request = xmlclient.UpsertRequest(SERVER_URL, 'SESSION', 'Ext__c',
+                                          sObjects)
+        with mock.patch.object(xmlclient, 'STREAM_CHUNK_SIZE', 512):
+            chunks = list(request.iterEnvelope())
+            self.assertTrue(len(chunks) > 5)
+            self.assertTrue(all(chunks))
+            self.assertEqual(b''.join(chunks), request.makeEnvelope())
+
+            policy = CompressionPolicy()
+            body = b''.join(request.iterEnvelope(policy))
+        self.assertEqual(gzip.GzipFile(fileobj=BytesIO(body)).read(),
+                         request.makeEnvelope())
+        stats = policy.stats()
+        self.assertEqual((stats['requests'], stats['compressed']), (1, 1))
+        self.assertEqual(stats['bytesOut'], len(body))
+
+    def testTemplateLimit(self):
+        with mock.patch.object(xmlclient, 'MAX_TEMPLATES', 2):
+            for n in range(4):
+                self.retrieve('SESSION%d' % n).template()
+            self.assertTrue(len(xmlclient._templates) <= 2)
+
+    def testRetriesReuseEnvelope(self):
+        request = self.retrieve()
+        response = mock.Mock()
+        response.raw = BytesIO(
+            b'<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">'
+            b'<s:Body><retrieveResponse><result>1</result></retrieveResponse>'
+            b'</s:Body></s:Envelope>')
+        conn = mock.Mock()
+        conn.post.side_effect = [requests.exceptions.ConnectionError(),
+                                 response]
+        with mock.patch.object(request, 'makeEnvelope',
+                               wraps=request.makeEnvelope) as makeEnvelope:
+            self.assertEqual(str(request.post(conn)), '1')
+        self.assertEqual(makeEnvelope.call_count, 1)
+        first, second = conn.post.call_args_list
+        self.assertTrue(first[1]['data'] is second[1]['data'])
+
+
 def test_suite():
     return unittest.TestSuite((
         unittest.makeSuite(TestBeatbox),
+        unittest.makeSuite(TestSoapEnvelope),
     ))
 
 
@@ -0,0 +1,98 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import unittest
+from xml.sax import SAXParseException
+
+import mock
+from defusedxml import DefusedXmlException
+from six import BytesIO
+from six import StringIO
+
+from pyforce import xmlparser
+from pyforce import xmltramp
+from pyforce.records import RecordHandler
+from tests.records_test import contactXml
+from tests.records_test import queryResponse
+from tests.records_test import TYPES
+
+DOCUMENT = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<doc xmlns="urn:a" xmlns:b="urn:b" b:attr="1">'
+    'some &amp; <b:child>text \xe9</b:child> more'
+    '<b:empty/>  <inner xmlns:c="urn:c" plain="2">'
+    '<c:deep>x</c:deep></inner></doc>'
+)
+
+ENTITIES = (
+    '<?xml version="1.0"?><!DOCTYPE doc [<!ENTITY a "aaaa">'
+    '<!ENTITY b "&a;&a;&a;&a;">]><doc>&b;</doc>'
+)
+
+EXTERNAL = (
+    '<?xml version="1.0"?><!DOCTYPE doc [<!ENTITY e SYSTEM '
+    '"file:///etc/passwd">]><doc>&e;</doc>'
+)
+
+
+class TestParserBackends(unittest.TestCase):
+    def setUp(self):
+        self.backends = xmlparser.availableBackends()
+
+    def tearDown(self):
+        xmlparser.setDefaultBackend(None)
+
+    def testSameTrees(self):
+        expected = xmltramp.parse(DOCUMENT, backend='sax').__repr__(1, 1)
+        for backend in self.backends:
+            for source in (DOCUMENT, DOCUMENT.encode('utf-8'),
+                           BytesIO(DOCUMENT.encode('utf-8')),
+                           StringIO(DOCUMENT)):
+                tree = xmltramp.seed(source, backend=backend)
+                self.assertEqual(tree.__repr__(1, 1), expected, backend)
+        tree = xmltramp.parse(DOCUMENT)
+        self.assertEqual(tree[('urn:b', 'child')][0], 'text \xe9')
+        self.assertEqual(tree(('urn:b', 'attr')), '1')
+        self.assertEqual(tree.inner('plain'), '2')
+
+    def testSameRecords(self):
+        body = queryResponse([contactXml(n, account=n % 2 == 0)
+                              for n in range(5)]).encode('utf-8')
+        results = []
+        for backend in self.backends:
+            handler = RecordHandler(lambda types: dict(
+                (t, TYPES[t]) for t in types))
+            # small reads, so values are split across chunks
+            with mock.patch.object(xmlparser, 'CHUNK_SIZE', 7):
+                xmltramp.parseWith(BytesIO(body), handler, backend)
+            results.append(handler.queryResult())
+        for result in results:
+            self.assertEqual(result, results[0])
+        self.assertEqual(len(results[0]), 5)
+
+    def testEntitiesForbidden(self):
+        for backend in self.backends:
+            for doc in (ENTITIES, EXTERNAL):
+                self.assertRaises(DefusedXmlException, xmltramp.parse,
+                                  doc.encode('utf-8'), backend)
+
+    def testMalformed(self):
+        for backend in self.backends:
+            self.assertRaises(SAXParseException, xmltramp.parse,
+                              b'<doc><a></doc>', backend)
+
+    def testChoosingBackends(self):
+        self.assertEqual(self.backends[0], 'expat')
+        self.assertEqual(xmlparser.getBackend().name, self.backends[0])
+        xmlparser.setDefaultBackend('sax')
+        self.assertEqual(xmlparser.getBackend().name, 'sax')
+        xmlparser.setDefaultBackend(None)
+        self.assertEqual(xmlparser.getBackend().name, self.backends[0])
+        self.assertRaises(ValueError, xmlparser.getBackend, 'nope')
+        with mock.patch.object(xmlparser, 'etree', None):
+            self.assertNotIn('lxml', xmlparser.availableBackends())
+            self.assertRaises(ValueError, xmlparser.getBackend, 'lxml')
+
+
+if __name__ == '__main__':
+    unittest.main()